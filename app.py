@@ -1,28 +1,45 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import os
+import sys
 import bcrypt
 import qrcode
 from io import BytesIO
+from urllib.parse import urlencode
 from datetime import date
-import re
 import uuid
 import time
-import hashlib
+import json
+import logging
+import cProfile
+import pstats
+import tracemalloc
+import threading
+import storage
+import reports
+import scheduler
+import backup
+import joblib
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_autorefresh import st_autorefresh
-# ---------------- TEXT NORMALIZATION ----------------
-def normalize_username(text):
-    return text.strip().lower()
-
-def normalize_roll(text):
-    return text.strip().upper()
-
-def normalize_name(text):
-    return text.strip().title()
-def normalize_title(text):
-    return text.strip().title()
-
+from core import (
+    USER_FILE, MARKS_FILE, ASSIGN_FILE, SLIP_FILE, GRADE_CONFIG_FILE, ROSTER_FILE,
+    ATT_FILE, SESSIONS_FILE, SHARD_DIR, ATT_COLUMNS,
+    normalize_username, normalize_roll, normalize_name, normalize_title,
+    QR_EXPIRY, current_slot, generate_token, token_slot,
+    ROLL_PATTERN, is_valid_roll, shard_file, REPLAY_SLOTS, scan_check, scan_row,
+    live_scans_file, write_live_scan, scan_event, get_working_days, attendance_summary,
+    GRADE_COMPONENTS, GRADE_CONFIG_COLUMNS, DEFAULT_WEIGHTS, DEFAULT_BANDS, ALL_SUBJECTS,
+    clean_rolls, parse_bands, attendance_percentages, component_scores, entry_problem
+)
+import core
+# ---------------- DEVICE ID ----------------
 def get_device_id():
     if "device_id" not in st.session_state:
         # Check if device_id already exists in URL
@@ -37,32 +54,6 @@ def get_device_id():
             st.query_params["device_id"] = new_id
 
     return st.session_state.device_id
-def generate_token():
-    current_slot = int(time.time() // QR_EXPIRY)
-    raw = f"{SECRET_KEY}-{current_slot}"
-    return hashlib.sha256(raw.encode()).hexdigest()
-SECRET_KEY = "smart_teacher_secret"
-QR_EXPIRY = 20
-
-
-
-# ✅ ADD HERE
-def is_valid_token(token):
-    current_slot = int(time.time() // QR_EXPIRY)
-
-    for offset in [0, -1]:
-        raw = f"{SECRET_KEY}-{current_slot + offset}"
-        valid = hashlib.sha256(raw.encode()).hexdigest()
-
-        if token == valid:
-            return True
-
-    return False
-
-# ---------------- ROLL VALIDATION ----------------
-def is_valid_roll(roll):
-    pattern = r"^\d{5}-[A-Za-z]{3}-\d{3}$"
-    return re.match(pattern, roll)
 # ---------------- PAGE CONFIG ----------------
 st.set_page_config(page_title="Smart Teacher Assistant", layout="wide")
 
@@ -177,34 +168,441 @@ section[data-testid="stSidebar"] div[role="radiogroup"] > label:hover {
 """, unsafe_allow_html=True)
 
 # ---------------- FILES ----------------
-USER_FILE = "users.csv"
-ATT_FILE = "attendance.csv"
-MARKS_FILE = "marks.csv"
-ASSIGN_FILE = "assignments.csv"
-SLIP_FILE = "slip_tests.csv"
+RISK_MODEL_FILE = "risk_model.joblib"
+SKETCH_FILE = "mark_sketches.csv"
+# storage.content_version of marks.csv the sketches were built from
+SKETCH_VERSION_FILE = "mark_sketches.version"
+# The data files and grade settings come from core (shared with the scan service and the CLI)
+
+# Features of the at-risk model and the rule used to label training rows
+RISK_FEATURES = ["Attendance", "Marks_Avg", "Marks_Trend", "SlipTest_Avg", "Assignment_Completion"]
+RISK_PASS_MARK = 35
+RISK_MIN_ATTENDANCE = 50
+RISK_NOTE = (
+    f"Risk_% is a model fitted to a rule (attendance below {RISK_MIN_ATTENDANCE}% or average mark below "
+    f"{RISK_PASS_MARK}), not to past outcomes, so it restates that rule rather than predicting results"
+)
+
+# Marks are whole numbers 0-100, so one bucket per mark is an exact, mergeable sketch
+SKETCH_BINS = 101
+SKETCH_COLUMNS = [f"B{i}" for i in range(SKETCH_BINS)]
+PERCENTILES = [10, 25, 50, 75, 90]
 
 
 # ---------------- CREATE FILES ----------------
-if not os.path.exists(USER_FILE):
-    pd.DataFrame(columns=["Username", "Password"]).to_csv(USER_FILE, index=False)
+core.create_files()
+
+# Replay any unflushed journal records, then start the background flusher
+try:
+    storage.start()
+except RuntimeError as e:
+    st.error(f"❌ {e}")
+    st.stop()
+
+
+
+# ---------------- METRICS ----------------
+# Opt-in: METRICS_ENABLED=1 streamlit run app.py
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+METRICS_FILE = "metrics.log"
+ADMIN_USERS = {u.strip() for u in os.environ.get("ADMIN_USERS", "").split(",") if u.strip()}
+METRIC_COUNTERS = [
+    "csv_reads", "csv_read_bytes", "csv_writes", "csv_write_bytes",
+    "journal_writes", "journal_write_bytes", "rows_scanned", "cache_hits", "cache_misses",
+    "snapshot_hits", "snapshot_shared_bytes"
+]
+
+
+def is_admin():
+    return st.session_state.get("user") in ADMIN_USERS
+
+
+@st.cache_resource
+def metrics_logger():
+    # One rotating JSON-lines file per server process
+    logger = logging.getLogger("smart_teacher.metrics")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(RotatingFileHandler(METRICS_FILE, maxBytes=1_000_000, backupCount=5))
+    return logger
+
+
+def session_metrics():
+    if "metrics" not in st.session_state:
+        st.session_state.metrics = {
+            "reruns": 0,
+            "totals": dict.fromkeys(METRIC_COUNTERS, 0),
+            "sections": {},
+            "snapshots": set()
+        }
+
+    return st.session_state.metrics
+
+
+def record(counter, amount=1):
+    # Only count work done inside a user's script run
+    if METRICS_ENABLED and get_script_run_ctx() is not None:
+        session_metrics()["totals"][counter] += amount
+
+
+@contextmanager
+def timed_section(name):
+    if not METRICS_ENABLED:
+        yield
+        return
+
+    metrics = session_metrics()
+    before = dict(metrics["totals"])
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        entry = {c: metrics["totals"][c] - before[c] for c in METRIC_COUNTERS}
+        entry["wall_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        metrics["sections"][name] = entry
+
+        metrics_logger().info(json.dumps({
+            "ts": round(time.time(), 3),
+            "session": get_script_run_ctx().session_id,
+            "user": st.session_state.get("user", ""),
+            "section": name,
+            "rerun": metrics["reruns"],
+            **entry
+        }))
+
+
+@st.cache_resource
+def snapshot_store():
+    # (path, read options) -> latest parsed frame, shared read-only by every session
+    return {"lock": threading.Lock(), "frames": {}}
+
+
+def read_csv(path, **kwargs):
+    key = (path, repr(sorted(kwargs.items())))
+    version = storage.file_version(path)
+    store = snapshot_store()
+
+    with store["lock"]:
+        snap = store["frames"].get(key)
+
+    if snap is None or snap["version"] != version:
+        df = storage.read(path, **kwargs)
+        snap = {
+            "version": version,
+            "df": df,
+            "rows": len(df),
+            "bytes": int(df.memory_usage(deep=True).sum()),
+            "hits": 0
+        }
+
+        with store["lock"]:
+            store["frames"][key] = snap
+
+        record("csv_reads")
+        record("csv_read_bytes", os.path.getsize(path) if os.path.exists(path) else 0)
+        record("rows_scanned", len(df))
+    else:
+        record("snapshot_hits")
+
+    snap["hits"] += 1
+    record("snapshot_shared_bytes", snap["bytes"])
+
+    if METRICS_ENABLED and get_script_run_ctx() is not None:
+        session_metrics()["snapshots"].add(key)
+
+    # Shallow copy: pandas copy-on-write copies a column only if this caller changes it.
+    # Copy-on-write is always on from pandas 3, hence pandas>=3 in requirements.txt
+    return snap["df"].copy(deep=False)
+
+
+def write_csv(df, path):
+    storage.rewrite(path, df)
+
+    record("csv_writes")
+    record("csv_write_bytes", os.path.getsize(path))
+
+
+# Record saves go to the write-ahead journal and return immediately
+def save_record(path, row):
+    record("journal_writes")
+    record("journal_write_bytes", storage.append(path, row))
+
+
+def save_record_if(path, row, check, **kwargs):
+    # check(current rows) returns a problem to report, or None to save
+    problem = storage.append_if(path, row, check, **kwargs)
+
+    if problem is None:
+        record("journal_writes")
+
+    return problem
+
+
+def update_record(path, keys, row, update=None):
+    record("journal_writes")
+    record("journal_write_bytes", storage.upsert(path, keys, row, update))
+
+
+def save_unique_record(path, keys, row, update):
+    # Dedupe index on `keys` (see core.save_unique): "saved", "updated" or "unchanged"
+    outcome = core.save_unique(path, keys, row, update, read_csv)
+
+    if outcome != "unchanged":
+        record("journal_writes")
+
+    return outcome
+
+
+@contextmanager
+def tracked_write(path, teacher, rows=None, lock=storage.exclusive):
+    # The write inside this block saves to `path` for `teacher`. The caches kept on the write path
+    # take it from here instead of rereading the file: the department rollup marks the teacher
+    # changed, and attendance `rows` go straight into the attendance index.
+    # lock=storage.rewriting when the block also rewrites a file
+    with lock():
+        before = storage.content_version(path)
+        yield
+        after = storage.content_version(path)
+
+    # Outside the storage lock: both caches read storage while holding their own lock
+    if rows is not None:
+        attendance_index((path, rows, before, after))
+    rollup_written(path, teacher, before, after)
+
+
+def form_nonce(form):
+    # Issued when the form renders; replaced after every save, so the next submission gets a new one
+    return st.session_state.setdefault("form_nonces", {}).setdefault(form, uuid.uuid4().hex)
+
+
+def submit_once(form, nonce, path, keys, row, update):
+    # A nonce is spent by its first save; identical values sent again are left to the dedupe index
+    done = st.session_state.setdefault("submissions", set())
+
+    if nonce in done:
+        return "repeat"
+
+    outcome = save_unique_record(path, keys, row, update)
+
+    if outcome != "unchanged":
+        done.add(nonce)
+        st.session_state["form_nonces"][form] = uuid.uuid4().hex
 
-if not os.path.exists(ATT_FILE):
-    pd.DataFrame(
-        columns=["Username", "Roll", "Name", "Date", "Status", "DeviceID", "Token"]
-    ).to_csv(ATT_FILE, index=False)
+    return outcome
 
 
-if not os.path.exists(MARKS_FILE):
-    pd.DataFrame(columns=["Username", "Roll", "Name", "Subject", "Marks"]).to_csv(MARKS_FILE, index=False)
+def submit_message(outcome, saved, updated):
+    if outcome == "saved":
+        st.success(saved)
+    elif outcome == "updated":
+        st.success(updated)
+    elif outcome == "unchanged":
+        st.info("ℹ️ Already saved with the same details. Nothing changed")
+    else:
+        st.info("ℹ️ Already submitted")
+
+
+def object_bytes(obj, seen=None):
+    # Rough deep size; DataFrames counted by their own memory report
+    seen = set() if seen is None else seen
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(object_bytes(k, seen) + object_bytes(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(object_bytes(v, seen) for v in obj)
+
+    return sys.getsizeof(obj)
+
+
+def memory_panel():
+    store = snapshot_store()
+
+    with store["lock"]:
+        snaps = dict(store["frames"])
+
+    read = session_metrics()["snapshots"]
+
+    # Before: each session parsed its own copy of every file it read; after: only session state is private
+    before = sum(snap["bytes"] for key, snap in snaps.items() if key in read)
+    after = object_bytes({k: v for k, v in st.session_state.items()})
+
+    st.markdown("**🧠 Memory (per session)**")
+
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Before (KB)", round(before / 1024, 1))
+    c2.metric("After (KB)", round(after / 1024, 1))
+    c3.metric("Shared (KB)", round(sum(s["bytes"] for s in snaps.values()) / 1024, 1))
+
+    st.dataframe(pd.DataFrame([
+        {"File": key[0], "Options": key[1], "Rows": s["rows"], "KB": round(s["bytes"] / 1024, 1), "Reads": s["hits"]}
+        for key, s in snaps.items()
+    ]))
+
+
+def metrics_panel():
+    metrics = session_metrics()
+
+    with st.sidebar.expander("📈 Performance Metrics"):
+        st.metric("Reruns (this session)", metrics["reruns"])
+
+        if len(metrics["sections"]) > 0:
+            st.dataframe(pd.DataFrame(metrics["sections"]).T)
+
+        st.dataframe(pd.Series(metrics["totals"], name="Session Total"))
+        st.caption(f"Also written to {METRICS_FILE}")
+
+        memory_panel()
+
+        admission_panel()
+
+
+# ---------------- PROFILER ----------------
+PROFILE_DIR = "profiles"
+PROFILED_PAGES = ["Attendance", "Analytics", "Student Attendance"]
+
+
+@st.cache_resource
+def profiler_settings():
+    # Shared by all sessions so an admin can profile student scans too.
+    # tracemalloc is process wide: "tracing" counts the runs using it, "started" whether we turned it on
+    return {"pages": set(), "sessions": set(), "lock": threading.Lock(), "tracing": 0, "started": False}
+
+
+def should_profile(name):
+    ctx = get_script_run_ctx()
+
+    if name not in PROFILED_PAGES or ctx is None:
+        return False
+
+    settings = profiler_settings()
+    return name in settings["pages"] or ctx.session_id in settings["sessions"]
 
-if not os.path.exists(ASSIGN_FILE):
-    pd.DataFrame(columns=["Username", "Roll", "Name", "Assignment", "File"]).to_csv(ASSIGN_FILE, index=False)
-if not os.path.exists(SLIP_FILE):
-    pd.DataFrame(
-        columns=["Username","Roll","Name","SlipTest","File","Marks"]
-    ).to_csv(SLIP_FILE, index=False)
+
+@contextmanager
+def profiled(name):
+    if not should_profile(name):
+        yield
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    settings = profiler_settings()
+
+    # Overlapping runs share tracemalloc; the last one out stops it, unless someone else started it
+    with settings["lock"]:
+        if settings["tracing"] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            settings["started"] = True
+        settings["tracing"] += 1
+
+    # Python 3.12+ allows one active cProfile at a time; an overlapping run gets only the memory snapshot
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        profile = None
+
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+
+        with settings["lock"]:
+            snapshot = tracemalloc.take_snapshot()
+            settings["tracing"] -= 1
+
+            if settings["tracing"] == 0 and settings["started"]:
+                tracemalloc.stop()
+                settings["started"] = False
+
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(
+            PROFILE_DIR,
+            f"{stamp}_{name.replace(' ', '_')}_{get_script_run_ctx().session_id[:8]}"
+        )
+
+        if profile is not None:
+            profile.dump_stats(base + ".prof")
+        snapshot.dump(base + ".snap")
+
+
+def top_functions(path, limit=15):
+    stats = pstats.Stats(path)
+
+    rows = [
+        {
+            "Function": f"{func} ({os.path.basename(file)}:{line})",
+            "Calls": calls,
+            "Own_s": round(own, 4),
+            "Cumulative_s": round(cumulative, 4)
+        }
+        for (file, line, func), (_, calls, own, cumulative, _) in stats.stats.items()
+    ]
+
+    return pd.DataFrame(rows).nlargest(limit, "Cumulative_s")
 
 
+def top_allocations(path, limit=15):
+    snapshot = tracemalloc.Snapshot.load(path)
+
+    return pd.DataFrame([
+        {"Location": str(stat.traceback[0]), "Blocks": stat.count, "KiB": round(stat.size / 1024, 1)}
+        for stat in snapshot.statistics("lineno")[:limit]
+    ])
+
+
+def set_profiled_pages():
+    profiler_settings()["pages"] = set(st.session_state["prof_pages"])
+
+
+def profiler_panel():
+    settings = profiler_settings()
+    session_id = get_script_run_ctx().session_id
+
+    with st.sidebar.expander("🧪 Profiler"):
+        mine = st.checkbox("Profile my session", session_id in settings["sessions"], key="prof_session")
+
+        if mine:
+            settings["sessions"].add(session_id)
+        else:
+            settings["sessions"].discard(session_id)
+
+        # Shared by every admin: show the current setting, and change it only when this one is edited
+        st.session_state["prof_pages"] = sorted(settings["pages"])
+        st.multiselect("Profile page for everyone", PROFILED_PAGES, key="prof_pages", on_change=set_profiled_pages)
+
+        if not os.path.isdir(PROFILE_DIR):
+            return
+
+        runs = sorted(
+            (f[:-5] for f in os.listdir(PROFILE_DIR) if f.endswith(".prof")), reverse=True
+        )
+
+        if len(runs) == 0:
+            return
+
+        run = st.selectbox("Captured run", runs, key="prof_run")
+
+    st.subheader(f"🧪 Profile: {run}")
+    st.write("Top functions by cumulative time")
+    st.dataframe(top_functions(os.path.join(PROFILE_DIR, run + ".prof")))
+
+    snap = os.path.join(PROFILE_DIR, run + ".snap")
+
+    if os.path.exists(snap):
+        st.write("Top allocation sites")
+        st.dataframe(top_allocations(snap))
+
 
 # ---------------- PASSWORD ----------------
 def hash_pass(p):
@@ -233,15 +631,16 @@ def signup():
             st.error("Passwords not match")
             return
 
-        df = pd.read_csv(USER_FILE)
+        problem = save_record_if(
+            USER_FILE,
+            {"Username": user, "Password": hash_pass(pwd)},
+            lambda users: "User Exists" if user in users["Username"].values else None
+        )
 
-        if user in df["Username"].values:
-            st.warning("User Exists")
+        if problem is not None:
+            st.warning(problem)
             return
 
-        df.loc[len(df)] = [user, hash_pass(pwd)]
-        df.to_csv(USER_FILE, index=False)
-
         st.success("Account Created! Login Now")
 
     st.markdown('</div>', unsafe_allow_html=True)
@@ -260,7 +659,7 @@ def login():
 
     if st.button("Login", key="login_btn"):
 
-        df = pd.read_csv(USER_FILE)
+        df = read_csv(USER_FILE)
 
         if user not in df["Username"].values:
             st.error("User Not Found")
@@ -281,26 +680,518 @@ def login():
 
     st.markdown('</div>', unsafe_allow_html=True)
 
-from datetime import timedelta
+# ---------------- GRADING ENGINE ----------------
+# The engine lives in core; these read through the shared snapshots and record metrics
+def load_grade_config():
+    return core.load_grade_config(read_csv)
+
+
+def compute_final_grades(teachers=None):
+    result, changed = core.compute_final_grades(teachers, read_csv, lambda path, df: write_csv(df, path))
+
+    record("cache_hits", len(result) - changed)
+    record("cache_misses", changed)
+
+    return result, changed
+
+
+def save_grade_config(user, subject, weights, bands):
+    row = pd.DataFrame([[user, subject] + [weights[c] for c in GRADE_COMPONENTS] + [bands]],
+                       columns=GRADE_CONFIG_COLUMNS)
+
+    def replace_row(config):
+        config = config[~((config["Username"] == user) & (config["Subject"] == subject))]
+        return pd.concat([config, row], ignore_index=True)
+
+    # Read-modify-write under the storage lock, so two sessions saving at once both land
+    storage.transform(GRADE_CONFIG_FILE, replace_row)
+    record("csv_writes")
+
+# ---------------- AT-RISK PREDICTION ----------------
+def data_signature(*paths):
+    # Also changes when another worker writes, or when journal records are pending
+    return storage.version(*paths)
+
+
+def marks_trend_features(marks_df):
+    keys = ["Username", "Roll"]
+
+    # Least-squares slope of marks against entry order, per student
+    g = marks_df[keys].copy()
+    g["y"] = pd.to_numeric(marks_df["Marks"], errors="coerce")
+    g["x"] = marks_df.groupby(keys).cumcount()
+    g["xy"] = g["x"] * g["y"]
+    g["xx"] = g["x"] * g["x"]
+
+    s = g.groupby(keys).agg(
+        n=("y", "count"), sx=("x", "sum"), sy=("y", "sum"),
+        sxy=("xy", "sum"), sxx=("xx", "sum"), Marks_Avg=("y", "mean")
+    )
+
+    denom = s["n"] * s["sxx"] - s["sx"] ** 2
+    s["Marks_Trend"] = ((s["n"] * s["sxy"] - s["sx"] * s["sy"]) / denom.where(denom != 0)).fillna(0)
+
+    return s[["Marks_Avg", "Marks_Trend"]].reset_index()
+
+
+def assignment_completion(assign_df):
+    keys = ["Username", "Roll"]
+
+    done = assign_df.groupby(keys)["Assignment"].nunique().rename("Done").reset_index()
+    total = assign_df.groupby("Username")["Assignment"].nunique()
+
+    done["Assignment_Completion"] = done["Done"] / done["Username"].map(total).where(lambda t: t > 0)
+
+    return done[keys + ["Assignment_Completion"]]
+
+
+def risk_features(only=None):
+    # only: these teachers' students. Every feature is per (teacher, roll), so a subset gives
+    # the same rows as the full run
+    keys = ["Username", "Roll"]
+
+    marks_df = clean_rolls(read_csv(MARKS_FILE))
+    assign_df = clean_rolls(read_csv(ASSIGN_FILE))
+    slip_df = clean_rolls(read_csv(SLIP_FILE))
+    att_df = read_attendance(only)
+
+    if only is not None:
+        marks_df = marks_df[marks_df["Username"].isin(only)]
+        assign_df = assign_df[assign_df["Username"].isin(only)]
+        slip_df = slip_df[slip_df["Username"].isin(only)]
+        att_df = att_df[att_df["Username"].isin(list(only) + ["QR-STUDENT"])]
+
+    teachers = pd.concat(
+        [marks_df["Username"], assign_df["Username"], slip_df["Username"], att_df["Username"]]
+    ).dropna().unique()
+    teachers = [t for t in teachers if t != "QR-STUDENT"]
+
+    attendance_pct = attendance_percentages(att_df, teachers)
+    slip_avg = component_scores(slip_df, "SlipTest_Avg")
+
+    students = pd.concat(
+        [d[keys] for d in (marks_df, assign_df, slip_df, attendance_pct)]
+    ).drop_duplicates()
+
+    features = students.merge(attendance_pct, on=keys, how="left") \
+        .merge(marks_trend_features(marks_df), on=keys, how="left") \
+        .merge(slip_avg, on=keys, how="left") \
+        .merge(assignment_completion(assign_df), on=keys, how="left")
+
+    features[RISK_FEATURES] = features[RISK_FEATURES].astype(float).fillna(0)
+
+    return features.reset_index(drop=True)
+
+
+def risk_labels(features):
+    # There are no later outcomes (next term's results) in the data yet, so the model learns this
+    # rule from the same features: Risk_% is a smoothed version of it, not a forecast
+    return (
+        (features["Attendance"] < RISK_MIN_ATTENDANCE) |
+        (features["Marks_Avg"] < RISK_PASS_MARK)
+    ).astype(int).to_numpy()
+
+
+def load_risk_model():
+    if not os.path.exists(RISK_MODEL_FILE):
+        return None
+
+    return joblib.load(RISK_MODEL_FILE)
+
+
+def update_risk_model(features=None):
+    # Incremental update: one partial_fit pass on top of the saved model
+    if features is None:
+        features = risk_features()
+
+    if len(features) == 0:
+        return load_risk_model()
+
+    model = load_risk_model()
+
+    if model is None:
+        model = {
+            "scaler": StandardScaler(),
+            "clf": SGDClassifier(loss="log_loss", random_state=0),
+            "updates": 0
+        }
+
+    X = features[RISK_FEATURES].to_numpy(float)
+
+    model["scaler"].partial_fit(X)
+    model["clf"].partial_fit(model["scaler"].transform(X), risk_labels(features), classes=[0, 1])
+    model["updates"] += 1
+
+    # Readers never see a half-written pickle; sessions share the process, so the name has the thread too
+    tmp = f"{RISK_MODEL_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    joblib.dump(model, tmp)
+    os.replace(tmp, RISK_MODEL_FILE)
+
+    return model
+
+
+# The signature changes on every save; only the latest result is worth keeping
+@st.cache_data(show_spinner=False, max_entries=1)
+def cached_risk_scores(signature):
+    # risk_scores() counts every call as a hit, so turn this one into a miss
+    record("cache_hits", -1)
+    record("cache_misses")
+
+    return score_risk(risk_features())
+
+
+def score_risk(features):
+    if len(features) == 0:
+        return pd.DataFrame(columns=["Username", "Roll", "Risk_%"])
+
+    model = load_risk_model()
+
+    if model is None:
+        model = update_risk_model(features)
+
+    # One batch inference pass over every student
+    X = model["scaler"].transform(features[RISK_FEATURES].to_numpy(float))
+    features["Risk_%"] = (model["clf"].predict_proba(X)[:, 1] * 100).round(1)
+
+    return features[["Username", "Roll", "Risk_%"]]
+
+
+def risk_scores():
+    record("cache_hits")
+
+    return cached_risk_scores(
+        data_signature(MARKS_FILE, ASSIGN_FILE, SLIP_FILE, ATT_FILE, SESSIONS_FILE, RISK_MODEL_FILE)
+    )
+
+# ---------------- MARK SKETCHES ----------------
+def mark_buckets(values):
+    return np.clip(np.rint(values), 0, SKETCH_BINS - 1).astype(int)
+
+
+def build_sketches():
+    df = read_csv(MARKS_FILE)
+    df["Marks"] = pd.to_numeric(df["Marks"], errors="coerce")
+    df = df.dropna(subset=["Username", "Subject", "Marks"])
+
+    counts = pd.crosstab(
+        [df["Username"], df["Subject"]], mark_buckets(df["Marks"].to_numpy())
+    ).reindex(columns=range(SKETCH_BINS), fill_value=0)
+    counts.columns = SKETCH_COLUMNS
+
+    sketches = counts.reset_index()
+    save_sketches(sketches)
+
+    return sketches
+
+
+def save_sketches(sketches):
+    # Sketches first: a crash in between leaves an old version, which only forces a rebuild
+    write_csv(sketches, SKETCH_FILE)
+    storage.write_atomic(SKETCH_VERSION_FILE, json.dumps(storage.content_version(MARKS_FILE)))
+
+
+def sketch_version():
+    try:
+        with open(SKETCH_VERSION_FILE) as f:
+            return tuple(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+
+def load_sketches():
+    # Rebuild when marks.csv was changed outside marks(); flushes don't count as changes
+    if not os.path.exists(SKETCH_FILE) or sketch_version() != storage.content_version(MARKS_FILE):
+        record("cache_misses")
+        return build_sketches()
+
+    record("cache_hits")
+    return read_csv(SKETCH_FILE, dtype={"Username": str, "Subject": str})
+
+
+def update_sketch(sketches, user, subject, old_mark, new_mark):
+    row = (sketches["Username"] == user) & (sketches["Subject"] == subject)
+
+    if not row.any():
+        empty = pd.DataFrame([[user, subject] + [0] * SKETCH_BINS], columns=sketches.columns)
+        sketches = pd.concat([sketches, empty], ignore_index=True)
+        row = (sketches["Username"] == user) & (sketches["Subject"] == subject)
+
+    if old_mark is not None:
+        sketches.loc[row, f"B{mark_buckets(old_mark)}"] -= 1
+
+    sketches.loc[row, f"B{mark_buckets(new_mark)}"] += 1
+    save_sketches(sketches)
+
+
+def merge_sketches(sketches):
+    return sketches[SKETCH_COLUMNS].to_numpy().sum(axis=0)
+
+
+def sketch_percentiles(counts, percentiles=PERCENTILES):
+    total = counts.sum()
+
+    if total == 0:
+        return [np.nan] * len(percentiles)
+
+    cumulative = np.cumsum(counts)
+    ranks = np.ceil(np.array(percentiles) / 100 * total).clip(min=1)
+
+    return list(np.searchsorted(cumulative, ranks))
+
+# ---------------- REPORT CARDS ----------------
+def report_students(teachers=None):
+    # One plain dict per (teacher, student), ready to send to report worker processes
+    marks_df = clean_rolls(read_csv(MARKS_FILE))
+    assign_df = clean_rolls(read_csv(ASSIGN_FILE))
+    slip_df = clean_rolls(read_csv(SLIP_FILE))
+
+    if teachers is not None:
+        marks_df = marks_df[marks_df["Username"].isin(teachers)]
+        assign_df = assign_df[assign_df["Username"].isin(teachers)]
+        slip_df = slip_df[slip_df["Username"].isin(teachers)]
+
+    # Files from before assignment marks existed
+    if "Marks" not in assign_df.columns:
+        assign_df["Marks"] = 0
+
+    teachers = pd.concat([marks_df["Username"], assign_df["Username"], slip_df["Username"]]).dropna().unique()
+    keys = ["Username", "Roll"]
+
+    attendance_pct = attendance_percentages(read_attendance(teachers), teachers)
+    graded, _ = compute_final_grades(list(teachers))
+
+    marks_rows = marks_df.groupby(keys + ["Subject"])["Marks"].mean().round(2).reset_index().merge(
+        graded[keys + ["Subject", "Final", "Grade"]], on=keys + ["Subject"], how="left"
+    ).fillna({"Final": "", "Grade": ""})
+
+    students = pd.concat([d[keys + ["Name"]] for d in (marks_df, assign_df, slip_df)]) \
+        .dropna(subset=["Username"]).drop_duplicates(keys, keep="last") \
+        .merge(attendance_pct, on=keys, how="left").fillna({"Attendance": 0, "Name": ""})
+
+    def grouped(df, columns):
+        return {k: list(g[columns].itertuples(index=False, name=None)) for k, g in df.groupby(keys)}
+
+    marks_by = grouped(marks_rows, ["Subject", "Marks", "Final", "Grade"])
+    assign_by = grouped(assign_df.fillna(""), ["Assignment", "File", "Marks"])
+    slip_by = grouped(slip_df.fillna({"Marks": 0}), ["SlipTest", "Marks"])
+
+    return [
+        {
+            "teacher": teacher,
+            "roll": roll,
+            "name": str(name),
+            "attendance": float(pct),
+            "marks": marks_by.get((teacher, roll), []),
+            "assignments": assign_by.get((teacher, roll), []),
+            "slip_tests": slip_by.get((teacher, roll), [])
+        }
+        for teacher, roll, name, pct in students[keys + ["Name", "Attendance"]].itertuples(index=False)
+    ]
+
+
+def report_cards_panel(user):
+    st.subheader("📄 Report Cards")
+
+    scopes = ["My Class", "Department"] if is_admin() else ["My Class"]
+    scope = st.radio("Scope", scopes, horizontal=True, key="report_scope")
+
+    if st.button("🖨️ Generate Report Cards", key="report_btn"):
+        start = time.time()
+        students = report_students([user] if scope == "My Class" else None)
+
+        if len(students) == 0:
+            st.info("No student data available for reports")
+            return
+
+        bar = st.progress(0.0, text=f"Rendering 0 / {len(students)}")
+
+        def progress(done, total):
+            # Redrawing for every student would cost more than rendering it
+            if done == total or done % max(total // 100, 1) == 0:
+                bar.progress(done / total, text=f"Rendering {done} / {total}")
+
+        path = os.path.join(reports.REPORTS_DIR, f"report_cards_{user}_{time.strftime('%Y%m%d_%H%M%S')}.zip")
+        reports.generate_reports(students, path, progress=progress)
+
+        st.session_state.report_zip = path
+        st.success(f"Generated {len(students)} report cards in {time.time() - start:.2f}s")
+
+    path = st.session_state.get("report_zip")
+
+    if path is not None and os.path.exists(path):
+        with open(path, "rb") as f:
+            st.download_button("⬇️ Download Report Cards (.zip)", f, file_name=os.path.basename(path), key="report_dl")
+
 
-# ---------------- WORKING DAYS FUNCTION ----------------
-def get_working_days(start_date, end_date, holidays=None):
-    if holidays is None:
-        holidays = []
+# ---------------- ROSTERS ----------------
+def load_roster(user=None):
+    roster = read_csv(ROSTER_FILE, dtype={"Roll": str, "Name": str, "Section": str})
 
-    count = 0
-    current = start_date
+    if user is not None:
+        roster = roster[roster["Username"] == user]
 
-    while current <= end_date:
-        # weekday(): Monday=0 ... Sunday=6
-        if current.weekday() != 6 and current not in holidays:
-            count += 1
-        current += timedelta(days=1)
+    return roster
+
+
+def parse_roster_lines(text):
+    # "Roll, Name, Section" per line; Section is optional
+    rows, bad = [], []
+
+    for line in text.splitlines():
+        parts = [p.strip() for p in line.split(",")]
+
+        if len(parts) == 1 and parts[0] == "":
+            continue
+
+        roll = normalize_roll(parts[0])
+
+        if len(parts) < 2 or parts[1] == "" or not is_valid_roll(roll):
+            bad.append(line)
+            continue
+
+        rows.append({
+            "Roll": roll,
+            "Name": normalize_name(parts[1]),
+            "Section": parts[2].upper() if len(parts) > 2 and parts[2] else "GENERAL"
+        })
+
+    return rows, bad
+
+
+def add_roster_students(user, rows):
+    # Ids are assigned under the storage lock so two teachers never get the same one
+    with storage.exclusive():
+        roster = storage.read(ROSTER_FILE, dtype={"Roll": str})
+        known = set(roster.loc[roster["Username"] == user, "Roll"])
+        next_id = int(pd.to_numeric(roster["StudentID"]).max()) + 1 if len(roster) > 0 else 1
+
+        new = []
+        for row in rows:
+            if row["Roll"] in known:
+                continue
+
+            known.add(row["Roll"])
+            new.append({"StudentID": next_id, "Username": user, **row})
+            next_id += 1
+
+        if len(new) > 0:
+            record("journal_writes")
+            record("journal_write_bytes", storage.append_many(ROSTER_FILE, new))
+
+    return len(new)
+
+
+def with_roster_names(df):
+    return core.with_roster_names(df, load_roster())
+
+
+def save_roll_call(user, att_date, sheet):
+    # Whole class in one journal record
+    rows = [
+        {
+            "Username": user,
+            "Roll": roll,
+            "Name": "",
+            "Date": str(att_date),
+            "Status": "Present" if present else "Absent",
+            "DeviceID": "",
+            "Token": "",
+            "StudentID": int(student_id)
+        }
+        for student_id, roll, present in sheet[["StudentID", "Roll", "Present"]].itertuples(index=False)
+    ]
+
+    # Same (teacher, roll, date) index as manual attendance: a repeated roll call updates, never appends
+    with tracked_write(ATT_FILE, user, rows):
+        df = read_csv(ATT_FILE, dtype=str)
+        day = df[(df["Username"] == user) & (df["Date"] == str(att_date))]
+        marked = dict(zip(day["Roll"], day["Status"]))
+
+        new = [r for r in rows if r["Roll"] not in marked]
+        changed = [r for r in rows if r["Roll"] in marked and marked[r["Roll"]] != r["Status"]]
+
+        # The whole change set in one journal record: new students are appended, as no row matches them
+        if len(changed) > 0:
+            record("journal_writes")
+            record("journal_write_bytes", storage.upsert_many(ATT_FILE, ["Username", "Roll", "Date"], new + changed, ["Status"]))
+        elif len(new) > 0:
+            record("journal_writes")
+            record("journal_write_bytes", storage.append_many(ATT_FILE, new))
+
+    return len(rows)
+
+
+# ---------------- QR SESSIONS ----------------
+def load_sessions():
+    return read_csv(SESSIONS_FILE, dtype=str)
+
+
+def find_session(session_id):
+    return core.find_session(session_id, load_sessions())
+
+
+def qr_session(user, class_name, qr_date):
+    # The teacher's session for this class and date, if one was started
+    opened = st.session_state.setdefault("qr_sessions", {})
+    key = (class_name, str(qr_date))
+
+    if key not in opened:
+        sessions = load_sessions()
+        match = sessions[
+            (sessions["Username"] == user) &
+            (sessions["Class"] == class_name) &
+            (sessions["Date"] == str(qr_date))
+        ]
+
+        if len(match) == 0:
+            return None
+
+        opened[key] = match.iloc[0]["SessionID"]
+
+    return opened[key]
+
+
+def open_qr_session(user, class_name, qr_date):
+    # One session per teacher, class and date; its shard is created by the first scan
+    def existing(sessions):
+        match = sessions[
+            (sessions["Username"] == user) &
+            (sessions["Class"] == class_name) &
+            (sessions["Date"] == str(qr_date))
+        ]
+        return None if len(match) == 0 else match.iloc[0]["SessionID"]
+
+    session_id = uuid.uuid4().hex[:12]
+
+    found = save_record_if(SESSIONS_FILE, {
+        "SessionID": session_id,
+        "Username": user,
+        "Class": class_name,
+        "Date": str(qr_date),
+        "Created": time.strftime("%Y-%m-%d %H:%M:%S")
+    }, existing)
+
+    if found is not None:
+        session_id = found
+
+    st.session_state.setdefault("qr_sessions", {})[(class_name, str(qr_date))] = session_id
+    return session_id
+
+
+def attendance_frames(teachers=None):
+    return core.attendance_frames(teachers, read_csv)
+
+
+def read_attendance(teachers=None, frames=None):
+    return core.read_attendance(teachers, frames, read_csv)
 
-    return count
 
 # ---------------- ATTENDANCE ----------------
-df = pd.read_csv(ATT_FILE)
+APP_URL = "https://smart-teacher-assistant.streamlit.app"
+# e.g. http://10.0.0.5:8600 - students' QR scans then go to scan_service.py instead of this app
+SCAN_SERVICE_URL = os.environ.get("SCAN_SERVICE_URL", "").rstrip("/")
+
+df = read_csv(ATT_FILE)
 
 if "DeviceID" not in df.columns:
     df["DeviceID"] = ""
@@ -328,42 +1219,68 @@ def attendance():
     key="qr_date"
 )
 
-    token = generate_token()
+    qr_class = st.text_input("Class / Section", value="General", key="qr_class").strip().upper() or "GENERAL"
 
-    app_url = f"https://smart-teacher-assistant.streamlit.app/?page=student&date={qr_date}&token={token}"
+    # Each class gets its own session, signed tokens and attendance shard, once the teacher starts it
+    session_id = qr_session(st.session_state.user, qr_class, qr_date)
 
-    qr = qrcode.make(app_url)
-    buf = BytesIO()
-    qr.save(buf)
+    if session_id is None:
+        st.info(f"No QR session for {qr_class} on {qr_date} yet")
 
-    col1, col2, col3 = st.columns([2,1,2])
-    with col2:
-     st.image(buf.getvalue(), width=250)
+        if st.button("▶️ Start QR Attendance", key="qr_start"):
+            session_id = open_qr_session(st.session_state.user, qr_class, qr_date)
 
-# Countdown
-    remaining = QR_EXPIRY - int(time.time() % QR_EXPIRY)
-    st.info(f"⏳ QR refreshes in {remaining} seconds")
+    if session_id is not None:
+        token = generate_token(session_id)
 
-    st.progress(remaining / QR_EXPIRY)
+        if SCAN_SERVICE_URL:
+            app_url = f"{SCAN_SERVICE_URL}/scan?" + urlencode({"date": qr_date, "session": session_id, "token": token})
+        else:
+            app_url = f"{APP_URL}/?page=student&date={qr_date}&session={session_id}&token={token}"
 
-# ✅ PERFECT SYNC REFRESH
-    current_slot = int(time.time() // QR_EXPIRY)
+        qr = qrcode.make(app_url)
+        buf = BytesIO()
+        qr.save(buf)
 
-    if "last_slot" not in st.session_state:
-     st.session_state.last_slot = current_slot
+        col1, col2, col3 = st.columns([2,1,2])
+        with col2:
+         st.image(buf.getvalue(), width=250)
 
-    if current_slot != st.session_state.last_slot:
-     st.session_state.last_slot = current_slot
-     st.rerun()
+    # Countdown
+        remaining = QR_EXPIRY - int(time.time() % QR_EXPIRY)
+        st.info(f"⏳ QR refreshes in {remaining} seconds")
 
-    # Refresh every 1 second
-    st_autorefresh(interval=1000, key="qr_refresh")
+        st.progress(remaining / QR_EXPIRY)
 
+    # ✅ PERFECT SYNC REFRESH
+        current_slot = int(time.time() // QR_EXPIRY)
 
-    st.markdown(
-      "<p style='text-align:center;'>Students scan this QR to mark attendance</p>",
-       unsafe_allow_html=True
-    ) 
+        if "last_slot" not in st.session_state:
+         st.session_state.last_slot = current_slot
+
+        if current_slot != st.session_state.last_slot:
+         st.session_state.last_slot = current_slot
+         st.rerun()
+
+        # Refresh every 1 second
+        st_autorefresh(interval=1000, key="qr_refresh")
+
+
+        st.markdown(
+          "<p style='text-align:center;'>Students scan this QR to mark attendance</p>",
+           unsafe_allow_html=True
+        ) 
+
+        # -------- LIVE SCANS --------
+        scanned = live_scans(qr_date, session_id)
+
+        st.metric(f"🟢 Scanned for {qr_class} on {qr_date}", len(scanned))
+
+        if len(scanned) > 0:
+            st.dataframe(
+                pd.DataFrame(list(scanned.items())[::-1], columns=["Roll", "Name"]),
+                height=200
+            )
     
 
     st.divider()
@@ -385,34 +1302,107 @@ def attendance():
         name = normalize_name(st.text_input("Student Name", key="att_name"))
 
         status = st.selectbox("Status", ["Present", "Absent"], key="att_status")
+        nonce = form_nonce("attendance")
 
         if st.button("Save Attendance", key="att_btn"):
             if not is_valid_roll(roll):
                 st.error("❌ Invalid Roll No format (Example: 12345-CSE-001)")
                 return
 
-            df = pd.read_csv(ATT_FILE)
+            row = {
+                "Username": user,
+                "Roll": roll,
+                "Name": name,
+                "Date": str(selected_date),
+                "Status": status,
+                "DeviceID": ""
+            }
+
+            # One row per (teacher, roll, date): saving again changes the status
+            with tracked_write(ATT_FILE, user, [row]):
+                outcome = submit_once(
+                    "attendance", nonce, ATT_FILE,
+                    {"Username": user, "Roll": roll, "Date": str(selected_date)},
+                    row,
+                    update=["Name", "Status"]
+                )
+
+            submit_message(outcome, "Attendance Saved Successfully", "Attendance Updated Successfully")
+
+    # -------- CLASS ROSTER --------
+    with st.expander("👥 Class Roster"):
+        lines = st.text_area(
+            "Add students, one per line: Roll, Name, Section",
+            placeholder="12345-CSE-001, Asha, A",
+            key="roster_lines"
+        )
+
+        if st.button("➕ Add to Roster", key="roster_add"):
+            rows, bad = parse_roster_lines(lines)
+
+            if len(bad) > 0:
+                st.error(f"❌ Invalid lines (Example: 12345-CSE-001, Asha, A): {bad}")
+                return
+
+            added = add_roster_students(user, rows)
+            st.success(f"Added {added} students ({len(rows) - added} already on the roster)")
 
-            expected_cols = ["Username","Roll","Name","Date","Status","DeviceID"]
+        roster = load_roster(user)
 
-            for col in expected_cols:
-                if col not in df.columns:
-                    df[col] = ""
+        if len(roster) == 0:
+            st.info("No students on your roster yet")
+        else:
+            st.dataframe(roster.drop(columns="Username"))
+
+    # -------- ROLL CALL --------
+    with st.expander("🧾 Roll Call"):
+        roster = load_roster(user)
 
-            df = df[expected_cols]
+        if len(roster) == 0:
+            st.info("Add students to your roster to take roll call")
+        else:
+            call_date = st.date_input("Roll Call Date", key="call_date")
+            sections = sorted(roster["Section"].dropna().unique())
+            section = st.selectbox("Section", ["All"] + sections, key="call_section")
+
+            if section != "All":
+                roster = roster[roster["Section"] == section]
+
+            sheet = st.data_editor(
+                roster[["StudentID", "Roll", "Name"]].assign(Present=True),
+                disabled=["StudentID", "Roll", "Name"],
+                hide_index=True,
+                key=f"call_sheet_{section}"
+            )
+
+            if st.button("✅ Save Roll Call", key="call_btn"):
+                saved = save_roll_call(user, call_date, sheet)
+                st.success(f"Roll call saved: {int(sheet['Present'].sum())} present, {saved - int(sheet['Present'].sum())} absent")
+
+    # -------- OFFLINE SCANS --------
+    with st.expander("📤 Sync Offline Scans"):
+        st.caption(
+            "No internet in class? Run `python scan_service.py --capture scans.jsonl --session <class session>` "
+            "on a classroom laptop, show its /qr page, then upload scans.jsonl here."
+        )
+        if session_id is None:
+            st.info("Start the QR session above to get its class session ID")
+        else:
+            st.code(f"Class session for {qr_class} on {qr_date}: {session_id}")
 
-            df.loc[len(df)] = [
-                 user,
-                 roll,
-                 name,
-                 selected_date,
-                 status,
-                 ""
-            ]
+        batch = st.file_uploader("Captured scans", type=["jsonl"], key="offline_batch")
 
-            df.to_csv(ATT_FILE, index=False)
+        if batch is not None and st.button("🔄 Sync Scans", key="offline_sync"):
+            report = core.ingest_offline(batch.getvalue().splitlines(), user, load_sessions())
+            attendance_index()
+            counts = report["Result"].value_counts()
 
-            st.success("Attendance Saved Successfully")
+            st.success(
+                f"✅ {counts.get('Accepted', 0)} accepted, "
+                f"{counts.get('Duplicate', 0)} duplicates, {counts.get('Rejected', 0)} rejected"
+            )
+            st.dataframe(report, hide_index=True)
+            st.download_button("⬇️ Download Report", report.to_csv(index=False), "sync_report.csv", key="offline_report")
 
     st.divider()
 
@@ -421,7 +1411,8 @@ def attendance():
 
     view_date = st.date_input("Choose Date to View", key="att_view_date")
 
-    df = pd.read_csv(ATT_FILE)
+    frames = attendance_frames([user])
+    df = read_attendance(frames=frames)
 
     day_data = df[
     ((df["Username"] == user) | (df["Username"] == "QR-STUDENT")) &
@@ -471,104 +1462,553 @@ def attendance():
             st.warning("No attendance found for this Roll No")
 
         else:
-            present_days = student_data[student_data["Status"] == "Present"]["Date"].nunique()
+            present_days = student_data[student_data["Status"] == "Present"]["Date"].nunique()
+
+
+            # Calculate working days between start and end date
+            total_days = get_working_days(start_date, end_date)
+            percentage = round((present_days / total_days) * 100, 2)
+            col1, col2 = st.columns(2)
+
+            with col1:
+              st.metric("✅ Present Days", present_days)
+
+            with col2:
+              st.metric("📊 Attendance %", f"{percentage}%")
+                            
+
+
+          
+
+    st.markdown('</div>', unsafe_allow_html=True)
+    st.divider()
+
+    # -------- REGULAR / NON-REGULAR STUDENTS --------
+    st.subheader("📈 Regular & Non-Regular Students (50% Criteria)")
+
+    df = read_attendance(frames=frames)
+
+    user_data = df[
+    (df["Username"] == user) | (df["Username"] == "QR-STUDENT")
+]
+
+    if len(user_data) == 0:
+        st.info("No attendance data available")
+        return
+
+    # Nightly / after-writes precomputed summary, live only when none exists yet
+    precomputed = scheduler.load("attendance_summary")
+
+    if precomputed is not None and user in precomputed["value"]:
+        summary = precomputed["value"][user]
+        st.caption(
+            f"🕑 Precomputed {time.strftime('%Y-%m-%d %H:%M', time.localtime(precomputed['computed_at']))} "
+            f"(v{precomputed['version']})"
+        )
+    else:
+        summary = attendance_summary(user_data)
+
+    # At-risk score from the early-warning model
+    risk = risk_scores()
+    summary = summary.merge(
+        risk[risk["Username"] == user][["Roll", "Risk_%"]],
+        on="Roll",
+        how="left"
+    )
+
+    # Separate tables
+    regular = summary[summary["Status"] == "Regular"]
+    non_regular = summary[summary["Status"] == "Non-Regular"]
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.success("✅ Regular Students (≥ 50%)")
+
+        if len(regular) == 0:
+            st.info("No regular students found")
+        else:
+            st.dataframe(regular)
+
+    with col2:
+        st.error("⚠️ Non-Regular Students (< 50%)")
+
+        if len(non_regular) == 0:
+            st.info("No non-regular students found")
+        else:
+            st.dataframe(non_regular)
+
+    st.caption(f"ℹ️ {RISK_NOTE}")
+
+    if st.button("🔁 Update Risk Model", key="risk_update"):
+        update_risk_model()
+        st.success("Risk model updated")
+
+    st.divider()
+
+    attendance_trends(user)
+
+    st.divider()
+
+    names = clean_rolls(user_data).dropna(subset=["Name"]).drop_duplicates("Roll", keep="last").set_index("Roll")["Name"]
+    attendance_queries(user, names)
+
+
+# ---------------- LIVE SCANS ----------------
+LIVE_EVENT_TTL = 24 * 60 * 60
+
+
+@st.cache_resource
+def scan_channel():
+    # In-process event log shared by all sessions; "offset" is the seq of events[0]
+    return {"lock": threading.Lock(), "offset": 0, "events": []}
+
+
+def publish_scan(att_date, roll, name, device_id, session_id=None):
+    event = scan_event(att_date, roll, name, device_id, session_id)
+    now = event["ts"]
+
+    # Shared storage mode: one events file per day, followed by byte offset in every worker
+    if storage.STORAGE_MODE == "shared":
+        write_live_scan(event)
+        return
+
+    channel = scan_channel()
+
+    with channel["lock"]:
+        channel["events"].append(event)
+
+        # Drop events older than a day
+        expired = 0
+        while channel["events"][expired]["ts"] < now - LIVE_EVENT_TTL:
+            expired += 1
+
+        if expired > 0:
+            del channel["events"][:expired]
+            channel["offset"] += expired
+
+
+def scan_cursor():
+    if storage.STORAGE_MODE == "shared":
+        path = live_scans_file()
+        return (path, os.path.getsize(path) if os.path.exists(path) else 0)
+
+    channel = scan_channel()
+
+    with channel["lock"]:
+        return channel["offset"] + len(channel["events"])
+
+
+def scans_since(cursor):
+    if storage.STORAGE_MODE == "shared":
+        path, offset = cursor
+
+        # New day, new file
+        if path != live_scans_file():
+            path, offset = live_scans_file(), 0
+
+        if not os.path.exists(path):
+            return [], (path, offset)
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        complete = data[:data.rfind(b"\n") + 1]
+        events = [json.loads(line) for line in complete.splitlines()]
+
+        return events, (path, offset + len(complete))
+
+    channel = scan_channel()
+
+    with channel["lock"]:
+        start = max(cursor - channel["offset"], 0)
+        events = channel["events"][start:]
+        return events, channel["offset"] + len(channel["events"])
+
+
+def live_scans(qr_date, session_id=None):
+    live = st.session_state.get("live_scans")
+
+    # New date or class: seed from storage once, then follow events only
+    if live is None or live["date"] != str(qr_date) or live["session"] != session_id:
+        cursor = scan_cursor()
+
+        if session_id is None:
+            df = read_csv(ATT_FILE)
+            seeded = df[(df["Username"] == "QR-STUDENT") & (df["Date"] == str(qr_date))]
+        else:
+            df = read_csv(shard_file(session_id), columns=ATT_COLUMNS)
+            seeded = df[df["Date"] == str(qr_date)]
+
+        live = {
+            "date": str(qr_date),
+            "session": session_id,
+            "cursor": cursor,
+            "rolls": dict(zip(seeded["Roll"], seeded["Name"]))
+        }
+        st.session_state.live_scans = live
+
+    events, live["cursor"] = scans_since(live["cursor"])
+
+    for event in events:
+        if event["date"] == live["date"] and event.get("session") == session_id:
+            live["rolls"][event["roll"]] = event["name"]
+
+    return live["rolls"]
+
+
+# ---------------- ATTENDANCE TRENDS ----------------
+@st.cache_resource
+def attendance_matrix_store():
+    # Per teacher: date-indexed matrix (students x working days), and per file the rows consumed
+    # and its storage.content_versions entry
+    return {}
+
+
+def working_days_index(start, end):
+    days = pd.date_range(start, end, freq="D")
+    return days[days.weekday != 6]
+
+
+def attendance_matrix(user):
+    # While attendance files only get appends, only their new rows are read into the matrix.
+    # Versions first: a save landing before the read is then seen again next time, never missed
+    store = attendance_matrix_store()
+    entry = store.get(user)
+    versions = storage.content_versions(*core.attendance_paths(read_csv))
+    frames = attendance_frames([user])
+
+    # A rewrite (e.g. cleanup), an in-place update from any process or a file gone - start over
+    if entry is None or any(p not in frames for p in entry["files"]) or any(
+        entry["files"][p]["version"][1:] != versions.get(p, (0, 0, 0))[1:] or entry["files"][p]["rows"] > len(f)
+        for p, f in frames.items() if p in entry["files"]
+    ):
+        entry = {"files": {}, "matrix": pd.DataFrame(dtype="int8")}
+
+    new = read_attendance(frames={
+        p: f.iloc[entry["files"].get(p, {}).get("rows", 0):] for p, f in frames.items()
+    })
+    new = clean_rolls(new[(new["Username"] == user) | (new["Username"] == "QR-STUDENT")])
+    new = new.assign(Date=pd.to_datetime(new["Date"], errors="coerce").dt.normalize())
+    new = new.dropna(subset=["Date"])
+
+    matrix = entry["matrix"]
+    record("cache_misses" if len(new) > 0 else "cache_hits")
+
+    if len(new) > 0:
+        known = matrix.columns
+        start = min(new["Date"].min(), known.min()) if len(known) > 0 else new["Date"].min()
+        end = max(new["Date"].max(), known.max()) if len(known) > 0 else new["Date"].max()
+
+        # Only new students / new days are added, existing cells are kept
+        matrix = matrix.reindex(
+            index=matrix.index.union(pd.Index(new["Roll"].unique())).sort_values(),
+            columns=working_days_index(start, end),
+            fill_value=0
+        ).astype("int8")
+
+        present = new[(new["Status"] == "Present") & (new["Date"].dt.weekday != 6)]
+
+        values = matrix.to_numpy(copy=True)
+        values[
+            matrix.index.get_indexer(present["Roll"]),
+            matrix.columns.get_indexer(present["Date"])
+        ] = 1
+
+        matrix = pd.DataFrame(values, index=matrix.index, columns=matrix.columns)
+
+    store[user] = {"files": {p: {"rows": len(f), "version": versions.get(p, (0, 0, 0))} for p, f in frames.items()}, "matrix": matrix}
+
+    return matrix
+
+
+def rolling_rates(matrix, window):
+    return matrix.T.rolling(window, min_periods=1).mean().T * 100
+
+
+def run_lengths(flags):
+    # Length of the run ending at each column, for every row at once
+    counts = np.cumsum(flags, axis=1)
+    resets = np.maximum.accumulate(np.where(flags, 0, counts), axis=1)
+    return counts - resets
+
+
+def attendance_streaks(matrix):
+    present = matrix.to_numpy() == 1
+    present_runs = run_lengths(present)
+    absent_runs = run_lengths(~present)
+
+    return pd.DataFrame({
+        "Current_Present_Streak": present_runs[:, -1],
+        "Longest_Present_Streak": present_runs.max(axis=1),
+        "Current_Absent_Streak": absent_runs[:, -1],
+        "Longest_Absent_Streak": absent_runs.max(axis=1)
+    }, index=matrix.index)
+
+
+def attendance_heatmap(row):
+    days = row.index
+    first_monday = days.min() - pd.Timedelta(days=days.min().weekday())
+
+    week = (days - first_monday).days // 7
+    grid = np.full((6, week.max() + 1), np.nan)
+    grid[days.weekday, week] = row.to_numpy()
+
+    fig, ax = plt.subplots(figsize=(max(4, grid.shape[1] * 0.4), 2.5))
+    ax.imshow(grid, cmap="RdYlGn", vmin=0, vmax=1, aspect="auto")
+    ax.set_yticks(range(6))
+    ax.set_yticklabels(["Mon", "Tue", "Wed", "Thu", "Fri", "Sat"])
+    ax.set_xlabel(f"Weeks from {first_monday.date()}")
+
+    return fig
+
+
+def attendance_trends(user):
+    st.subheader("📉 Attendance Trends")
+
+    matrix = attendance_matrix(user)
+
+    if matrix.empty:
+        st.info("No attendance data available")
+        return
+
+    table = pd.DataFrame({
+        "Rate_7D": rolling_rates(matrix, "7D").iloc[:, -1].round(2),
+        "Rate_30D": rolling_rates(matrix, "30D").iloc[:, -1].round(2)
+    }).join(attendance_streaks(matrix))
+
+    st.dataframe(table)
+
+    # Class-wide daily rate with rolling windows
+    daily = matrix.mean(axis=0) * 100
+
+    st.line_chart(pd.DataFrame({
+        "Daily %": daily,
+        "7-Day %": daily.rolling("7D").mean(),
+        "30-Day %": daily.rolling("30D").mean()
+    }))
+
+    roll = st.selectbox("Student Calendar", matrix.index, key="trend_roll")
+
+    fig = attendance_heatmap(matrix.loc[roll])
+    st.pyplot(fig)
+    plt.close(fig)
+
+
+# ---------------- ATTENDANCE INDEX ----------------
+@st.cache_resource
+def attendance_index_store():
+    # Loaded from disk once per process, then kept current from this process's writes and
+    # the attendance files' content versions; "dirty": changed since last saved
+    return {"index": None, "lock": threading.Lock(), "dirty": False}
+
+
+def attendance_index(written=None):
+    # written: (path, rows, version before, version after) from tracked_write(). Without it,
+    # files changed elsewhere (CLI, scan service, other workers) are indexed from their new rows
+    store = attendance_index_store()
+
+    with store["lock"]:
+        if written is not None:
+            # Not loaded yet: the first query indexes these rows from the file
+            if store["index"] is not None and core.index_written(store["index"], *written):
+                store["dirty"] = True
+            return store["index"]
+
+        if store["index"] is None:
+            store["index"] = core.load_attendance_index()
+
+        if core.refresh_attendance_index(store["index"], core.attendance_paths(read_csv), read_csv):
+            store["dirty"] = True
+            record("cache_misses")
+        else:
+            record("cache_hits")
+
+        if store["dirty"]:
+            core.save_attendance_index(store["index"])
+            store["dirty"] = False
+
+        return store["index"]
+
+
+ATTENDANCE_QUERIES = [
+    "Absent on all of these days",
+    "Absent on any of these days",
+    "Present on one day but not another",
+    "Absent on consecutive days"
+]
+
+
+def attendance_queries(user, names):
+    st.subheader("🧮 Attendance Queries")
+
+    index = attendance_index()
+    days = core.index_days(index, user)
+
+    if len(days) == 0:
+        st.info("No attendance data available")
+        return
+
+    query = st.selectbox("Find students", ATTENDANCE_QUERIES, key="index_query")
+
+    if query == "Present on one day but not another":
+        col1, col2 = st.columns(2)
+        day = col1.selectbox("Present on", days[::-1], key="index_day")
+        other_day = col2.selectbox("Not present on", days[::-1], index=min(1, len(days) - 1), key="index_other_day")
+
+        start = time.perf_counter()
+        bits = core.present_not(index, user, day, other_day)
+
+    elif query == "Absent on consecutive days":
+        length = st.number_input("At least this many days in a row", 1, len(days), min(3, len(days)), key="index_streak")
+        ongoing = st.checkbox("Still absent on the latest day", key="index_ongoing")
+
+        start = time.perf_counter()
+        anywhere, current = core.absence_streaks(index, user, int(length))
+        bits = current if ongoing else anywhere
+
+    else:
+        chosen = st.multiselect("Days", days[::-1], default=days[::-1][:2], key="index_days")
+
+        start = time.perf_counter()
+        if query == "Absent on all of these days":
+            bits = core.absent_on_all(index, user, chosen)
+        else:
+            bits = core.absent_on_any(index, user, chosen)
+
+    elapsed = time.perf_counter() - start
+    rolls = core.bitset_rolls(index, bits)
+
+    st.caption(f"{len(rolls)} students, found in {elapsed * 1e6:.0f} µs (counted over the {len(days)} days attendance was taken)")
+
+    if len(rolls) > 0:
+        st.dataframe(pd.DataFrame({"Roll": rolls, "Name": names.reindex(rolls).to_numpy()}), hide_index=True)
+
+
+# ---------------- ADMISSION CONTROL ----------------
+# Token buckets: RATE submissions per second, bursts of up to BURST
+SCAN_GLOBAL_RATE = 20
+SCAN_GLOBAL_BURST = 60
+SCAN_DEVICE_RATE = 1 / 10
+SCAN_DEVICE_BURST = 3
+# At most SCAN_QUEUE_SLOTS saves run at once; others wait up to SCAN_QUEUE_WAIT seconds
+SCAN_QUEUE_SLOTS = 8
+SCAN_QUEUE_WAIT = 5
+
+
+@st.cache_resource
+def admission_control():
+    # Shared by every session of this server process
+    return {
+        "lock": threading.Lock(),
+        "slots": threading.BoundedSemaphore(SCAN_QUEUE_SLOTS),
+        "global": {"tokens": SCAN_GLOBAL_BURST, "ts": time.monotonic()},
+        "devices": {},
+        "waiting": 0,
+        "running": 0,
+        "stats": {
+            "admitted": 0, "rejected_device": 0, "rejected_global": 0,
+            "rejected_queue": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0, "max_depth": 0
+        }
+    }
 
 
-            # Calculate working days between start and end date
-            total_days = get_working_days(start_date, end_date)
-            percentage = round((present_days / total_days) * 100, 2)
-            col1, col2 = st.columns(2)
+def refill(bucket, rate, burst, now):
+    # Returns 0 when a token is available, else the seconds until one is
+    bucket["tokens"] = min(burst, bucket["tokens"] + (now - bucket["ts"]) * rate)
+    bucket["ts"] = now
 
-            with col1:
-              st.metric("✅ Present Days", present_days)
+    if bucket["tokens"] >= 1:
+        return 0
 
-            with col2:
-              st.metric("📊 Attendance %", f"{percentage}%")
-                            
+    return (1 - bucket["tokens"]) / rate
 
 
-          
+def admit_scan(device_id):
+    # None when admitted, else seconds the client should wait before retrying
+    control = admission_control()
+    now = time.monotonic()
 
-    st.markdown('</div>', unsafe_allow_html=True)
-    st.divider()
+    with control["lock"]:
+        devices = control["devices"]
 
-    # -------- REGULAR / NON-REGULAR STUDENTS --------
-    st.subheader("📈 Regular & Non-Regular Students (50% Criteria)")
+        # A device idle long enough has a full bucket again, no need to keep it
+        if len(devices) > 10_000:
+            idle = SCAN_DEVICE_BURST / SCAN_DEVICE_RATE
+            for key in [k for k, b in devices.items() if now - b["ts"] > idle]:
+                del devices[key]
 
-    df = pd.read_csv(ATT_FILE)
+        device = devices.setdefault(device_id, {"tokens": SCAN_DEVICE_BURST, "ts": now})
 
-    user_data = df[
-    (df["Username"] == user) | (df["Username"] == "QR-STUDENT")
-]
+        wait = refill(device, SCAN_DEVICE_RATE, SCAN_DEVICE_BURST, now)
+        if wait > 0:
+            control["stats"]["rejected_device"] += 1
+            return wait
 
-    if len(user_data) == 0:
-        st.info("No attendance data available")
-        return
+        wait = refill(control["global"], SCAN_GLOBAL_RATE, SCAN_GLOBAL_BURST, now)
+        if wait > 0:
+            control["stats"]["rejected_global"] += 1
+            return wait
 
-    # Group by student
-    # Convert Date column to datetime
-    user_data["Date"] = pd.to_datetime(user_data["Date"], errors="coerce")
+        device["tokens"] -= 1
+        control["global"]["tokens"] -= 1
+        return None
 
-# Get academic range
-    all_dates = user_data["Date"].dropna()
 
-    if len(all_dates) > 0:
-     start_date = all_dates.min().date()
-     end_date = all_dates.max().date()
-    else:
-     start_date = date.today()
-     end_date = date.today()
+@contextmanager
+def submission_slot():
+    # Bounded queue in front of the storage write; yields False when the wait times out
+    control = admission_control()
+    start = time.perf_counter()
 
-# Calculate total working days
-    total_working_days = get_working_days(start_date, end_date)
+    with control["lock"]:
+        control["waiting"] += 1
+        control["stats"]["max_depth"] = max(control["stats"]["max_depth"], control["waiting"])
 
-# Group by student (only Present count)
-    summary = user_data.groupby(
-    ["Roll", "Name"]
-).agg(
-    Present_Days=("Status", lambda x: (x == "Present").sum())
-).reset_index()
+    acquired = control["slots"].acquire(timeout=SCAN_QUEUE_WAIT)
+    waited = (time.perf_counter() - start) * 1000
 
-# Add Total Days column (same for all students)
-    summary["Total_Days"] = total_working_days
+    with control["lock"]:
+        control["waiting"] -= 1
+        stats = control["stats"]
 
-# Calculate Percentage
-    summary["Percentage"] = round(
-    (summary["Present_Days"] / summary["Total_Days"]) * 100, 2
-)
+        if acquired:
+            control["running"] += 1
+            stats["admitted"] += 1
+            stats["wait_ms_total"] += waited
+            stats["wait_ms_max"] = max(stats["wait_ms_max"], waited)
+        else:
+            stats["rejected_queue"] += 1
 
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with control["lock"]:
+                control["running"] -= 1
+            control["slots"].release()
 
-    # Calculate Percentage
-    summary["Percentage"] = round(
-        (summary["Present_Days"] / summary["Total_Days"]) * 100, 2
-    )
 
-    # Regular / Non-Regular
-    summary["Status"] = summary["Percentage"].apply(
-        lambda x: "Regular" if x >= 50 else "Non-Regular"
-    )
+def retry_message(seconds):
+    st.warning(f"⏳ Too many scans right now. Please retry in {max(int(np.ceil(seconds)), 1)} seconds.")
 
-    # Separate tables
-    regular = summary[summary["Status"] == "Regular"]
-    non_regular = summary[summary["Status"] == "Non-Regular"]
 
-    col1, col2 = st.columns(2)
+def admission_panel():
+    control = admission_control()
 
-    with col1:
-        st.success("✅ Regular Students (≥ 50%)")
+    with control["lock"]:
+        stats = dict(control["stats"])
+        waiting, running = control["waiting"], control["running"]
 
-        if len(regular) == 0:
-            st.info("No regular students found")
-        else:
-            st.dataframe(regular)
+    st.markdown("**🚦 Scan Admission (this process)**")
 
-    with col2:
-        st.error("⚠️ Non-Regular Students (< 50%)")
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Queue Depth", waiting)
+    c2.metric("Saving Now", f"{running}/{SCAN_QUEUE_SLOTS}")
+    c3.metric("Avg Wait (ms)", round(stats["wait_ms_total"] / max(stats["admitted"], 1), 1))
 
-        if len(non_regular) == 0:
-            st.info("No non-regular students found")
-        else:
-            st.dataframe(non_regular)
+    st.dataframe(pd.Series(stats, name="Count"))
 
 
 # ---------------- STUDENT QR ATTENDANCE ----------------
@@ -577,14 +2017,6 @@ def student_attendance():
         st.session_state.submitted = False
 
     query = st.query_params
-    df = pd.read_csv(ATT_FILE)
-
-    # Fix columns if missing
-    if "Token" not in df.columns:
-        df["Token"] = ""
-    if "DeviceID" not in df.columns:
-        df["DeviceID"] = ""
-    df.to_csv(ATT_FILE, index=False)
 
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.header("📱 Student Attendance (QR Scan)")
@@ -596,15 +2028,36 @@ def student_attendance():
 
     # ✅ FIRST TIME VALIDATION ONLY
     if "validated" not in st.session_state:
-        if not is_valid_token(query["token"]):
+        # Class QR: scans belong to the session's teacher and go to its shard
+        session_id = query.get("session")
+        teacher = "QR-STUDENT"
+
+        if session_id is not None:
+            session = find_session(session_id)
+
+            # The token signs only the session and slot, so the date has to match the session's
+            if session is None or query["date"] != session["Date"]:
+                st.error("Invalid QR Code")
+                return
+
+            teacher = session["Username"]
+
+        slot = token_slot(query["token"], session_id)
+
+        if slot is None:
             st.error("❌ QR Code Expired. Please scan again.")
             return
 
         st.session_state.validated = True
         st.session_state.saved_token = query["token"]
+        st.session_state.saved_slot = slot
         st.session_state.qr_date = query["date"]
+        st.session_state.qr_session = session_id
+        st.session_state.qr_teacher = teacher
 
     att_date = st.session_state.qr_date
+    session_id = st.session_state.qr_session
+    scan_file = ATT_FILE if session_id is None else shard_file(session_id)
 
     st.write(f"📅 Date: **{att_date}**")
     st.success("✅ QR Verified! You can take your time.")
@@ -622,55 +2075,47 @@ def student_attendance():
     if not st.session_state.submitted:
         if st.button("✅ Mark Present"):
 
-            # ❌ Prevent QR reuse
-            if len(df[df["Token"] == st.session_state.saved_token]) > 0:
-                st.error("❌ This QR already used")
-                return
-
-            # ❌ Device restriction
-            device_data = df[
-                (df["DeviceID"] == device_id) &
-                (df["Date"] == str(att_date))
-            ]
-
-            if len(device_data) > 0:
-                existing_roll = device_data.iloc[0]["Roll"]
-
-                if existing_roll == roll:
-                    st.warning("⚠️ You already marked attendance")
-                else:
-                    st.error(f"❌ Device already used for Roll: {existing_roll}")
-                return
-
-            # ❌ Roll restriction
-            if len(df[
-                (df["Roll"] == roll) &
-                (df["Date"] == str(att_date))
-            ]) > 0:
-                st.warning("⚠️ Attendance already marked for this Roll")
+            # Verified too long ago: the token has left the replay window
+            if st.session_state.saved_slot < current_slot() - REPLAY_SLOTS:
+                del st.session_state.validated
+                st.error("❌ QR Code Expired. Please scan again.")
                 return
 
-            # ✅ Validate input
-            if roll.strip() == "" or name.strip() == "":
-                st.warning("Please fill all fields")
+            # Over the per-device or global rate: turn away before touching storage
+            retry_after = admit_scan(device_id)
+            if retry_after is not None:
+                retry_message(retry_after)
                 return
 
-            if not is_valid_roll(roll):
-                st.error("❌ Invalid Roll No format")
+            with submission_slot() as admitted:
+                if not admitted:
+                    retry_message(SCAN_QUEUE_WAIT)
+                    return
+
+                row = scan_row(st.session_state.qr_teacher, roll, name, att_date, device_id, st.session_state.saved_token)
+
+                # Checked against the latest data while holding the storage lock
+                with tracked_write(scan_file, st.session_state.qr_teacher, [row]):
+                    problem = save_record_if(
+                        scan_file,
+                        row,
+                        lambda current: scan_check(
+                            current, roll, name, device_id, att_date,
+                            st.session_state.saved_token, st.session_state.saved_slot, session_id
+                        ),
+                        columns=ATT_COLUMNS
+                    )
+
+            if problem is not None:
+                level, message = problem
+
+                if level == "error":
+                    st.error(message)
+                else:
+                    st.warning(message)
                 return
 
-            # ✅ SAVE
-            df.loc[len(df)] = [
-                "QR-STUDENT",
-                roll,
-                name,
-                att_date,
-                "Present",
-                device_id,
-                st.session_state.saved_token
-            ]
-
-            df.to_csv(ATT_FILE, index=False)
+            publish_scan(att_date, roll, name, device_id, session_id)
 
             st.success("✅ Attendance Marked Successfully")
             st.toast("🎉 Attendance Saved")
@@ -712,35 +2157,45 @@ def assignments():
 )
 
     # Fix assignments file if Marks column missing
-    df = pd.read_csv(ASSIGN_FILE)
+    df = read_csv(ASSIGN_FILE)
 
     if "Marks" not in df.columns:
-        df["Marks"] = 0
-        df.to_csv(ASSIGN_FILE, index=False)
+        storage.transform(ASSIGN_FILE, lambda d: d.assign(Marks=0))
+
+    nonce = form_nonce("assignment")
 
     if st.button("Submit Assignment", key="ass_btn"):
-     if not is_valid_roll(roll):
-        st.error("❌ Invalid Roll No format (Example: 12345-CSE-001)")
-        return
-       
-    # Validate marks
-     if ass_marks < 0 or ass_marks > 10:
-        st.error("❌ Marks must be between 0 and 10")
-        return
+     problem = entry_problem(roll, name, ass, ass_marks, 10)
 
-     if roll.strip() == "" or name.strip() == "" or ass.strip() == "":
-        st.warning("Please fill all fields")
-        return
+     if problem is not None:
+        level, message = problem
 
-     df = pd.read_csv(ASSIGN_FILE)
+        if level == "error":
+            st.error(message)
+        else:
+            st.warning(message)
+        return
 
     # No file now
      filename = "No File"
 
-     df.loc[len(df)] = [user, roll, name, ass, filename, ass_marks]
-     df.to_csv(ASSIGN_FILE, index=False)
-
-     st.success("✅ Assignment Submitted Successfully")
+     # One row per (teacher, roll, assignment): a resubmission updates it
+     with tracked_write(ASSIGN_FILE, user):
+         outcome = submit_once(
+            "assignment", nonce, ASSIGN_FILE,
+            {"Username": user, "Roll": roll, "Assignment": ass},
+            {
+                "Username": user,
+                "Roll": roll,
+                "Name": name,
+                "Assignment": ass,
+                "File": filename,
+                "Marks": ass_marks
+            },
+            update=["Name", "Marks"]
+         )
+
+     submit_message(outcome, "✅ Assignment Submitted Successfully", "✅ Assignment Updated Successfully")
          
 
 
@@ -749,7 +2204,7 @@ def assignments():
     # ---------------- MY SUBMISSIONS ----------------
     st.subheader("📂 My Submissions")
 
-    df = pd.read_csv(ASSIGN_FILE)
+    df = read_csv(ASSIGN_FILE)
     mydata = df[df["Username"] == user]
 
     if len(mydata) == 0:
@@ -807,39 +2262,40 @@ def slip_test():
 )
 
 
-    
+    nonce = form_nonce("slip_test")
 
     if st.button("Submit Slip-Test", key="slip_btn_page"):
-     if not is_valid_roll(st_roll):
-        st.error("❌ Invalid Roll No format (Example: 12345-CSE-001)")
-        return
+     problem = entry_problem(st_roll, st_name, st_title, st_marks, 10)
 
-    # Validate marks
-     if st_marks < 0 or st_marks > 10:
-        st.error("❌ Marks must be between 0 and 10")
-        return
+     if problem is not None:
+        level, message = problem
 
-     if st_roll.strip() == "" or st_name.strip() == "" or st_title.strip() == "":
-        st.warning("Please fill all fields")
+        if level == "error":
+            st.error(message)
+        else:
+            st.warning(message)
         return
 
-     df = pd.read_csv(SLIP_FILE)
-
     # No file now
      filename = "No File"
 
-     df.loc[len(df)] = [
-        user,
-        st_roll,
-        st_name,
-        st_title,
-        filename,
-        st_marks
-     ]
-
-     df.to_csv(SLIP_FILE, index=False)
-
-     st.success("✅ Slip-Test Submitted Successfully")
+     # One row per (teacher, roll, slip test): a resubmission updates it
+     with tracked_write(SLIP_FILE, user):
+         outcome = submit_once(
+            "slip_test", nonce, SLIP_FILE,
+            {"Username": user, "Roll": st_roll, "SlipTest": st_title},
+            {
+                "Username": user,
+                "Roll": st_roll,
+                "Name": st_name,
+                "SlipTest": st_title,
+                "File": filename,
+                "Marks": st_marks
+            },
+            update=["Name", "Marks"]
+         )
+
+     submit_message(outcome, "✅ Slip-Test Submitted Successfully", "✅ Slip-Test Updated Successfully")
 
 
     st.divider()
@@ -847,7 +2303,7 @@ def slip_test():
     # -------- VIEW RECORDS --------
     st.subheader("📂 My Slip-Test Records")
 
-    df = pd.read_csv(SLIP_FILE)
+    df = read_csv(SLIP_FILE)
 
     my_slips = df[df["Username"] == user]
 
@@ -888,24 +2344,35 @@ def marks():
             st.error("❌ Invalid Roll No format (Example: 12345-CSE-001)")
             return
  
-        df = pd.read_csv(MARKS_FILE)
+        # One step, so the sketch's stored marks version covers exactly this save.
+        # rewriting(): saving the sketch rewrites a file, which waits for the flusher
+        with tracked_write(MARKS_FILE, user, lock=storage.rewriting):
+            df = read_csv(MARKS_FILE)
+            sketches = load_sketches()
+
+            # Check if already exists (Update marks)
+            existing = df[
+                (df["Username"] == user) &
+                (df["Roll"] == roll) &
+                (df["Subject"] == subject)
+                ]
+
+            # Same key -> only Marks is updated, otherwise a new row is added
+            update_record(
+                MARKS_FILE,
+                {"Username": user, "Roll": roll, "Subject": subject},
+                {"Username": user, "Roll": roll, "Name": name, "Subject": subject, "Marks": mark},
+                update=["Marks"]
+            )
 
-        # Check if already exists (Update marks)
-        existing = df[
-            (df["Username"] == user) &
-            (df["Roll"] == roll) &
-            (df["Subject"] == subject)
-            ]
+            old_mark = existing["Marks"].iloc[0] if len(existing) > 0 else None
+            update_sketch(sketches, user, subject, old_mark, mark)
 
-        if len(existing) > 0:
-            df.loc[existing.index, "Marks"] = mark
+        if old_mark is not None:
             st.success("Marks Updated Successfully")
         else:
-            df.loc[len(df)] = [user, roll, name, subject, mark]
             st.success("Marks Saved Successfully")
 
-        df.to_csv(MARKS_FILE, index=False)
-
     st.divider()
 
     # ---------------- STUDENT SEARCH ----------------
@@ -913,7 +2380,7 @@ def marks():
 
     search_roll = st.text_input("Enter Roll No to Search", key="marks_search")
 
-    df = pd.read_csv(MARKS_FILE)
+    df = read_csv(MARKS_FILE)
     mydata = df[df["Username"] == user]
 
     if search_roll.strip() != "":
@@ -955,7 +2422,7 @@ def analytics():
     user = st.session_state.user
 
     # Load data
-    df = pd.read_csv(MARKS_FILE)
+    df = read_csv(MARKS_FILE)
     df = df[df["Username"] == user]
 
     if len(df) == 0:
@@ -1007,8 +2474,8 @@ def analytics():
 
     avg_student = data.groupby(["Roll", "Name"])["Marks"].mean().reset_index()
 
-    top5 = avg_student.sort_values("Marks", ascending=False).head(5)
-    weak5 = avg_student.sort_values("Marks").head(5)
+    top5 = avg_student.nlargest(5, "Marks")
+    weak5 = avg_student.nsmallest(5, "Marks")
 
     col1, col2 = st.columns(2)
 
@@ -1022,6 +2489,63 @@ def analytics():
 
     st.divider()
 
+    # ---------------- DISTRIBUTION ----------------
+    st.subheader("📐 Marks Distribution")
+
+    marks_arr = data["Marks"].to_numpy(float)
+    bands = np.percentile(marks_arr, PERCENTILES)
+
+    cols = st.columns(len(PERCENTILES))
+
+    for col, p, value in zip(cols, PERCENTILES, bands):
+        col.metric(f"P{p}", round(value, 2))
+
+    # Per-subject percentile bands
+    subject_bands = data.groupby("Subject")["Marks"].quantile(
+        [p / 100 for p in PERCENTILES]
+    ).unstack()
+    subject_bands.columns = [f"P{p}" for p in PERCENTILES]
+    st.dataframe(subject_bands)
+
+    counts, edges = np.histogram(marks_arr, bins=10, range=(0, 100))
+
+    fig3, ax3 = plt.subplots()
+    ax3.bar(edges[:-1], counts, width=10, align="edge", edgecolor="white")
+    ax3.set_xlabel("Marks")
+    ax3.set_ylabel("Students")
+
+    st.pyplot(fig3)
+
+    # Z-score of each mark within its subject
+    by_subject = data.groupby("Subject")["Marks"]
+    z_data = data[["Roll", "Name", "Subject", "Marks"]].copy()
+    z_data["Z_Score"] = (
+        (data["Marks"] - by_subject.transform("mean")) / by_subject.transform("std", ddof=0).replace(0, np.nan)
+    ).round(2)
+
+    st.dataframe(z_data)
+
+    # ---------------- DEPARTMENT COMPARISON ----------------
+    st.subheader("🏫 Compare With Department")
+
+    sketches = load_sketches()
+
+    if selected_sub != "All":
+        sketches = sketches[sketches["Subject"] == selected_sub]
+
+    mine = merge_sketches(sketches[sketches["Username"] == user])
+    dept = merge_sketches(sketches)
+
+    compare = pd.DataFrame(
+        {"Mine": sketch_percentiles(mine), "Department": sketch_percentiles(dept)},
+        index=[f"P{p}" for p in PERCENTILES]
+    )
+
+    st.dataframe(compare)
+    st.caption(f"Department: {int(dept.sum())} marks from {sketches['Username'].nunique()} teachers")
+
+    st.divider()
+
     # ---------------- PASS / FAIL ----------------
     st.subheader("✅ Pass / Fail Distribution")
 
@@ -1067,6 +2591,96 @@ def analytics():
     st.markdown('</div>', unsafe_allow_html=True)
 
 
+# ---------------- GRADES ----------------
+def grades():
+    st.markdown(
+    "<hr style='margin:5px 0;border:10px solid #1f4037;'>",
+    unsafe_allow_html=True
+    )
+    st.header("🎓 Final Grades")
+
+    user = st.session_state.user
+
+    # ---------------- WEIGHTS ----------------
+    st.subheader("⚖️ Weights & Grade Bands")
+
+    marks_df = read_csv(MARKS_FILE)
+    subjects = [ALL_SUBJECTS] + sorted(marks_df[marks_df["Username"] == user]["Subject"].dropna().unique())
+
+    subject = st.selectbox(
+        "Subject (* = default for all subjects)",
+        subjects,
+        key="grade_subject"
+    )
+
+    config = load_grade_config()
+    current = config[(config["Username"] == user) & (config["Subject"] == subject)]
+
+    if len(current) > 0:
+        weights = {c: float(current.iloc[0][c]) for c in GRADE_COMPONENTS}
+        bands = current.iloc[0]["Bands"]
+    else:
+        weights = {c: float(v) for c, v in DEFAULT_WEIGHTS.items()}
+        bands = DEFAULT_BANDS
+
+    cols = st.columns(len(GRADE_COMPONENTS))
+
+    for col, comp in zip(cols, GRADE_COMPONENTS):
+        with col:
+            weights[comp] = st.number_input(
+                f"{comp} Weight", 0.0, 100.0, weights[comp], key=f"grade_w_{comp}_{subject}"
+            )
+
+    bands = st.text_input("Grade Bands (min:grade, ...)", bands, key=f"grade_bands_{subject}")
+
+    if st.button("💾 Save Weights", key="grade_save"):
+        try:
+            parse_bands(bands)
+        except ValueError:
+            st.error("❌ Invalid grade bands (Example: 90:O,80:A+,0:F)")
+            return
+
+        if sum(weights.values()) <= 0:
+            st.error("❌ At least one weight must be above 0")
+            return
+
+        save_grade_config(user, subject, weights, bands)
+        st.success("Weights Saved Successfully")
+
+    st.divider()
+
+    # ---------------- CLASS GRADES ----------------
+    st.subheader("📋 Class Grades")
+
+    result, changed = compute_final_grades([user])
+
+    if len(result) == 0:
+        st.info("No marks data available for grading")
+    else:
+        st.dataframe(result.drop(columns=["Username", "Fingerprint"]))
+        st.caption(f"Recomputed {changed} of {len(result)} rows")
+
+    st.divider()
+
+    # ---------------- DEPARTMENT ----------------
+    st.subheader("🏫 Department Regrade")
+
+    if st.button("🔄 Regrade Department", key="grade_dept"):
+        start = time.time()
+        result, changed = compute_final_grades()
+
+        st.success(
+            f"Regraded {result['Username'].nunique()} teachers: "
+            f"{changed} of {len(result)} rows recomputed in {time.time() - start:.2f}s"
+        )
+
+    st.divider()
+
+    report_cards_panel(user)
+
+    st.markdown('</div>', unsafe_allow_html=True)
+
+
 # ---------------- CHATBOT ----------------
 def chatbot():
     st.markdown(
@@ -1089,43 +2703,481 @@ def chatbot():
     st.markdown('</div>', unsafe_allow_html=True)
 
 
+# ---------------- DATA CLEANUP ----------------
+QUARANTINE_DIR = "quarantine"
+CLEANUP_REPORT_FILE = os.path.join(QUARANTINE_DIR, "cleanup_report.csv")
+# Opt-in nightly run: CLEANUP_AT=03:00 streamlit run app.py
+CLEANUP_AT = os.environ.get("CLEANUP_AT")
+
+# Same rules as the normalize_* helpers used by the forms
+CLEANUP_NORMALIZERS = {
+    "Username": lambda s: s.str.strip().str.lower(),
+    "Roll": lambda s: s.str.strip().str.upper(),
+    "Name": lambda s: s.str.strip().str.title(),
+    "Subject": lambda s: s.str.strip().str.title(),
+    "Assignment": lambda s: s.str.strip().str.title(),
+    "SlipTest": lambda s: s.str.strip().str.title()
+}
+
+# keys: rows sharing them are merged, keeping `keep`; None merges exact duplicates only
+CLEANUP_RULES = {
+    USER_FILE: {"keys": ["Username"], "keep": "first", "rolls": False},
+    # Same keys as the forms' dedupe index (save_unique_record), latest entry wins
+    ATT_FILE: {"keys": ["Username", "Roll", "Date"], "keep": "last", "rolls": True},
+    MARKS_FILE: {"keys": ["Username", "Roll", "Subject"], "keep": "last", "rolls": True},
+    ASSIGN_FILE: {"keys": ["Username", "Roll", "Assignment"], "keep": "last", "rolls": True},
+    SLIP_FILE: {"keys": ["Username", "Roll", "SlipTest"], "keep": "last", "rolls": True}
+}
+
+
+def clean_frame(df, rules):
+    # df is all text (read with dtype=str); returns (clean rows, quarantined rows, stats)
+    normalized = 0
+
+    for col, fn in CLEANUP_NORMALIZERS.items():
+        if col not in df.columns:
+            continue
+
+        before = df[col]
+        after = fn(before)
+
+        # Legacy QR scans keep their marker user
+        if col == "Username":
+            after = after.where(before != "QR-STUDENT", before)
+
+        normalized += int((before != after).sum())
+        df = df.assign(**{col: after})
+
+    bad = pd.Series(False, index=df.index)
+    reason = pd.Series("", index=df.index)
+
+    if rules["rolls"]:
+        bad = ~df["Roll"].str.fullmatch(ROLL_PATTERN)
+        reason = reason.mask(bad, np.where(df["Roll"] == "", "missing roll", "invalid roll"))
+
+    # Duplicates among the valid rows only
+    subset = rules["keys"] if rules["keys"] is not None else list(df.columns)
+    dup = df[~bad].duplicated(subset=subset, keep=rules["keep"]).reindex(df.index, fill_value=False)
+    reason = reason.mask(dup, "duplicate")
+
+    drop = bad | dup
+    quarantined = df[drop].assign(Reason=reason[drop])
+
+    stats = {
+        "Rows_Before": len(df),
+        "Cells_Normalized": normalized,
+        "Invalid_Roll": int(bad.sum()),
+        "Duplicates": int(dup.sum()),
+        "Rows_After": int((~drop).sum())
+    }
+
+    return df[~drop], quarantined, stats
+
+
+def quarantine(path, rows):
+    if len(rows) == 0:
+        return
+
+    os.makedirs(QUARANTINE_DIR, exist_ok=True)
+    target = os.path.join(QUARANTINE_DIR, path.replace(os.sep, "_"))
+
+    rows.assign(Quarantined=time.strftime("%Y-%m-%d %H:%M:%S")).to_csv(
+        target, mode="a", index=False, header=not os.path.exists(target)
+    )
+
+
+def run_cleanup(paths=None, dry_run=False):
+    # Datasets plus attendance shards, each rewritten in one locked read-modify-write
+    if paths is None:
+        paths = list(CLEANUP_RULES) + [
+            os.path.join(SHARD_DIR, f) for f in sorted(os.listdir(SHARD_DIR)) if f.endswith(".csv")
+        ]
+
+    report = []
+
+    for path in paths:
+        rules = CLEANUP_RULES.get(path, CLEANUP_RULES[ATT_FILE])
+        start = time.perf_counter()
+        result = {}
+
+        if dry_run:
+            result.update(clean_frame(storage.read(path, dtype=str, keep_default_na=False), rules)[2])
+        else:
+            def clean(df):
+                cleaned, bad, stats = clean_frame(df, rules)
+                quarantine(path, bad)
+                result.update(stats)
+                return cleaned
+
+            storage.transform(path, clean)
+
+        report.append({"File": path, **result, "Seconds": round(time.perf_counter() - start, 3)})
+
+    report = pd.DataFrame(report)
+
+    if dry_run:
+        return report
+
+    os.makedirs(QUARANTINE_DIR, exist_ok=True)
+    report.assign(Run=time.strftime("%Y-%m-%d %H:%M:%S")).to_csv(
+        CLEANUP_REPORT_FILE, mode="a", index=False, header=not os.path.exists(CLEANUP_REPORT_FILE)
+    )
+
+    return report
+
+
+def cleanup_panel():
+    with st.sidebar.expander("🧹 Data Cleanup"):
+        st.caption(f"Bad rows are moved to {QUARANTINE_DIR}/, never deleted")
+
+        if st.button("🔍 Preview", key="cleanup_preview"):
+            st.session_state.cleanup_report = run_cleanup(dry_run=True)
+
+        if st.button("🧹 Run Cleanup", key="cleanup_btn"):
+            st.session_state.cleanup_report = run_cleanup()
+
+    if "cleanup_report" in st.session_state:
+        st.subheader("🧹 Cleanup Report")
+        st.dataframe(st.session_state.cleanup_report)
+
+
+# ---------------- PRECOMPUTE ----------------
+# Saves since the last run that trigger an early refresh of the summary
+SUMMARY_AFTER_WRITES = 100
+# Daily incremental snapshot of the data files (see backup.py for restore)
+BACKUP_AT = os.environ.get("BACKUP_AT", "01:45")
+
+
+def summary_job():
+    return core.attendance_summaries(read_csv)
+
+
+def grades_job():
+    result, changed = compute_final_grades()
+    return {"rows": len(result), "recomputed": changed}
+
+
+def risk_model_job():
+    model = update_risk_model()
+    return {"updates": 0 if model is None else model["updates"]}
+
+
+@st.cache_resource
+def start_scheduler():
+    # One scheduler thread per server process; jobs write versioned results under precomputed/
+    scheduler.register("attendance_summary", summary_job, at="02:00", after_writes=SUMMARY_AFTER_WRITES)
+    scheduler.register("final_grades", grades_job, at="02:15")
+    scheduler.register("risk_model", risk_model_job, at="02:30")
+    scheduler.register("backup", backup.snapshot, at=BACKUP_AT)
+
+    if CLEANUP_AT:
+        scheduler.register("data_cleanup", lambda: run_cleanup().to_dict("records"), at=CLEANUP_AT, initial=False)
+
+    scheduler.start()
+
+
+def scheduler_panel():
+    with st.sidebar.expander("🗓️ Precompute Jobs"):
+        for name, job in scheduler.jobs().items():
+            entry = scheduler.load(name)
+
+            trigger = ", ".join(
+                t for t in [
+                    f"daily {job['at']}" if job["at"] else "",
+                    f"every {job['every']}s" if job["every"] else "",
+                    f"after {job['after_writes']} saves" if job["after_writes"] else ""
+                ] if t
+            )
+
+            if entry is None:
+                st.write(f"**{name}** ({trigger}): not run yet")
+            else:
+                st.write(
+                    f"**{name}** ({trigger}): v{entry['version']} at "
+                    f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['computed_at']))}, "
+                    f"{entry['seconds']}s"
+                )
+
+            if st.button(f"▶️ Run {name} now", key=f"job_{name}"):
+                entry = scheduler.run(name)
+                st.success(f"{name} v{entry['version']} done in {entry['seconds']}s")
+
+
+# ---------------- DEPARTMENT ROLLUP ----------------
+# Risk_% at or above this counts a student as at risk
+RISK_ALERT = 50
+# Files every teacher's rows share; a change not seen on this process's write path redoes everyone
+ROLLUP_SHARED_FILES = [MARKS_FILE, ASSIGN_FILE, SLIP_FILE, ATT_FILE]
+
+
+def partial_stats(values):
+    # Mergeable summary: [count, sum, sum of squares, min, max]
+    v = pd.to_numeric(pd.Series(values), errors="coerce").dropna().to_numpy(float)
+
+    if len(v) == 0:
+        return np.array([0.0, 0.0, 0.0, np.inf, -np.inf])
+
+    return np.array([len(v), v.sum(), (v * v).sum(), v.min(), v.max()])
+
+
+def merge_stats(parts):
+    parts = np.array(list(parts), dtype=float).reshape(-1, 5)
+
+    if len(parts) == 0:
+        return partial_stats([])
+
+    return np.concatenate([parts[:, :3].sum(axis=0), [parts[:, 3].min(), parts[:, 4].max()]])
+
+
+def stats_row(stats):
+    count, total, squares, low, high = stats
+
+    if count == 0:
+        return {"Count": 0, "Mean": np.nan, "Std": np.nan, "Min": np.nan, "Max": np.nan}
+
+    mean = total / count
+
+    return {
+        "Count": int(count),
+        "Mean": round(mean, 2),
+        "Std": round(float(np.sqrt(max(squares / count - mean ** 2, 0))), 2),
+        "Min": low,
+        "Max": high
+    }
+
+
+def teacher_partial(teacher, marks_df, att_df, risk):
+    # Only this teacher's rows; runs in a worker thread
+    return {
+        "attendance": partial_stats(attendance_percentages(att_df, [teacher])["Attendance"]),
+        "risk": partial_stats(risk["Risk_%"]),
+        "at_risk": partial_stats(risk["Risk_%"] >= RISK_ALERT),
+        "subjects": {subject: partial_stats(g["Marks"]) for subject, g in marks_df.groupby("Subject")}
+    }
+
+
+@st.cache_resource
+def rollup_store():
+    # Latest per-teacher partials; the content version of every input file they reflect,
+    # and the teachers written since on this process's write path ("everyone": QR scans)
+    return {
+        "lock": threading.Lock(),
+        "partials": {},
+        "versions": {},
+        "model": None,
+        "changed": set(),
+        "everyone": True,
+        "seconds": 0,
+        "recomputed": 0
+    }
+
+
+def rollup_written(path, teacher, before, after):
+    # Write path: only this teacher's partial is redone, unless someone else wrote the file meanwhile
+    store = rollup_store()
+
+    with store["lock"]:
+        if store["versions"].get(path) != before or before == after:
+            return
+
+        store["versions"][path] = after
+
+        if teacher == "QR-STUDENT":
+            store["everyone"] = True
+        else:
+            store["changed"].add(teacher)
+
+
+def rollup_inputs(only=None):
+    # Marks, attendance (with the QR scans every teacher sees) and risk of these teachers, or everyone's
+    marks_df = clean_rolls(read_csv(MARKS_FILE))
+    att_df = read_attendance(only)
+    # Everyone: the cached scores the Attendance page uses too
+    risk = risk_scores() if only is None else score_risk(risk_features(only))
+
+    if only is not None:
+        marks_df = marks_df[marks_df["Username"].isin(only)]
+        att_df = att_df[att_df["Username"].isin(list(only) + ["QR-STUDENT"])]
+
+    return marks_df, att_df, risk
+
+
+def department_partials():
+    store = rollup_store()
+    sessions = load_sessions()
+    owners = dict(zip(map(shard_file, sessions["SessionID"]), sessions["Username"]))
+
+    with store["lock"]:
+        # Taken before anything is read: a save landing during the rollup is picked up next time
+        versions = storage.content_versions(*ROLLUP_SHARED_FILES, *owners)
+        model = storage.file_stat(RISK_MODEL_FILE)
+        seen = store["versions"]
+
+        everyone = store["everyone"] or model != store["model"] or any(
+            seen.get(path) != versions[path] for path in ROLLUP_SHARED_FILES
+        ) or any(path not in versions for path in seen)
+
+        # A session's shard holds only its teacher's scans
+        changed = store["changed"] | {owners[p] for p in owners if seen.get(p) != versions[p]}
+
+        if not everyone and len(changed) == 0:
+            record("cache_hits")
+            return store
+
+        record("cache_misses")
+        start = time.time()
+
+        marks_df, att_df, risk = rollup_inputs(None if everyone else sorted(changed))
+
+        teachers = set(marks_df["Username"].dropna()) | set(att_df["Username"].dropna()) | set(risk["Username"])
+        teachers.discard("QR-STUDENT")
+
+        # Split every dataset by teacher once
+        marks_by = dict(tuple(marks_df.groupby("Username")))
+        att_by = dict(tuple(att_df.groupby("Username")))
+        risk_by = dict(tuple(risk.groupby("Username")))
+        qr = att_by.pop("QR-STUDENT", att_df.iloc[:0])
+
+        fresh = {
+            teacher: teacher_partial(
+                teacher,
+                marks_by.get(teacher, marks_df.iloc[:0]),
+                pd.concat([att_by.get(teacher, att_df.iloc[:0]), qr], ignore_index=True),
+                risk_by.get(teacher, risk.iloc[:0])
+            )
+            for teacher in sorted(teachers)
+        }
+
+        store.update(
+            partials=fresh if everyone else {**store["partials"], **fresh},
+            versions=versions,
+            # Scoring may have saved the first model
+            model=storage.file_stat(RISK_MODEL_FILE) if model is None else model,
+            changed=set(),
+            everyone=False,
+            seconds=round(time.time() - start, 3),
+            recomputed=len(fresh)
+        )
+
+    return store
+
+
+def department_dashboard():
+    st.header("🏫 Department Rollup")
+
+    store = department_partials()
+    partials = store["partials"]
+
+    if len(partials) == 0:
+        st.info("No department data yet")
+        return
+
+    # Department numbers come from merging the small per-teacher partials, never from raw rows
+    attendance = stats_row(merge_stats(p["attendance"] for p in partials.values()))
+    at_risk = merge_stats(p["at_risk"] for p in partials.values())
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("👩‍🏫 Teachers", len(partials))
+    col2.metric("📅 Avg Attendance", f"{attendance['Mean']}%")
+    col3.metric("⚠️ At-Risk Students", f"{int(at_risk[1])} / {int(at_risk[0])}")
+
+    # -------- SUBJECT AVERAGES --------
+    st.subheader("📚 Subject Averages")
+
+    subjects = {}
+    for p in partials.values():
+        for subject, stats in p["subjects"].items():
+            subjects.setdefault(subject, []).append(stats)
+
+    if len(subjects) == 0:
+        st.info("No marks yet")
+    else:
+        st.dataframe(pd.DataFrame([
+            {"Subject": subject, "Teachers": len(parts), **stats_row(merge_stats(parts))}
+            for subject, parts in sorted(subjects.items())
+        ]), hide_index=True)
+
+    # -------- BY TEACHER --------
+    st.subheader("👩‍🏫 By Teacher")
+
+    st.dataframe(pd.DataFrame([
+        {
+            "Teacher": teacher,
+            "Students": int(p["attendance"][0]),
+            "Attendance_%": stats_row(p["attendance"])["Mean"],
+            "At_Risk": int(p["at_risk"][1]),
+            "Avg_Risk_%": stats_row(p["risk"])["Mean"]
+        }
+        for teacher, p in sorted(partials.items())
+    ]), hide_index=True)
+
+    st.caption(
+        f"Merged from {len(partials)} teacher partials, {store['recomputed']} recomputed "
+        f"in {store['seconds']}s"
+    )
+    st.caption(f"ℹ️ At-risk: Risk_% ≥ {RISK_ALERT}. {RISK_NOTE}")
+
+
 # ---------------- DASHBOARD ----------------
 def dashboard():
     
     st.sidebar.markdown("## 📚 Teacher Panel")
 
-    menu = ["Attendance", "Assignments", "Slip Test", "Marks", "Analytics", "Chatbot", "Logout"]
+    menu = ["Attendance", "Assignments", "Slip Test", "Marks", "Analytics", "Grades", "Chatbot", "Logout"]
+
+    # Heads of department also get the cross-teacher rollup
+    if is_admin():
+        menu.insert(-1, "Department")
 
 
     choice = st.sidebar.radio("Menu", menu)
 
-    if choice == "Attendance":
-        attendance()
+    with timed_section(choice), profiled(choice):
+        if choice == "Attendance":
+            attendance()
+
+        elif choice == "Assignments":
+            assignments()
+        elif choice == "Slip Test":
+            slip_test()
+
+        elif choice == "Marks":
+            marks()
+
+        elif choice == "Analytics":
+            analytics()
 
-    elif choice == "Assignments":
-        assignments()
-    elif choice == "Slip Test":
-        slip_test()
+        elif choice == "Grades":
+            grades()
 
-    elif choice == "Marks":
-        marks()
+        elif choice == "Chatbot":
+            chatbot()
 
-    elif choice == "Analytics":
-        analytics()
+        elif choice == "Department":
+            department_dashboard()
 
-    elif choice == "Chatbot":
-        chatbot()
+        elif choice == "Logout":
 
-    elif choice == "Logout":
+            st.session_state.login = False
+            st.rerun()
+
+    if METRICS_ENABLED and is_admin():
+        metrics_panel()
 
-        st.session_state.login = False
-        st.rerun()
+    if is_admin():
+        scheduler_panel()
+        cleanup_panel()
+        profiler_panel()
 
 
 # ---------------- MAIN ----------------
 if "login" not in st.session_state:
     st.session_state.login = False
 
+if METRICS_ENABLED:
+    session_metrics()["reruns"] += 1
+    session_metrics()["snapshots"] = set()
+
 st.markdown("""
 <div class="card">
 <h1 style="color:green;"> Smart Teacher Assistant</h1>
@@ -1136,13 +3188,16 @@ AI + Digital Management System for Teachers
 """, unsafe_allow_html=True)
 
 
+start_scheduler()
+
 # -------- QR ROUTING --------
 query = st.query_params
 
 if "page" in query:
 
     if query["page"] == "student":
-        student_attendance()
+        with timed_section("Student Attendance"), profiled("Student Attendance"):
+            student_attendance()
         st.stop()
 
 if not st.session_state.login:
@@ -0,0 +1,299 @@
+import os
+import glob
+import json
+import time
+import zlib
+import hashlib
+import argparse
+from datetime import datetime
+import numpy as np
+import storage
+
+# ---------------- SETTINGS ----------------
+BACKUP_DIR = "backups"
+# Content-defined chunks: a cut falls where the rolling hash of the last 32 bytes has its top
+# CHUNK_BITS bits zero, so an edit only changes the chunks around it, even if it shifts the rest
+CHUNK_BITS = 16            # about 64 KiB per chunk on average
+CHUNK_MIN = 16 * 1024
+CHUNK_MAX = 256 * 1024
+# Gear table: one fixed 32-bit value per byte
+GEAR = np.array([int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little") for i in range(256)], dtype=np.uint32)
+# What a snapshot holds; the journal files make it consistent without waiting for a flush
+BACKUP_PATTERNS = ["*.csv", "*.joblib", "attendance_shards/*.csv", storage.JOURNAL_FILE, storage.MANIFEST_FILE]
+
+
+# ---------------- CHUNKS ----------------
+def chunk_file(digest):
+    return os.path.join(BACKUP_DIR, "chunks", digest[:2], digest)
+
+
+def save_chunk(data):
+    # Stored once per content hash; returns (digest, stored bytes or 0 if already there)
+    digest = hashlib.sha256(data).hexdigest()
+    path = chunk_file(digest)
+
+    if os.path.exists(path):
+        return digest, 0
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    packed = zlib.compress(data, 6)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(packed)
+    os.replace(tmp, path)
+
+    return digest, len(packed)
+
+
+def load_chunk(digest):
+    with open(chunk_file(digest), "rb") as f:
+        data = zlib.decompress(f.read())
+
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Backup chunk {digest} is corrupted")
+
+    return data
+
+
+def chunk_ends(data):
+    # Gear hash h = sum(GEAR[byte i-k] << k): each byte leaves the 32-bit hash after 32 steps,
+    # so the hash at a position depends only on the bytes just before it
+    n = len(data)
+    gear = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    h = gear.copy()
+
+    # Files shorter than the window only get the terms that fit
+    for k in range(1, min(32, n)):
+        h[k:] += gear[:n - k] << np.uint32(k)
+
+    cuts = np.flatnonzero(h >> np.uint32(32 - CHUNK_BITS) == 0) + 1
+
+    ends, start = [], 0
+    for cut in list(cuts) + [n]:
+        while cut - start > CHUNK_MAX:
+            start += CHUNK_MAX
+            ends.append(start)
+
+        if cut - start >= CHUNK_MIN or (cut == n and cut > start):
+            ends.append(int(cut))
+            start = cut
+
+    return ends
+
+
+def file_chunks(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    start = 0
+    for end in chunk_ends(data):
+        yield data[start:end]
+        start = end
+
+
+# ---------------- SNAPSHOTS ----------------
+def snapshot_file(name):
+    return os.path.join(BACKUP_DIR, "snapshots", f"{name}.json")
+
+
+def snapshots():
+    # Oldest first; names sort by time
+    return sorted(
+        os.path.basename(p)[:-len(".json")]
+        for p in glob.glob(os.path.join(BACKUP_DIR, "snapshots", "*.json"))
+    )
+
+
+def load_snapshot(name):
+    with open(snapshot_file(name)) as f:
+        return json.load(f)
+
+
+def backup_paths(root="."):
+    paths = set()
+
+    for pattern in BACKUP_PATTERNS:
+        for path in glob.glob(os.path.join(root, pattern)):
+            if os.path.isfile(path):
+                paths.add(os.path.relpath(path, root))
+
+    return sorted(paths)
+
+
+def snapshot():
+    previous = load_snapshot(snapshots()[-1])["files"] if snapshots() else {}
+    files = {}
+    new_chunks = new_bytes = 0
+
+    # Writers wait while the files are read, so data files and journal match each other
+    with storage.exclusive():
+        for path in backup_paths():
+            st = os.stat(path)
+            stat = [st.st_size, st.st_mtime_ns]
+
+            # Untouched since the last snapshot: reuse its chunk list without reading the file
+            if path in previous and previous[path]["stat"] == stat:
+                files[path] = previous[path]
+                continue
+
+            chunks = []
+            for data in file_chunks(path):
+                digest, stored = save_chunk(data)
+                chunks.append(digest)
+                new_chunks += stored > 0
+                new_bytes += stored
+
+            files[path] = {"stat": stat, "size": st.st_size, "chunks": chunks}
+
+    name = time.strftime("%Y%m%d-%H%M%S")
+    while os.path.exists(snapshot_file(name)):
+        name += "_"
+
+    os.makedirs(os.path.dirname(snapshot_file(name)), exist_ok=True)
+    storage.write_atomic(snapshot_file(name), json.dumps({"name": name, "created": time.time(), "files": files}))
+
+    return {
+        "name": name,
+        "files": len(files),
+        "bytes": sum(f["size"] for f in files.values()),
+        "new_chunks": new_chunks,
+        "new_bytes": new_bytes
+    }
+
+
+def snapshot_at(when):
+    # Latest snapshot taken at or before `when` (datetime), or None
+    names = [n for n in snapshots() if load_snapshot(n)["created"] <= when.timestamp()]
+    return names[-1] if names else None
+
+
+# ---------------- RESTORE ----------------
+def restore(name, target="."):
+    # Rebuilds the data files as they were in the snapshot; files that already match are skipped
+    files = load_snapshot(name)["files"]
+    restored = []
+
+    with storage.exclusive():
+        for path, entry in files.items():
+            dest = os.path.join(target, path)
+
+            if os.path.exists(dest) and os.path.getsize(dest) == entry["size"]:
+                if [hashlib.sha256(c).hexdigest() for c in file_chunks(dest)] == entry["chunks"]:
+                    continue
+
+            os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+
+            tmp = f"{dest}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(load_chunk(digest))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, dest)
+
+            restored.append(path)
+
+        # Files created after the snapshot (new shards, a later journal) would not match it
+        removed = [p for p in backup_paths(target) if p not in files]
+        for path in removed:
+            os.remove(os.path.join(target, path))
+
+    return {"restored": restored, "removed": removed, "unchanged": len(files) - len(restored)}
+
+
+def verify(name):
+    # Chunks missing or corrupted in a snapshot
+    bad = []
+
+    for entry in load_snapshot(name)["files"].values():
+        for digest in entry["chunks"]:
+            try:
+                load_chunk(digest)
+            except (OSError, ValueError, zlib.error):
+                bad.append(digest)
+
+    return bad
+
+
+def prune(keep):
+    # Keeps the newest `keep` snapshots and deletes chunks no remaining snapshot uses
+    names = snapshots()
+
+    for name in names[:-keep] if keep > 0 else names:
+        os.remove(snapshot_file(name))
+
+    used = set()
+    for name in snapshots():
+        for entry in load_snapshot(name)["files"].values():
+            used.update(entry["chunks"])
+
+    removed = 0
+    for path in glob.glob(os.path.join(BACKUP_DIR, "chunks", "*", "*")):
+        if os.path.basename(path) not in used:
+            os.remove(path)
+            removed += 1
+
+    return removed
+
+
+# ---------------- CLI ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Incremental backups of the Smart Teacher data files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("snapshot", help="back up the data files now")
+    commands.add_parser("list", help="list snapshots")
+
+    restore_cmd = commands.add_parser("restore", help="restore a snapshot (stop the app first)")
+    restore_cmd.add_argument("name", nargs="?", help="snapshot name (default: latest)")
+    restore_cmd.add_argument("--at", help="latest snapshot at or before this time, e.g. '2026-10-19 14:00'")
+    restore_cmd.add_argument("--to", default=".", help="directory to restore into (default: here)")
+
+    verify_cmd = commands.add_parser("verify", help="check a snapshot's chunks")
+    verify_cmd.add_argument("name", nargs="?")
+
+    prune_cmd = commands.add_parser("prune", help="delete old snapshots and unused chunks")
+    prune_cmd.add_argument("--keep", type=int, required=True)
+
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        result = snapshot()
+        print(f"Snapshot {result['name']}: {result['files']} files, {result['bytes']} bytes, "
+              f"{result['new_chunks']} new chunks ({result['new_bytes']} bytes stored)")
+
+    elif args.command == "list":
+        for name in snapshots():
+            snap = load_snapshot(name)
+            print(f"{name}  {len(snap['files'])} files  {sum(f['size'] for f in snap['files'].values())} bytes")
+
+    elif args.command == "restore":
+        name = args.name
+        if args.at is not None:
+            name = snapshot_at(datetime.fromisoformat(args.at))
+        elif name is None and snapshots():
+            name = snapshots()[-1]
+
+        if name is None:
+            parser.error("no snapshot to restore")
+
+        result = restore(name, args.to)
+        print(f"Restored {name}: {len(result['restored'])} files written, {result['unchanged']} unchanged, "
+              f"{len(result['removed'])} removed")
+
+    elif args.command == "verify":
+        name = args.name or (snapshots()[-1] if snapshots() else None)
+
+        if name is None:
+            parser.error("no snapshot to verify")
+
+        bad = verify(name)
+        print(f"{name}: OK" if len(bad) == 0 else f"{name}: {len(bad)} bad chunks")
+
+    elif args.command == "prune":
+        print(f"Removed {prune(args.keep)} unused chunks")
+
+
+if __name__ == "__main__":
+    main()
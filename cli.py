@@ -0,0 +1,157 @@
+import os
+
+# Runs next to the Streamlit app on the same data directory, so both must lock across processes.
+# Start the app with STORAGE_MODE=shared as well.
+os.environ.setdefault("STORAGE_MODE", "shared")
+
+import sys
+import argparse
+import pandas as pd
+import storage
+import scheduler
+import core
+
+EXPORT_KINDS = list(core.RECORD_TYPES) + ["grades", "summary"]
+
+
+# ---------------- COMMANDS ----------------
+def import_command(args):
+    df = pd.read_csv(args.file, dtype=str, keep_default_na=False)
+
+    try:
+        result = core.import_records(args.kind, df, args.teacher)
+    except ValueError as e:
+        print(f"{args.file}: {e}", file=sys.stderr)
+        return 2
+
+    rejected = result["rejected"]
+
+    # Keep the saved attendance index current for the app's queries
+    if args.kind == "attendance" and result["added"] + result["updated"] > 0:
+        core.sync_attendance_index()
+
+    print(
+        f"{args.kind}: {result['added']} added, {result['updated']} updated, {result['unchanged']} unchanged, "
+        f"{result['duplicates']} repeated in the file, {len(rejected)} rejected"
+    )
+
+    if len(rejected) > 0:
+        if args.rejects:
+            rejected.to_csv(args.rejects, index=False)
+            print(f"Rejected rows written to {args.rejects}")
+        else:
+            print(rejected["Reason"].value_counts().to_string())
+        return 1
+
+    return 0
+
+
+def export_frame(kind, teacher=None):
+    if kind == "attendance":
+        df = core.read_attendance(None if teacher is None else [teacher])
+        # QR scans belong to every teacher, as on the Attendance page
+        return df if teacher is None else df[df["Username"].isin([teacher, "QR-STUDENT"])]
+
+    if kind == "summary":
+        summaries = core.attendance_summaries()
+        if teacher is not None:
+            summaries = {u: s for u, s in summaries.items() if u == teacher}
+        if len(summaries) == 0:
+            return pd.DataFrame()
+        return pd.concat([s.assign(Username=u) for u, s in summaries.items()], ignore_index=True)
+
+    if kind == "grades":
+        if not os.path.exists(core.GRADES_FILE):
+            return pd.DataFrame(columns=core.GRADE_RESULT_COLUMNS)
+        df = storage.read(core.GRADES_FILE, dtype={"Roll": str, "Fingerprint": str})
+    else:
+        df = storage.read(core.RECORD_TYPES[kind]["file"])
+
+    return df if teacher is None else df[df["Username"] == teacher]
+
+
+def export_command(args):
+    df = export_frame(args.kind, args.teacher)
+    df.to_csv(args.output or sys.stdout, index=False)
+
+    if args.output:
+        print(f"{len(df)} rows written to {args.output}")
+
+    return 0
+
+
+def grades_job():
+    result, changed = core.compute_final_grades()
+    return {"rows": len(result), "recomputed": changed}
+
+
+def recompute_command(args):
+    # Same job names as the app's scheduler, so the app picks the results up
+    scheduler.register("attendance_summary", core.attendance_summaries)
+    scheduler.register("final_grades", grades_job)
+
+    names = ["attendance_summary", "final_grades"] if args.what == "all" else \
+        {"summary": ["attendance_summary"], "grades": ["final_grades"]}[args.what]
+
+    for name in names:
+        entry = scheduler.run(name)
+        print(f"{name}: v{entry['version']} in {entry['seconds']}s")
+
+    return 0
+
+
+def grade_command(args):
+    result, changed = core.compute_final_grades([args.teacher])
+
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"{len(result)} grades written to {args.output}")
+    else:
+        print(result[["Roll", "Name", "Subject", "Final", "Grade"]].to_string(index=False))
+
+    print(f"{args.teacher}: {len(result)} grades, {changed} recomputed")
+    return 0
+
+
+# ---------------- MAIN ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Smart Teacher Assistant batch jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("import", help="bulk import a CSV with the forms' checks and dedupe rules")
+    cmd.add_argument("kind", choices=list(core.RECORD_TYPES))
+    cmd.add_argument("file")
+    cmd.add_argument("--teacher", help="owner of every row (default: the file's Username column)")
+    cmd.add_argument("--rejects", help="write rejected rows with a Reason column to this CSV")
+    cmd.set_defaults(run=import_command)
+
+    cmd = commands.add_parser("export", help="export a dataset as CSV")
+    cmd.add_argument("kind", choices=EXPORT_KINDS)
+    cmd.add_argument("--teacher")
+    cmd.add_argument("-o", "--output", help="CSV file (default: stdout)")
+    cmd.set_defaults(run=export_command)
+
+    cmd = commands.add_parser("recompute", help="rebuild the precomputed results the app shows")
+    cmd.add_argument("what", choices=["summary", "grades", "all"])
+    cmd.set_defaults(run=recompute_command)
+
+    cmd = commands.add_parser("grade", help="grade a teacher's class")
+    cmd.add_argument("teacher")
+    cmd.add_argument("-o", "--output", help="CSV file (default: print a table)")
+    cmd.set_defaults(run=grade_command)
+
+    args = parser.parse_args()
+
+    core.create_files()
+
+    # Replay unflushed records; anything written here is flushed on exit
+    try:
+        storage.start()
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1180 @@
+import os
+import re
+import json
+import time
+import hmac
+import hashlib
+import zlib
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import storage
+
+# Shared by the Streamlit app, the scan service and the CLI; no Streamlit imports here
+# Functions that load data take `read`: storage.read by default, the app passes its cached reader
+
+# ---------------- FILES ----------------
+USER_FILE = "users.csv"
+MARKS_FILE = "marks.csv"
+ASSIGN_FILE = "assignments.csv"
+SLIP_FILE = "slip_tests.csv"
+GRADE_CONFIG_FILE = "grade_weights.csv"
+GRADES_FILE = "final_grades.csv"
+# Content versions of the grade inputs final_grades.csv was computed from, and the teachers it covers
+GRADES_VERSION_FILE = "final_grades.version"
+ROSTER_FILE = "rosters.csv"
+ATT_FILE = "attendance.csv"
+SESSIONS_FILE = "qr_sessions.csv"
+# Bitmap index over the attendance files, rebuilt from them if lost
+ATT_INDEX_FILE = "attendance_index.bin"
+# One attendance file per QR class session: <dir>/<SessionID>.csv
+SHARD_DIR = "attendance_shards"
+# Shared storage mode: one live scan events file per day
+LIVE_SCANS_DIR = "live_scans"
+
+ATT_COLUMNS = ["Username", "Roll", "Name", "Date", "Status", "DeviceID", "Token", "StudentID"]
+SESSION_COLUMNS = ["SessionID", "Username", "Class", "Date", "Created"]
+# StudentID: compact integer id, unique across all rosters
+ROSTER_COLUMNS = ["StudentID", "Username", "Roll", "Name", "Section"]
+
+
+# ---------------- TEXT NORMALIZATION ----------------
+def normalize_username(text):
+    return text.strip().lower()
+
+def normalize_roll(text):
+    return text.strip().upper()
+
+def normalize_name(text):
+    return text.strip().title()
+def normalize_title(text):
+    return text.strip().title()
+
+
+# ---------------- TOKENS ----------------
+SECRET_KEY = "smart_teacher_secret"
+QR_EXPIRY = 20
+
+def current_slot():
+    return int(time.time() // QR_EXPIRY)
+
+def slot_token(slot):
+    raw = f"{SECRET_KEY}-{slot}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def qr_token(slot, session_id=None):
+    # Class sessions sign their own tokens; no session means the legacy global QR
+    if session_id is None:
+        return slot_token(slot)
+
+    raw = f"{session_id}-{slot}"
+    return hmac.new(SECRET_KEY.encode(), raw.encode(), hashlib.sha256).hexdigest()
+
+def generate_token(session_id=None):
+    return qr_token(current_slot(), session_id)
+
+def token_slot(token, session_id=None):
+    # Time slot the token was issued for, if it is still valid (current or previous slot)
+    now = current_slot()
+
+    for offset in [0, -1]:
+        if token == qr_token(now + offset, session_id):
+            return now + offset
+
+    return None
+
+def is_valid_token(token, session_id=None):
+    return token_slot(token, session_id) is not None
+
+
+# ---------------- ROLL VALIDATION ----------------
+ROLL_PATTERN = r"^\d{5}-[A-Za-z]{3}-\d{3}$"
+
+def is_valid_roll(roll):
+    return re.match(ROLL_PATTERN, roll)
+
+
+# ---------------- QR SESSIONS ----------------
+def shard_file(session_id):
+    return os.path.join(SHARD_DIR, f"{session_id}.csv")
+
+
+def find_session(session_id, sessions=None):
+    if sessions is None:
+        sessions = storage.read(SESSIONS_FILE, dtype=str)
+
+    match = sessions[sessions["SessionID"] == session_id]
+
+    if len(match) == 0:
+        return None
+
+    return match.iloc[0].to_dict()
+
+
+# ---------------- REPLAY CACHE ----------------
+# A verified QR may be submitted for this long; older tokens are evicted with their slot
+SCAN_SUBMIT_WINDOW = 10 * 60
+REPLAY_SLOTS = SCAN_SUBMIT_WINDOW // QR_EXPIRY + 1
+# Shared storage mode: the cache lives in this file, read and written under the storage lock
+REPLAY_FILE = "replay_tokens.json"
+
+# slot -> tokens already used; "seeded" lists the QR sources loaded from stored scans
+_replay = {"slots": {}, "seeded": set()}
+
+
+def save_replay_slots(slots):
+    if storage.STORAGE_MODE == "shared":
+        storage.write_atomic(REPLAY_FILE, json.dumps({k: sorted(v) for k, v in slots.items()}))
+
+
+def load_replay_slots():
+    if storage.STORAGE_MODE != "shared":
+        return _replay["slots"]
+
+    if not os.path.exists(REPLAY_FILE):
+        return {}
+
+    with open(REPLAY_FILE) as f:
+        return {int(k): set(v) for k, v in json.load(f).items()}
+
+
+def used_tokens(df, session_id=None, slots=None):
+    # Only called under the storage lock; df holds the stored scans of this QR source.
+    # A batch passes the slots it already loaded, so the cache is read once per batch
+    if slots is None:
+        slots = load_replay_slots()
+
+    floor = current_slot() - REPLAY_SLOTS
+    for slot in [s for s in slots if s < floor]:
+        del slots[slot]
+
+    # First check for this source since start: pick up tokens saved before a restart
+    if session_id not in _replay["seeded"] and "Token" in df.columns:
+        _replay["seeded"].add(session_id)
+        tokens = {qr_token(slot, session_id): slot for slot in range(floor, current_slot() + 1)}
+
+        for token in df.loc[df["Token"].isin(tokens), "Token"]:
+            slots.setdefault(tokens[token], set()).add(token)
+
+        save_replay_slots(slots)
+
+    return slots
+
+
+def claim_token(slots, token, slot):
+    slots.setdefault(slot, set()).add(token)
+    save_replay_slots(slots)
+
+
+def token_problem(slots, token, slot):
+    if slot < current_slot() - REPLAY_SLOTS:
+        return "error", "❌ QR Code Expired. Please scan again."
+
+    # ❌ Prevent QR reuse
+    if token in slots.get(slot, ()):
+        return "error", "❌ This QR already used"
+
+    return None
+
+
+# ---------------- SCAN CHECKS ----------------
+def scan_check(df, roll, name, device_id, att_date, token, slot, session_id=None):
+    # Runs under the storage lock; the token is claimed only when the scan will be saved
+    slots = used_tokens(df, session_id)
+    problem = token_problem(slots, token, slot) or scan_problem(df, roll, name, device_id, att_date)
+
+    if problem is None:
+        claim_token(slots, token, slot)
+
+    return problem
+
+
+def scan_problem(df, roll, name, device_id, att_date):
+    # Older files have no DeviceID column
+    if "DeviceID" not in df.columns:
+        df["DeviceID"] = ""
+
+    # ❌ Device restriction
+    device_data = df[
+        (df["DeviceID"] == device_id) &
+        (df["Date"] == str(att_date))
+    ]
+
+    if len(device_data) > 0:
+        existing_roll = device_data.iloc[0]["Roll"]
+
+        if existing_roll == roll:
+            return "warning", "⚠️ You already marked attendance"
+        return "error", f"❌ Device already used for Roll: {existing_roll}"
+
+    # ❌ Roll restriction
+    if len(df[
+        (df["Roll"] == roll) &
+        (df["Date"] == str(att_date))
+    ]) > 0:
+        return "warning", "⚠️ Attendance already marked for this Roll"
+
+    return scan_fields_problem(roll, name)
+
+
+def scan_fields_problem(roll, name):
+    # ✅ Validate input
+    if roll.strip() == "" or name.strip() == "":
+        return "warning", "Please fill all fields"
+
+    if not is_valid_roll(roll):
+        return "error", "❌ Invalid Roll No format"
+
+    return None
+
+
+def scan_row(teacher, roll, name, att_date, device_id, token):
+    return {
+        "Username": teacher,
+        "Roll": roll,
+        "Name": name,
+        "Date": str(att_date),
+        "Status": "Present",
+        "DeviceID": device_id,
+        "Token": token
+    }
+
+
+# ---------------- LIVE SCANS ----------------
+def live_scans_file():
+    return os.path.join(LIVE_SCANS_DIR, time.strftime("%Y-%m-%d") + ".jsonl")
+
+
+def write_live_scan(event):
+    os.makedirs(LIVE_SCANS_DIR, exist_ok=True)
+
+    with open(live_scans_file(), "a") as f:
+        f.write(json.dumps(event) + "\n")
+
+
+def scan_event(att_date, roll, name, device_id, session_id=None):
+    return {
+        "ts": time.time(), "date": str(att_date), "roll": roll, "name": name,
+        "device": device_id, "session": session_id
+    }
+
+
+# ---------------- OFFLINE SCANS ----------------
+# A classroom device captures signed scans without reaching the server; they are synced later as one batch
+# Captured scans are accepted this long after their QR slot
+OFFLINE_MAX_AGE = 7 * 24 * 3600
+OFFLINE_FIELDS = ["session", "slot", "token", "date", "roll", "name", "device_id"]
+REPORT_COLUMNS = ["Line", "Roll", "Name", "Date", "DeviceID", "Result", "Message"]
+
+
+def record_signature(record):
+    raw = "|".join("" if record.get(k) is None else str(record[k]) for k in OFFLINE_FIELDS)
+    return hmac.new(SECRET_KEY.encode(), raw.encode(), hashlib.sha256).hexdigest()
+
+
+def offline_record(scan):
+    record = {k: scan.get(k) for k in OFFLINE_FIELDS}
+    record["sig"] = record_signature(record)
+    return record
+
+
+def seen_scans(df):
+    # Keys of the (Roll, Date) and (DeviceID, Date) rules; first roll per device, as in scan_problem()
+    # Older files have no DeviceID column
+    if "DeviceID" not in df.columns:
+        df = df.assign(DeviceID="")
+
+    devices = df[df["DeviceID"].notna() & (df["DeviceID"] != "")].drop_duplicates(["DeviceID", "Date"])
+
+    return {
+        "rolls": set(zip(df["Roll"], df["Date"].astype(str))),
+        "devices": dict(zip(zip(devices["DeviceID"], devices["Date"].astype(str)), devices["Roll"]))
+    }
+
+
+def dedupe_problem(seen, roll, device_id, att_date):
+    # Same rules and messages as scan_problem(); keys are claimed when the scan passes
+    day = str(att_date)
+    # No device id (older clients, pages where the id could not be made): only the roll rule,
+    # as seen_scans() does for stored rows
+    device_id = device_id if isinstance(device_id, str) else ""
+
+    if device_id != "" and (device_id, day) in seen["devices"]:
+        existing_roll = seen["devices"][(device_id, day)]
+
+        if existing_roll == roll:
+            return "warning", "⚠️ You already marked attendance"
+        return "error", f"❌ Device already used for Roll: {existing_roll}"
+
+    if (roll, day) in seen["rolls"]:
+        return "warning", "⚠️ Attendance already marked for this Roll"
+
+    if device_id != "":
+        seen["devices"][(device_id, day)] = roll
+    seen["rolls"].add((roll, day))
+    return None
+
+
+def read_offline_batch(lines):
+    # One JSON record per line; unreadable lines stay in so the report covers the whole file
+    records = []
+
+    for n, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+
+        if line.strip() == "":
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+
+        readable = isinstance(record, dict)
+        record = record if readable else {}
+
+        # Checked on the record as parsed, before the frame turns numbers into floats
+        signed = readable and hmac.compare_digest(str(record.get("sig")).encode(), record_signature(record).encode())
+
+        records.append({"line": n, **{k: record.get(k) for k in OFFLINE_FIELDS}, "readable": readable, "signed": signed})
+
+    return pd.DataFrame(records, columns=["line", *OFFLINE_FIELDS, "readable", "signed"])
+
+
+def verify_offline(batch, teacher, sessions):
+    # Checks every record in one pass over the batch; returns the problem per record, None when valid
+    problems = pd.Series(None, index=batch.index, dtype=object)
+
+    def fail(mask, message):
+        problems[mask & problems.isna()] = message
+
+    text = batch[OFFLINE_FIELDS].fillna("").astype(str).apply(lambda col: col.str.strip())
+    slot = pd.to_numeric(batch["slot"], errors="coerce")
+
+    fail(~batch["readable"].astype(bool), "❌ Unreadable record")
+
+    fail(~batch["signed"].astype(bool), "❌ Record was changed after capture")
+
+    now = current_slot()
+    fail(slot.isna() | (slot > now), "Invalid QR Code")
+    fail(slot < now - OFFLINE_MAX_AGE // QR_EXPIRY, "❌ QR Code Expired. Please scan again.")
+
+    # One signature per (session, slot) pair, however many students scanned it
+    keys = list(zip(text["session"], slot.fillna(-1).astype(int)))
+    expected = {k: qr_token(k[1], k[0] or None) for k in set(keys)}
+    fail(text["token"] != pd.Series([expected[k] for k in keys], index=batch.index, dtype=object), "Invalid QR Code")
+
+    classes = text["session"] != ""
+    fail(classes & ~text["session"].isin(sessions["SessionID"]), "Invalid QR Code")
+    session_dates = text["session"].map(sessions.drop_duplicates("SessionID").set_index("SessionID")["Date"])
+    fail(classes & (text["date"] != session_dates), "Invalid QR Code")
+    fail(classes & ~text["session"].isin(sessions.loc[sessions["Username"] == teacher, "SessionID"]),
+         "❌ This class session belongs to another teacher")
+
+    fail((text["roll"] == "") | (text["name"] == ""), "Please fill all fields")
+    fail(~text["roll"].str.fullmatch(ROLL_PATTERN), "❌ Invalid Roll No format")
+
+    return problems
+
+
+def ingest_offline(lines, teacher, sessions=None):
+    # Verifies, dedupes and saves a captured batch; returns one report row per record
+    if sessions is None:
+        sessions = storage.read(SESSIONS_FILE, dtype=str)
+
+    batch = read_offline_batch(lines)
+    problems = verify_offline(batch, teacher, sessions)
+    text = batch[OFFLINE_FIELDS].fillna("").astype(str).apply(lambda col: col.str.strip())
+
+    report = pd.DataFrame({
+        "Line": batch["line"], "Roll": text["roll"], "Name": text["name"], "Date": text["date"],
+        "DeviceID": text["device_id"], "Result": "Rejected", "Message": problems
+    }, columns=REPORT_COLUMNS)
+
+    # Capture order, so the first scan of a student wins as it would have online
+    slot = pd.to_numeric(batch["slot"], errors="coerce")
+    valid = text[problems.isna()].assign(slot=slot).sort_values("slot", kind="stable")
+    outcome = {}
+
+    with storage.exclusive():
+        for session_id, records in valid.groupby("session", sort=False):
+            path = ATT_FILE if session_id == "" else shard_file(session_id)
+            owner = "QR-STUDENT" if session_id == "" else teacher
+            seen = seen_scans(storage.read(path, columns=ATT_COLUMNS))
+            rows = []
+
+            for i, r in zip(records.index, records.itertuples(index=False)):
+                problem = dedupe_problem(seen, r.roll, r.device_id, r.date)
+
+                if problem is not None:
+                    outcome[i] = ("Duplicate" if problem[0] == "warning" else "Rejected", problem[1])
+                    continue
+
+                rows.append(scan_row(owner, r.roll, r.name, r.date, r.device_id, r.token))
+                outcome[i] = ("Accepted", "✅ Attendance Marked Successfully")
+
+            # One write per target file for the whole batch
+            if len(rows) > 0:
+                storage.append_many(path, rows)
+
+    if len(outcome) > 0:
+        done = pd.DataFrame.from_dict(outcome, orient="index", columns=["Result", "Message"])
+        report.loc[done.index, ["Result", "Message"]] = done
+
+    return report
+
+
+# ---------------- CREATE FILES ----------------
+def create_files():
+    # Empty data files with their headers, so a fresh directory works for the app and the CLI
+    empty = {
+        USER_FILE: ["Username", "Password"],
+        ATT_FILE: ATT_COLUMNS,
+        MARKS_FILE: ["Username", "Roll", "Name", "Subject", "Marks"],
+        ASSIGN_FILE: ["Username", "Roll", "Name", "Assignment", "File"],
+        SLIP_FILE: ["Username", "Roll", "Name", "SlipTest", "File", "Marks"],
+        GRADE_CONFIG_FILE: GRADE_CONFIG_COLUMNS,
+        SESSIONS_FILE: SESSION_COLUMNS,
+        ROSTER_FILE: ROSTER_COLUMNS
+    }
+
+    for path, columns in empty.items():
+        if not os.path.exists(path):
+            pd.DataFrame(columns=columns).to_csv(path, index=False)
+
+    os.makedirs(SHARD_DIR, exist_ok=True)
+
+
+# ---------------- WORKING DAYS FUNCTION ----------------
+def get_working_days(start_date, end_date, holidays=None):
+    if holidays is None:
+        holidays = []
+
+    count = 0
+    current = start_date
+
+    while current <= end_date:
+        # weekday(): Monday=0 ... Sunday=6
+        if current.weekday() != 6 and current not in holidays:
+            count += 1
+        current += timedelta(days=1)
+
+    return count
+
+
+# ---------------- ATTENDANCE ----------------
+def with_roster_names(df, roster):
+    # Roll-call rows carry a StudentID and no name; the roster supplies it
+    if "StudentID" not in df.columns or len(df) == 0:
+        return df
+
+    ids = pd.to_numeric(df["StudentID"], errors="coerce").astype("Int64")
+    names = ids.map(roster.set_index(pd.to_numeric(roster["StudentID"]).astype("Int64"))["Name"])
+
+    missing = df["Name"].isna() | (df["Name"] == "")
+    return df.assign(StudentID=ids, Name=df["Name"].where(~missing, names))
+
+
+def attendance_frames(teachers=None, read=storage.read):
+    # Shared file (manual entries, legacy QR scans) plus the teachers' session shards
+    frames = {ATT_FILE: read(ATT_FILE)}
+
+    sessions = read(SESSIONS_FILE, dtype=str)
+    if teachers is not None:
+        sessions = sessions[sessions["Username"].isin(teachers)]
+
+    # A shard is created by its session's first scan
+    for session_id in sessions["SessionID"]:
+        frames[shard_file(session_id)] = read(shard_file(session_id), columns=ATT_COLUMNS)
+
+    return frames
+
+
+def read_attendance(teachers=None, frames=None, read=storage.read):
+    if frames is None:
+        frames = attendance_frames(teachers, read)
+
+    parts = [f for f in frames.values() if len(f) > 0]
+    if len(parts) == 0:
+        return frames[ATT_FILE]
+
+    roster = read(ROSTER_FILE, dtype={"Roll": str, "Name": str, "Section": str})
+    return with_roster_names(pd.concat(parts, ignore_index=True), roster)
+
+
+def attendance_summary(user_data):
+    # Convert Date column to datetime
+    dates = pd.to_datetime(user_data["Date"], errors="coerce")
+
+    # Get academic range
+    all_dates = dates.dropna()
+
+    if len(all_dates) > 0:
+        start_date = all_dates.min().date()
+        end_date = all_dates.max().date()
+    else:
+        start_date = date.today()
+        end_date = date.today()
+
+    # Calculate total working days
+    total_working_days = get_working_days(start_date, end_date)
+
+    # Group by student (only Present count)
+    summary = user_data.assign(Present=user_data["Status"] == "Present").groupby(
+        ["Roll", "Name"]
+    ).agg(
+        Present_Days=("Present", "sum")
+    ).reset_index()
+
+    # Add Total Days column (same for all students)
+    summary["Total_Days"] = total_working_days
+
+    # Calculate Percentage
+    summary["Percentage"] = round(
+        (summary["Present_Days"] / summary["Total_Days"]) * 100, 2
+    )
+
+    # Regular / Non-Regular
+    summary["Status"] = np.where(summary["Percentage"] >= 50, "Regular", "Non-Regular")
+
+    return summary
+
+
+def attendance_summaries(read=storage.read):
+    # Every teacher's summary over their own rows plus QR scans, as the Attendance page shows it
+    df = read_attendance(read=read)
+    teachers = set(read(USER_FILE)["Username"].dropna()) | set(df["Username"].dropna())
+    teachers.discard("QR-STUDENT")
+
+    result = {}
+
+    for user in sorted(teachers):
+        user_data = df[(df["Username"] == user) | (df["Username"] == "QR-STUDENT")]
+
+        if len(user_data) > 0:
+            result[user] = attendance_summary(user_data)
+
+    return result
+
+
+# ---------------- ATTENDANCE INDEX ----------------
+# One bitset per (teacher, date) over dense student ids (bit i = ids["rolls"][i]).
+# "present" holds who was present, "marked" who had any row that day.
+# "files": per attendance file, the rows indexed so far and its storage.content_versions entry.
+def empty_attendance_index():
+    return {"rolls": [], "ids": {}, "present": {}, "marked": {}, "files": {}}
+
+
+def to_bitset(ids):
+    if len(ids) == 0:
+        return 0
+
+    flags = np.zeros(int(max(ids)) + 1, dtype=bool)
+    flags[np.asarray(ids, dtype=int)] = True
+    return int.from_bytes(np.packbits(flags, bitorder="little").tobytes(), "little")
+
+
+def bitset_ids(bits):
+    data = np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(data, bitorder="little"))
+
+
+def bitset_rolls(index, bits):
+    return [index["rolls"][i] for i in bitset_ids(bits)]
+
+
+def index_attendance(index, df):
+    # Applies rows in file order: a later row for the same (teacher, roll, date) replaces the earlier one
+    if len(df) == 0:
+        return
+
+    df = clean_rolls(df)
+    df = df.assign(Date=pd.to_datetime(df["Date"], errors="coerce").dt.strftime("%Y-%m-%d"))
+    df = df.dropna(subset=["Username", "Date"]).drop_duplicates(["Username", "Roll", "Date"], keep="last")
+
+    for roll in df["Roll"].unique():
+        if roll not in index["ids"]:
+            index["ids"][roll] = len(index["rolls"])
+            index["rolls"].append(roll)
+
+    df = df.assign(ID=df["Roll"].map(index["ids"]), Present=df["Status"] == "Present")
+
+    for (owner, day), group in df.groupby(["Username", "Date"]):
+        present = to_bitset(group.loc[group["Present"], "ID"])
+        absent = to_bitset(group.loc[~group["Present"], "ID"])
+
+        days = index["present"].setdefault(owner, {})
+        days[day] = (days.get(day, 0) | present) & ~absent
+
+        marked = index["marked"].setdefault(owner, {})
+        marked[day] = marked.get(day, 0) | present | absent
+
+
+def attendance_paths(read=storage.read):
+    # Every file attendance rows live in: the shared file plus one shard per session
+    return [ATT_FILE] + [shard_file(s) for s in read(SESSIONS_FILE, dtype=str)["SessionID"]]
+
+
+def refresh_attendance_index(index, paths, read=storage.read):
+    # Only files whose content version moved are read, and only their rows past the indexed count.
+    # A rewrite, a file gone, or an in-place update not seen on the write path reindexes everything.
+    # Returns True when the index changed.
+    files = index["files"]
+    versions = {path: list(v) for path, v in storage.content_versions(*paths).items()}
+
+    changed = [path for path in paths if files.get(path, {}).get("version") != versions[path]]
+
+    rebuild = any(path not in versions for path in files) or any(
+        path in files and files[path]["version"][1:] != versions[path][1:]
+        for path in changed
+    )
+
+    if rebuild:
+        index.update(empty_attendance_index())
+        files = index["files"]
+        changed = list(paths)
+
+    for path in changed:
+        df = read(path, columns=ATT_COLUMNS)
+        rows = files.get(path, {}).get("rows", 0)
+
+        index_attendance(index, df.iloc[rows if len(df) >= rows else 0:])
+        files[path] = {"rows": len(df), "version": versions[path]}
+
+    return rebuild or len(changed) > 0
+
+
+def index_written(index, path, rows, before, after):
+    # Write path: `rows` were just saved to `path`, moving its content version from `before` to
+    # `after` (both taken under the write's lock), so they go into the index without rereading
+    # the file. Rows past the indexed count are indexed again by the next refresh; applying a
+    # row twice changes nothing. Returns False when the index was not current before the write.
+    entry = index["files"].get(path)
+
+    if entry is None or entry["version"] != list(before) or before == after:
+        return False
+
+    index_attendance(index, pd.DataFrame(rows))
+    entry["version"] = list(after)
+    return True
+
+
+def sync_attendance_index(read=storage.read):
+    # For writers outside the app (CLI, scan service): bring the saved index up to date
+    index = load_attendance_index()
+
+    if refresh_attendance_index(index, attendance_paths(read), read):
+        save_attendance_index(index)
+
+    return index
+
+
+def load_attendance_index(path=ATT_INDEX_FILE):
+    try:
+        with open(path, "rb") as f:
+            data = json.loads(zlib.decompress(f.read()))
+    except (OSError, ValueError, zlib.error):
+        return empty_attendance_index()
+
+    # Saved before files were tracked by content version: rebuilt on the next refresh
+    if "files" not in data:
+        return empty_attendance_index()
+
+    for kind in ["present", "marked"]:
+        data[kind] = {
+            owner: {day: int(bits, 16) for day, bits in days.items()}
+            for owner, days in data[kind].items()
+        }
+
+    data["ids"] = {roll: i for i, roll in enumerate(data["rolls"])}
+    return data
+
+
+def save_attendance_index(index, path=ATT_INDEX_FILE):
+    data = {
+        "rolls": index["rolls"],
+        "files": index["files"],
+        **{
+            kind: {owner: {day: format(bits, "x") for day, bits in days.items()} for owner, days in index[kind].items()}
+            for kind in ["present", "marked"]
+        }
+    }
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(zlib.compress(json.dumps(data).encode(), 6))
+    os.replace(tmp, path)
+
+
+# ---------------- ATTENDANCE QUERIES ----------------
+# A teacher's view includes QR scans, as on the Attendance page
+def index_owners(teacher):
+    return [teacher, "QR-STUDENT"]
+
+
+def index_days(index, teacher):
+    # Days attendance was taken
+    return sorted({day for owner in index_owners(teacher) for day in index["marked"].get(owner, {})})
+
+
+def day_bits(index, teacher, day, kind="present"):
+    bits = 0
+    for owner in index_owners(teacher):
+        bits |= index[kind].get(owner, {}).get(day, 0)
+    return bits
+
+
+def class_bits(index, teacher):
+    # Every student with a row on any day
+    bits = 0
+    for owner in index_owners(teacher):
+        for day_marked in index["marked"].get(owner, {}).values():
+            bits |= day_marked
+    return bits
+
+
+def absent_bits(index, teacher, day, students=None):
+    if students is None:
+        students = class_bits(index, teacher)
+    return students & ~day_bits(index, teacher, day)
+
+
+def absent_on_all(index, teacher, days):
+    students = class_bits(index, teacher)
+    bits = students
+    for day in days:
+        bits &= absent_bits(index, teacher, day, students)
+    return bits
+
+
+def absent_on_any(index, teacher, days):
+    students = class_bits(index, teacher)
+    bits = 0
+    for day in days:
+        bits |= absent_bits(index, teacher, day, students)
+    return bits
+
+
+def present_not(index, teacher, day, other_day):
+    return day_bits(index, teacher, day) & ~day_bits(index, teacher, other_day)
+
+
+def absence_streaks(index, teacher, length):
+    # Students absent on `length` consecutive days attendance was taken: (at any point, up to the latest day)
+    # runs[j] holds who has been absent on at least the last j + 1 days
+    students = class_bits(index, teacher)
+    runs = [0] * length
+    hit = 0
+
+    for day in index_days(index, teacher):
+        absent = absent_bits(index, teacher, day, students)
+        runs = [absent] + [run & absent for run in runs[:-1]]
+        hit |= runs[-1]
+
+    return hit, runs[-1]
+
+
+# ---------------- GRADING ENGINE ----------------
+# Weight of each component in the final grade (per teacher, per subject)
+GRADE_COMPONENTS = ["Marks", "Assignments", "SlipTests", "Attendance"]
+GRADE_CONFIG_COLUMNS = ["Username", "Subject"] + GRADE_COMPONENTS + ["Bands"]
+DEFAULT_WEIGHTS = {"Marks": 60, "Assignments": 15, "SlipTests": 15, "Attendance": 10}
+# "min score:grade" pairs, highest first
+DEFAULT_BANDS = "90:O,80:A+,70:A,60:B+,50:B,40:C,35:P,0:F"
+ALL_SUBJECTS = "*"
+GRADE_RESULT_COLUMNS = [
+    "Username", "Roll", "Name", "Subject"
+] + GRADE_COMPONENTS + ["Final", "Grade", "Fingerprint"]
+
+
+def clean_rolls(df):
+    df = df.assign(Roll=df["Roll"].fillna("").astype(str))
+    return df[df["Roll"] != ""]
+
+
+def parse_bands(text):
+    bands = []
+
+    for part in text.split(","):
+        cutoff, grade = part.split(":")
+        bands.append((float(cutoff), grade.strip()))
+
+    if len(bands) == 0:
+        raise ValueError("No grade bands")
+
+    return sorted(bands)
+
+
+def attendance_percentages(att_df, teachers):
+    att_df = clean_rolls(att_df)
+
+    # QR scans are not tied to a teacher, so every teacher sees them
+    own = att_df[att_df["Username"].isin(teachers)]
+    qr = att_df[att_df["Username"] == "QR-STUDENT"].drop(columns="Username")
+    qr = qr.merge(pd.DataFrame({"Username": list(teachers)}), how="cross")
+
+    rows = pd.concat([own, qr], ignore_index=True)
+    rows["Date"] = pd.to_datetime(rows["Date"], errors="coerce")
+    rows = rows.dropna(subset=["Date"])
+
+    if len(rows) == 0:
+        # Keep Attendance numeric so the grade fingerprints don't depend on who else has scans
+        return pd.DataFrame(columns=["Username", "Roll", "Attendance"]).astype({"Attendance": float})
+
+    # Same rule as get_working_days(): every day except Sunday, both ends included
+    span = rows.groupby("Username")["Date"].agg(["min", "max"])
+    span["Working_Days"] = np.busday_count(
+        span["min"].values.astype("datetime64[D]"),
+        span["max"].values.astype("datetime64[D]") + np.timedelta64(1, "D"),
+        weekmask="1111110"
+    )
+
+    present = rows[rows["Status"] == "Present"].drop_duplicates(["Username", "Roll", "Date"])
+    result = rows[["Username", "Roll"]].drop_duplicates().merge(
+        present.groupby(["Username", "Roll"]).size().rename("Present_Days").reset_index(),
+        on=["Username", "Roll"],
+        how="left"
+    ).fillna({"Present_Days": 0})
+
+    working = result["Username"].map(span["Working_Days"]).clip(lower=1)
+    result["Attendance"] = (result["Present_Days"] / working * 100).clip(upper=100)
+
+    return result[["Username", "Roll", "Attendance"]]
+
+
+def component_scores(df, column):
+    # Assignments and slip-tests are marked out of 10, scale them to 100
+    df = clean_rolls(df)
+
+    # Assignments get a Marks column only once the first one is evaluated
+    if "Marks" not in df.columns:
+        df = df.assign(Marks=np.nan)
+
+    scores = (pd.to_numeric(df["Marks"], errors="coerce") * 10).clip(0, 100)
+
+    return scores.groupby([df["Username"], df["Roll"]]).mean().rename(column).reset_index()
+
+
+def load_grade_config(read=storage.read):
+    config = read(GRADE_CONFIG_FILE, dtype={"Username": str, "Subject": str, "Bands": str})
+    config = config.drop_duplicates(["Username", "Subject"], keep="last")
+
+    for comp in GRADE_COMPONENTS:
+        config[comp] = pd.to_numeric(config[comp], errors="coerce")
+
+    return config
+
+
+def resolve_grade_config(pairs, config):
+    config = config.rename(columns={c: "W_" + c for c in GRADE_COMPONENTS})
+    cols = ["W_" + c for c in GRADE_COMPONENTS] + ["Bands"]
+
+    # Subject specific row first, then the teacher default, then app defaults
+    exact = pairs.merge(config, on=["Username", "Subject"], how="left")
+    default = pairs[["Username"]].merge(
+        config[config["Subject"] == ALL_SUBJECTS].drop(columns="Subject"),
+        on="Username",
+        how="left"
+    )
+
+    resolved = pairs.copy()
+
+    for col in cols:
+        resolved[col] = exact[col].fillna(default[col])
+
+    for comp in GRADE_COMPONENTS:
+        resolved["W_" + comp] = resolved["W_" + comp].fillna(DEFAULT_WEIGHTS[comp])
+
+    resolved["Bands"] = resolved["Bands"].fillna(DEFAULT_BANDS)
+
+    return resolved
+
+
+def apply_grade_bands(final, bands_col):
+    grades = pd.Series("", index=final.index, dtype=object)
+
+    for bands_text, idx in final.groupby(bands_col).groups.items():
+        bands = parse_bands(bands_text)
+        cutoffs = np.array([b[0] for b in bands])
+        labels = np.array([b[1] for b in bands], dtype=object)
+
+        pos = np.searchsorted(cutoffs, final.loc[idx].to_numpy(float), side="right") - 1
+        grades.loc[idx] = labels[pos.clip(min=0)]
+
+    grades[final.isna()] = ""
+    return grades
+
+
+def grade_inputs(teachers=None, read=storage.read):
+    marks_df = clean_rolls(read(MARKS_FILE))
+
+    if teachers is not None:
+        marks_df = marks_df[marks_df["Username"].isin(teachers)]
+
+    teachers = marks_df["Username"].unique()
+
+    # One row per (teacher, student, subject)
+    inputs = marks_df.groupby(["Username", "Roll", "Subject"]).agg(
+        Name=("Name", "last"),
+        Marks=("Marks", "mean")
+    ).reset_index()
+
+    inputs = inputs.merge(
+        component_scores(read(ASSIGN_FILE), "Assignments"),
+        on=["Username", "Roll"], how="left"
+    ).merge(
+        component_scores(read(SLIP_FILE), "SlipTests"),
+        on=["Username", "Roll"], how="left"
+    ).merge(
+        attendance_percentages(read_attendance(teachers, read=read), teachers),
+        on=["Username", "Roll"], how="left"
+    )
+
+    inputs = resolve_grade_config(inputs, load_grade_config(read))
+
+    # Any change in a student's scores, weights or bands changes the fingerprint
+    inputs["Fingerprint"] = pd.util.hash_pandas_object(inputs, index=False).map("{:016x}".format)
+
+    return inputs
+
+
+def compute_grades(rows):
+    scores = rows[GRADE_COMPONENTS].to_numpy(float)
+    weights = rows[["W_" + c for c in GRADE_COMPONENTS]].to_numpy(float)
+
+    # A missing component (e.g. no slip-tests yet) does not count against the student
+    weights = np.where(np.isnan(scores), 0, weights)
+    total = weights.sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        final = np.nansum(scores * weights, axis=1) / total
+
+    rows = rows.copy()
+    rows["Final"] = np.where(total > 0, final.round(2), np.nan)
+    rows["Grade"] = apply_grade_bands(rows["Final"], rows["Bands"])
+
+    return rows
+
+
+def grade_versions(read=storage.read):
+    # Inputs every teacher shares, then each session shard with its teacher
+    sessions = read(SESSIONS_FILE, dtype=str)
+    owners = dict(zip(map(shard_file, sessions["SessionID"]), sessions["Username"]))
+    shared = [MARKS_FILE, ASSIGN_FILE, SLIP_FILE, ATT_FILE, GRADE_CONFIG_FILE]
+
+    versions = {path: list(v) for path, v in storage.content_versions(*shared, *owners).items()}
+    return versions, shared, owners
+
+
+def load_grades_state():
+    try:
+        with open(GRADES_VERSION_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def stale_teachers(teachers, state, versions, shared, owners):
+    # Teachers whose cached grades may be out of date; None when every teacher in scope is
+    if state is None or not os.path.exists(GRADES_FILE):
+        return None
+
+    seen = state["versions"]
+    if any(seen.get(path) != versions[path] for path in shared):
+        return None
+
+    covered = state["teachers"]
+    if covered != "*" and (teachers is None or not set(teachers) <= set(covered)):
+        return None
+
+    # Only session shards changed: just their teachers, in scope or not, so the saved versions hold for all
+    return {owners[path] for path in owners if seen.get(path) != versions[path]}
+
+
+def compute_final_grades(teachers=None, read=storage.read, write=storage.rewrite):
+    # Only teachers whose inputs changed are re-extracted, and of those only students whose
+    # fingerprint changed are regraded; returns (grades, regraded count)
+    keys = ["Username", "Roll", "Subject", "Fingerprint"]
+
+    # Versions first: a save landing while this runs is seen as a change next time
+    versions, shared, owners = grade_versions(read)
+    state = load_grades_state()
+    stale = stale_teachers(teachers, state, versions, shared, owners)
+
+    if os.path.exists(GRADES_FILE):
+        cached = read(GRADES_FILE, dtype={"Roll": str, "Fingerprint": str})
+    else:
+        cached = pd.DataFrame(columns=GRADE_RESULT_COLUMNS)
+
+    # Nothing changed since the last run
+    if stale is not None and len(stale) == 0:
+        result = cached if teachers is None else cached[cached["Username"].isin(teachers)]
+        return result.reset_index(drop=True), 0
+
+    scope = teachers if stale is None else sorted(stale)
+    inputs = grade_inputs(scope, read)
+
+    merged = inputs.merge(
+        cached[keys + ["Final", "Grade"]], on=keys, how="left", indicator=True
+    )
+    changed = (merged["_merge"] == "left_only").to_numpy()
+
+    fresh = compute_grades(inputs[changed])
+    reused = merged[~changed].drop(columns="_merge")
+
+    result = pd.concat([reused, fresh], ignore_index=True)[GRADE_RESULT_COLUMNS]
+
+    # Keep cached rows of teachers outside this run
+    if scope is not None:
+        others = cached[~cached["Username"].isin(scope)]
+        to_save = pd.concat([others, result], ignore_index=True)[GRADE_RESULT_COLUMNS]
+    else:
+        to_save = result
+
+    to_save = to_save.sort_values(["Username", "Roll", "Subject"]).reset_index(drop=True)
+
+    if stale is None:
+        covered = "*" if teachers is None else sorted(teachers)
+    else:
+        covered = state["teachers"]
+
+    with storage.rewriting():
+        if changed.any() or len(to_save) != len(cached):
+            write(GRADES_FILE, to_save)
+        storage.write_atomic(GRADES_VERSION_FILE, json.dumps({"versions": versions, "teachers": covered}))
+
+    if teachers is not None:
+        to_save = to_save[to_save["Username"].isin(teachers)]
+
+    return to_save.reset_index(drop=True), int(changed.sum())
+
+
+# ---------------- RECORDS ----------------
+# Per record type: file, dedupe index, columns a repeat may change, columns written
+RECORD_TYPES = {
+    "attendance": {
+        "file": ATT_FILE, "keys": ["Username", "Roll", "Date"], "update": ["Name", "Status"],
+        "columns": ["Username", "Roll", "Name", "Date", "Status", "DeviceID"], "max_marks": None
+    },
+    "marks": {
+        "file": MARKS_FILE, "keys": ["Username", "Roll", "Subject"], "update": ["Marks"],
+        "columns": ["Username", "Roll", "Name", "Subject", "Marks"], "max_marks": 100
+    },
+    "assignments": {
+        "file": ASSIGN_FILE, "keys": ["Username", "Roll", "Assignment"], "update": ["Name", "Marks"],
+        "columns": ["Username", "Roll", "Name", "Assignment", "File", "Marks"], "max_marks": 10
+    },
+    "slip_tests": {
+        "file": SLIP_FILE, "keys": ["Username", "Roll", "SlipTest"], "update": ["Name", "Marks"],
+        "columns": ["Username", "Roll", "Name", "SlipTest", "File", "Marks"], "max_marks": 10
+    }
+}
+
+
+def entry_problem(roll, name, title, marks=None, max_marks=10):
+    # Same checks, in the same order, as the forms
+    if not is_valid_roll(roll):
+        return "error", "❌ Invalid Roll No format (Example: 12345-CSE-001)"
+
+    if marks is not None and (marks < 0 or marks > max_marks):
+        return "error", f"❌ Marks must be between 0 and {max_marks}"
+
+    if roll.strip() == "" or name.strip() == "" or title.strip() == "":
+        return "warning", "Please fill all fields"
+
+    return None
+
+
+def save_unique(path, keys, row, update, read=storage.read):
+    # Dedupe index on `keys`: one row per key. Returns "saved", "updated" or "unchanged"
+    with storage.exclusive():
+        df = read(path, dtype=str)
+
+        match = pd.Series(len(df) > 0, index=df.index)
+        for col, key in keys.items():
+            match &= df[col] == str(key)
+
+        if not match.any():
+            storage.append(path, row)
+            return "saved"
+
+        if all((df.loc[match, col] == str(row[col])).all() for col in update if col in df.columns):
+            return "unchanged"
+
+        storage.upsert(path, keys, row, update)
+        return "updated"
+
+
+def import_records(kind, df, teacher=None):
+    # Bulk version of the forms: same normalization, checks and dedupe index, one append for all new keys
+    spec = RECORD_TYPES[kind]
+    keys, update = spec["keys"], spec["update"]
+    title = keys[-1]
+
+    df = df.fillna("").astype(str)
+    if teacher is not None:
+        df = df.assign(Username=teacher)
+
+    needed = keys + ["Name", "Status" if spec["max_marks"] is None else "Marks"]
+    missing = [c for c in needed if c not in df.columns]
+    if len(missing) > 0:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    rows = pd.DataFrame({c: df[c].str.strip() if c in df.columns else "" for c in spec["columns"]}, index=df.index)
+    rows["Username"] = rows["Username"].str.lower()
+    rows["Roll"] = rows["Roll"].str.upper()
+    rows["Name"] = rows["Name"].str.title()
+
+    if title == "Date":
+        rows["Date"] = pd.to_datetime(rows["Date"], errors="coerce").dt.strftime("%Y-%m-%d").fillna("")
+    else:
+        rows[title] = rows[title].str.title()
+
+    if "File" in rows.columns:
+        rows["File"] = rows["File"].where(rows["File"] != "", "No File")
+
+    reasons = pd.Series("", index=rows.index)
+
+    def reject(mask, reason):
+        reasons[mask & (reasons == "")] = reason
+
+    reject(rows[["Username", "Roll", "Name", title]].eq("").any(axis=1), "missing field")
+    reject(~rows["Roll"].str.fullmatch(ROLL_PATTERN), "invalid roll")
+
+    if spec["max_marks"] is None:
+        rows["Status"] = rows["Status"].str.title()
+        reject(~rows["Status"].isin(["Present", "Absent"]), "invalid status")
+    else:
+        marks = pd.to_numeric(rows["Marks"], errors="coerce")
+        reject(marks.isna() | (marks < 0) | (marks > spec["max_marks"]), "invalid marks")
+
+    rejected = df[reasons != ""].assign(Reason=reasons[reasons != ""])
+    rows = rows[reasons == ""]
+
+    # Within the file the last entry per key wins, as a later form submission would
+    dup = rows.duplicated(keys, keep="last")
+    rows = rows[~dup]
+
+    with storage.exclusive():
+        current = storage.read(spec["file"], dtype=str, keep_default_na=False)
+        current = current.reindex(columns=list(dict.fromkeys(list(current.columns) + keys + update)), fill_value="")
+        current = current.drop_duplicates(keys, keep="last")[keys + update]
+
+        merged = rows.merge(current, on=keys, how="left", suffixes=("", "_old"), indicator=True)
+        new = (merged["_merge"] == "left_only").to_numpy()
+        changed = ~new & (merged[update].to_numpy() != merged[[c + "_old" for c in update]].to_numpy()).any(axis=1)
+
+        if new.any():
+            storage.append_many(spec["file"], merged.loc[new, spec["columns"]].to_dict("records"))
+
+        for row in merged.loc[changed, spec["columns"]].to_dict("records"):
+            storage.upsert(spec["file"], {k: row[k] for k in keys}, row, update)
+
+    return {
+        "added": int(new.sum()),
+        "updated": int(changed.sum()),
+        "unchanged": int((~new & ~changed).sum()),
+        "duplicates": int(dup.sum()),
+        "rejected": rejected
+    }
@@ -0,0 +1,140 @@
+import os
+import re
+import html
+import base64
+import zipfile
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+# ---------------- SETTINGS ----------------
+REPORTS_DIR = "reports"
+# Fewer students than this render in-process; a pool costs more to start than it saves
+MIN_PARALLEL = 20
+# Students handed to a worker at a time
+CHUNK_SIZE = 8
+
+
+# ---------------- CHARTS ----------------
+_figure = {}
+
+
+def chart_axes():
+    # One figure per process, cleared between charts; creating figures dominates render time
+    if "fig" not in _figure:
+        fig, ax = plt.subplots(figsize=(6, 2.8))
+        fig.subplots_adjust(bottom=0.3)
+        _figure.update(fig=fig, ax=ax)
+
+    _figure["ax"].clear()
+    return _figure["fig"], _figure["ax"]
+
+
+def chart_png(labels, values, title, color):
+    fig, ax = chart_axes()
+    ax.bar(labels, values, color=color)
+    ax.set_ylim(0, max([100] + list(values)))
+    ax.set_title(title)
+    ax.tick_params(axis="x", labelrotation=30)
+
+    buf = BytesIO()
+    fig.savefig(buf, format="png", dpi=80)
+
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def img(png):
+    return f'<img src="data:image/png;base64,{png}">'
+
+
+def table(headers, rows):
+    head = "".join(f"<th>{html.escape(str(h))}</th>" for h in headers)
+    body = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(str(v))}</td>" for v in row) + "</tr>"
+        for row in rows
+    )
+
+    if len(rows) == 0:
+        body = f'<tr><td colspan="{len(headers)}">No records</td></tr>'
+
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+# ---------------- RENDER ----------------
+STYLE = """
+body { font-family: sans-serif; margin: 30px; color: #222; }
+h1 { color: #1f4037; }
+table { border-collapse: collapse; margin-bottom: 20px; }
+th, td { border: 1px solid #ccc; padding: 4px 10px; text-align: left; }
+th { background: #99f2c8; }
+"""
+
+
+def render_report(student):
+    # student: plain dict built by the app, so it can be sent to a worker process
+    sections = [
+        f"<h1>Report Card: {html.escape(student['name'])}</h1>",
+        f"<p><b>Roll:</b> {html.escape(student['roll'])} &nbsp; "
+        f"<b>Teacher:</b> {html.escape(student['teacher'])}</p>",
+        f"<h2>Attendance: {student['attendance']:.2f}%</h2>",
+        "<h2>Marks</h2>",
+        table(["Subject", "Marks", "Final", "Grade"], student["marks"])
+    ]
+
+    if len(student["marks"]) > 0:
+        sections.append(img(chart_png(
+            [r[0] for r in student["marks"]], [float(r[1]) for r in student["marks"]],
+            "Marks by Subject", "#1f4037"
+        )))
+
+    sections += [
+        "<h2>Assignments</h2>",
+        table(["Assignment", "File", "Marks"], student["assignments"]),
+        "<h2>Slip Tests</h2>",
+        table(["Slip Test", "Marks"], student["slip_tests"])
+    ]
+
+    if len(student["slip_tests"]) > 0:
+        sections.append(img(chart_png(
+            [r[0] for r in student["slip_tests"]], [float(r[1]) for r in student["slip_tests"]],
+            "Slip Tests", "#99c2f2"
+        )))
+
+    page = f"<html><head><meta charset='utf-8'><style>{STYLE}</style></head><body>{''.join(sections)}</body></html>"
+    name = "/".join(re.sub(r"[^\w-]", "_", p) for p in (student["teacher"], student["roll"])) + ".html"
+
+    return name, page
+
+
+# ---------------- BATCH ----------------
+def generate_reports(students, path, workers=None, progress=None):
+    # Renders in parallel and writes each report into the zip as soon as it is ready
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    total = len(students)
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        if total < MIN_PARALLEL:
+            results = map(render_report, students)
+            pool = None
+        else:
+            # spawn: workers must not inherit the server's threads and locks
+            pool = ProcessPoolExecutor(
+                max_workers=workers or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            results = pool.map(render_report, students, chunksize=CHUNK_SIZE)
+
+        try:
+            for done, (name, page) in enumerate(results, 1):
+                zf.writestr(name, page)
+
+                if progress is not None:
+                    progress(done, total)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    return path
@@ -0,0 +1,445 @@
+import os
+
+# Runs next to the Streamlit app on the same data directory, so both must lock across processes.
+# Start the app with STORAGE_MODE=shared as well.
+os.environ.setdefault("STORAGE_MODE", "shared")
+
+import json
+import html
+import time
+import asyncio
+import logging
+import base64
+import argparse
+from io import BytesIO
+from datetime import date
+from urllib.parse import parse_qs, urlsplit, urlencode
+import qrcode
+import storage
+from core import (
+    ATT_FILE, ATT_COLUMNS, SESSIONS_FILE, QR_EXPIRY, normalize_roll, normalize_name, generate_token, token_slot,
+    find_session, shard_file, scan_row, write_live_scan, scan_event, offline_record,
+    used_tokens, save_replay_slots, token_problem, scan_fields_problem, seen_scans, dedupe_problem,
+    sync_attendance_index
+)
+
+# ---------------- SETTINGS ----------------
+HOST = os.environ.get("SCAN_SERVICE_HOST", "127.0.0.1")
+PORT = int(os.environ.get("SCAN_SERVICE_PORT", "8600"))
+# Scans waiting for the writer; beyond this clients are asked to retry
+QUEUE_SIZE = 10_000
+# Scans checked and saved per storage lock / journal record
+BATCH_SIZE = 500
+MAX_BODY = 16 * 1024
+RETRY_AFTER = 5
+SUBMIT_TIMEOUT = 30
+
+logger = logging.getLogger("smart_teacher.scan_service")
+
+stats = {"received": 0, "accepted": 0, "rejected": 0, "busy": 0, "batches": 0}
+_sessions = {"version": None, "df": None}
+# Capture mode: scans are signed and appended to this batch file instead of storage
+_capture = {"path": None, "session": None, "seen": None}
+
+
+# ---------------- VALIDATION ----------------
+def load_sessions():
+    # Registry is re-read only when it changes
+    version = storage.file_version(SESSIONS_FILE)
+
+    if _sessions["version"] != version:
+        _sessions.update(version=version, df=storage.read(SESSIONS_FILE, dtype=str))
+
+    return _sessions["df"]
+
+
+def body_fields(body, as_json):
+    # Form or JSON object of strings; None for anything else (answered with 400)
+    if not as_json:
+        return {k: v[-1] for k, v in parse_qs(body).items()}
+
+    try:
+        fields = json.loads(body)
+    except ValueError:
+        return None
+
+    if not isinstance(fields, dict) or not all(isinstance(v, str) for v in fields.values()):
+        return None
+
+    return fields
+
+
+def prepare(fields):
+    # Cheap checks before queueing; returns (scan, None) or (None, (level, message))
+    token = fields.get("token", "")
+    session_id = fields.get("session") or None
+    teacher = "QR-STUDENT"
+
+    if token == "" or fields.get("date", "") == "":
+        return None, ("error", "Invalid QR Code")
+
+    # Offline, the session registry can't be reached; the server checks the session when syncing
+    if session_id is not None and _capture["path"] is None:
+        session = find_session(session_id, load_sessions())
+
+        # The token signs only the session and slot, so the date has to match the session's
+        if session is None or fields["date"] != session["Date"]:
+            return None, ("error", "Invalid QR Code")
+
+        teacher = session["Username"]
+
+    slot = token_slot(token, session_id)
+
+    if slot is None:
+        return None, ("error", "❌ QR Code Expired. Please scan again.")
+
+    return {
+        "roll": normalize_roll(fields.get("roll", "")),
+        "name": normalize_name(fields.get("name", "")),
+        "date": fields["date"],
+        "device_id": fields.get("device_id", ""),
+        "token": token,
+        "slot": slot,
+        "session": session_id,
+        "teacher": teacher,
+        "file": ATT_FILE if session_id is None else shard_file(session_id)
+    }, None
+
+
+# ---------------- INGEST ----------------
+def ingest(batch):
+    # One storage lock and one journal record per target file for the whole batch
+    results = [None] * len(batch)
+
+    by_file = {}
+    for i, scan in enumerate(batch):
+        by_file.setdefault(scan["file"], []).append(i)
+
+    with storage.exclusive():
+        slots = None
+
+        for path, indexes in by_file.items():
+            df = storage.read(path, columns=ATT_COLUMNS)
+
+            # Replay cache and dedupe keys built once per file, then checked per scan in memory
+            slots = used_tokens(df, batch[indexes[0]]["session"], slots)
+            seen = seen_scans(df)
+            rows = []
+
+            for i in indexes:
+                scan = batch[i]
+                day = str(scan["date"])
+
+                results[i] = (
+                    token_problem(slots, scan["token"], scan["slot"]) or
+                    scan_fields_problem(scan["roll"], scan["name"]) or
+                    dedupe_problem(seen, scan["roll"], scan["device_id"], day)
+                )
+
+                if results[i] is None:
+                    slots.setdefault(scan["slot"], set()).add(scan["token"])
+                    rows.append(scan_row(
+                        scan["teacher"], scan["roll"], scan["name"], day, scan["device_id"], scan["token"]
+                    ))
+
+            if len(rows) > 0:
+                storage.append_many(path, rows)
+
+        # Claimed tokens saved once for the whole batch
+        if slots is not None:
+            save_replay_slots(slots)
+
+    # Keep the saved attendance index current for the app's queries, once per batch
+    if any(result is None for result in results):
+        sync_attendance_index()
+
+    for scan, result in zip(batch, results):
+        if result is None:
+            write_live_scan(scan_event(scan["date"], scan["roll"], scan["name"], scan["device_id"], scan["session"]))
+
+    return results
+
+
+# ---------------- CAPTURE ----------------
+def captured_seen(path):
+    # Dedupe keys of the scans already in the batch file, loaded once
+    if _capture["seen"] is None:
+        _capture["seen"] = {"rolls": set(), "devices": {}}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        dedupe_problem(_capture["seen"], record["roll"], record["device_id"], record["date"])
+
+    return _capture["seen"]
+
+
+def capture(batch):
+    # Same checks as online, against this device's batch file; one append for the whole batch
+    path = _capture["path"]
+    seen = captured_seen(path)
+    results, lines = [], []
+
+    for scan in batch:
+        problem = scan_fields_problem(scan["roll"], scan["name"]) or \
+            dedupe_problem(seen, scan["roll"], scan["device_id"], scan["date"])
+
+        results.append(problem)
+
+        if problem is None:
+            lines.append(json.dumps(offline_record(scan)) + "\n")
+
+    if len(lines) > 0:
+        with open(path, "a") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    return results
+
+
+async def writer(queue):
+    loop = asyncio.get_running_loop()
+
+    while True:
+        items = [await queue.get()]
+
+        while len(items) < BATCH_SIZE and not queue.empty():
+            items.append(queue.get_nowait())
+
+        try:
+            save = ingest if _capture["path"] is None else capture
+            results = await loop.run_in_executor(None, save, [scan for scan, _ in items])
+        except Exception:
+            logger.exception("Scan batch failed")
+            results = [("error", "Server error, please retry")] * len(items)
+
+        stats["batches"] += 1
+
+        for (_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+
+# ---------------- HTTP ----------------
+FORM = """<!doctype html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Student Attendance</title>
+<style>
+body {{ font-family: sans-serif; max-width: 420px; margin: 40px auto; padding: 0 16px; }}
+input, button {{ width: 100%; padding: 10px; margin: 6px 0; font-size: 16px; box-sizing: border-box; }}
+.msg {{ padding: 10px; border-radius: 8px; background: #eef2f3; }}
+</style></head>
+<body>
+<h2>📱 Student Attendance (QR Scan)</h2>
+<p>📅 Date: <b>{date}</b></p>
+{message}
+<form method="post" action="/scan">
+<input type="hidden" name="date" value="{date}">
+<input type="hidden" name="token" value="{token}">
+<input type="hidden" name="session" value="{session}">
+<input type="hidden" name="device_id" id="device_id">
+<input name="roll" placeholder="Roll No" required>
+<input name="name" placeholder="Student Name" required>
+<button type="submit">✅ Mark Present</button>
+</form>
+<script>
+// crypto.randomUUID needs a secure context; a capture laptop serves plain http on the LAN
+function newId() {{
+  if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+  var bytes = new Uint8Array(16);
+  if (window.crypto && crypto.getRandomValues) crypto.getRandomValues(bytes);
+  else for (var i = 0; i < bytes.length; i++) bytes[i] = Math.floor(Math.random() * 256);
+  return Array.prototype.map.call(bytes, function (b) {{ return ("0" + b.toString(16)).slice(-2); }}).join("");
+}}
+var id = localStorage.getItem("device_id") || newId();
+localStorage.setItem("device_id", id);
+document.getElementById("device_id").value = id;
+</script>
+</body></html>"""
+
+
+QR_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><meta http-equiv="refresh" content="{refresh}">
+<title>Offline QR Attendance</title></head>
+<body style="font-family:sans-serif;text-align:center;margin-top:40px">
+<h2>📸 QR Attendance (offline capture)</h2>
+<p>📅 {date}</p>
+<img src="data:image/png;base64,{png}" width="300">
+<p>Students scan this QR to mark attendance</p>
+</body></html>"""
+
+
+def qr_page(base_url, fields):
+    # Classroom screen in capture mode; reloads when the token changes
+    session_id = fields.get("session") or _capture.get("session")
+    query = {"date": fields.get("date", str(date.today())), "token": generate_token(session_id)}
+
+    if session_id is not None:
+        query["session"] = session_id
+
+    buf = BytesIO()
+    qrcode.make(f"{base_url}/scan?{urlencode(query)}").save(buf)
+
+    return QR_PAGE.format(
+        refresh=QR_EXPIRY - int(time.time() % QR_EXPIRY) + 1,
+        date=html.escape(query["date"]),
+        png=base64.b64encode(buf.getvalue()).decode()
+    )
+
+
+def form_page(fields, message=""):
+    return FORM.format(
+        date=html.escape(fields.get("date", "")),
+        token=html.escape(fields.get("token", "")),
+        session=html.escape(fields.get("session", "")),
+        message=f'<p class="msg">{html.escape(message)}</p>' if message else ""
+    )
+
+
+def result_page(message):
+    return (
+        '<!doctype html><html><head><meta charset="utf-8"></head>'
+        f'<body style="font-family:sans-serif;text-align:center;margin-top:60px">'
+        f'<h2>{html.escape(message)}</h2></body></html>'
+    )
+
+
+async def respond(stream, status, body, content_type="text/html; charset=utf-8", headers=None):
+    reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 503: "Service Unavailable"}
+    data = body.encode()
+
+    head = [f"HTTP/1.1 {status} {reasons.get(status, 'OK')}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(data)}", "Connection: close"]
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+
+    stream.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+    await stream.drain()
+
+
+async def handle(reader, stream, queue):
+    try:
+        request = (await reader.readline()).decode("latin-1").split()
+
+        if len(request) < 2:
+            return
+
+        method, target = request[0], request[1]
+        headers = {}
+
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if line == "":
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0) or 0)
+
+        if length > MAX_BODY:
+            await respond(stream, 413, "Too large")
+            return
+
+        body = (await reader.readexactly(length)).decode() if length else ""
+        url = urlsplit(target)
+        fields = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        if method == "GET" and url.path == "/health":
+            await respond(stream, 200, json.dumps({**stats, "queued": queue.qsize()}), "application/json")
+
+        elif method == "GET" and url.path == "/qr" and _capture["path"] is not None:
+            await respond(stream, 200, qr_page(f"http://{headers.get('host', f'{HOST}:{PORT}')}", fields))
+
+        elif method == "GET" and url.path in ("/", "/scan"):
+            await respond(stream, 200, form_page(fields))
+
+        elif method == "POST" and url.path == "/scan":
+            as_json = headers.get("content-type", "").startswith("application/json")
+            posted = body_fields(body, as_json)
+
+            if posted is None:
+                await respond(stream, 400, "Expected a JSON object of strings", "text/plain; charset=utf-8")
+                return
+
+            fields.update(posted)
+            stats["received"] += 1
+
+            scan, problem = prepare(fields)
+            status, headers = 200, {}
+
+            if problem is None:
+                future = asyncio.get_running_loop().create_future()
+
+                try:
+                    queue.put_nowait((scan, future))
+                    problem = await asyncio.wait_for(future, SUBMIT_TIMEOUT)
+                except asyncio.QueueFull:
+                    stats["busy"] += 1
+                    status, headers = 503, {"Retry-After": RETRY_AFTER}
+                    problem = "busy", f"⏳ Too many scans right now. Please retry in {RETRY_AFTER} seconds."
+
+            if problem is None:
+                stats["accepted"] += 1
+                level, message = "ok", "✅ Attendance Marked Successfully"
+
+                if _capture["path"] is not None:
+                    message = "✅ Attendance captured. It will be synced when the class is back online."
+            else:
+                stats["rejected"] += status == 200
+                level, message = problem
+
+            if as_json:
+                await respond(stream, status, json.dumps({"status": level, "message": message}), "application/json", headers)
+            else:
+                await respond(stream, status, result_page(message), headers=headers)
+
+        else:
+            await respond(stream, 404, "Not found")
+
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError, asyncio.TimeoutError):
+        pass
+    finally:
+        stream.close()
+
+
+async def serve(host, port):
+    queue = asyncio.Queue(QUEUE_SIZE)
+    asyncio.create_task(writer(queue))
+
+    server = await asyncio.start_server(lambda r, w: handle(r, w, queue), host, port)
+    logger.info("Scan service listening on http://%s:%s/scan", host, port)
+
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QR scan ingestion service")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--capture", metavar="FILE",
+                        help="offline mode: save signed scans to FILE, to be uploaded later on the Attendance page")
+    parser.add_argument("--session", help="class session ID shown on the /qr page in offline mode")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.capture is not None:
+        _capture.update(path=args.capture, session=args.session)
+        logger.info("Capturing scans to %s; show http://%s:%s/qr to the class", args.capture, args.host, args.port)
+        asyncio.run(serve(args.host, args.port))
+        return
+
+    # Replay unflushed records and keep flushing in the background, like the app does
+    try:
+        storage.start()
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+import joblib
+import storage
+
+# ---------------- SETTINGS ----------------
+PRECOMPUTED_DIR = "precomputed"
+# How often the scheduler checks which jobs are due
+SCHEDULER_TICK = 30
+
+_jobs = {}
+_loaded = {}                 # name -> (file stat, entry), so pages don't reload unchanged results
+_lock = threading.Lock()
+_thread = None
+_started = {"computed_at": time.time(), "seq": 0}
+
+logger = logging.getLogger("smart_teacher.scheduler")
+
+
+# ---------------- JOBS ----------------
+def register(name, fn, at=None, every=None, after_writes=None, initial=True):
+    # at: "HH:MM" daily; every: seconds; after_writes: saves since the last run
+    # initial: run as soon as no stored result exists, instead of waiting for a trigger
+    _jobs[name] = {"fn": fn, "at": at, "every": every, "after_writes": after_writes, "initial": initial}
+
+
+def jobs():
+    return dict(_jobs)
+
+
+def output_file(name):
+    return os.path.join(PRECOMPUTED_DIR, f"{name}.joblib")
+
+
+@contextmanager
+def job_lock(name, blocking=True):
+    # One run of a job at a time, across every process sharing the data directory
+    os.makedirs(PRECOMPUTED_DIR, exist_ok=True)
+
+    with open(os.path.join(PRECOMPUTED_DIR, f"{name}.lock"), "a") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# ---------------- RESULTS ----------------
+def load(name):
+    # Latest stored result: {"version", "computed_at", "seq", "seconds", "value"}, or None
+    path = output_file(name)
+    stat = storage.file_stat(path)
+
+    if stat is None:
+        return None
+
+    with _lock:
+        cached = _loaded.get(name)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+
+    entry = joblib.load(path)
+
+    with _lock:
+        _loaded[name] = (stat, entry)
+
+    return entry
+
+
+def store(name):
+    # Caller holds the job lock
+    previous = load(name)
+    seq = storage.sequence()
+    start = time.time()
+
+    value = _jobs[name]["fn"]()
+
+    entry = {
+        "version": (previous["version"] if previous else 0) + 1,
+        "computed_at": time.time(),
+        "seq": seq,
+        "seconds": round(time.time() - start, 3),
+        "value": value
+    }
+
+    tmp = f"{output_file(name)}.{os.getpid()}.tmp"
+    joblib.dump(entry, tmp)
+    os.replace(tmp, output_file(name))
+
+    return entry
+
+
+def run(name):
+    with job_lock(name):
+        return store(name)
+
+
+# ---------------- TRIGGERS ----------------
+def due(name, entry, now=None):
+    job = _jobs[name]
+    now = time.time() if now is None else now
+
+    if entry is None:
+        if job["initial"]:
+            return True
+
+        # Never run: count triggers from when the scheduler started
+        entry = _started
+
+    if job["every"] is not None and now - entry["computed_at"] >= job["every"]:
+        return True
+
+    if job["at"] is not None:
+        hour, minute = map(int, job["at"].split(":"))
+        today = time.localtime(now)
+        slot = time.mktime((today.tm_year, today.tm_mon, today.tm_mday, hour, minute, 0, 0, 0, -1))
+
+        if now >= slot > entry["computed_at"]:
+            return True
+
+    if job["after_writes"] is not None and storage.sequence() - entry["seq"] >= job["after_writes"]:
+        return True
+
+    return False
+
+
+def run_due():
+    for name in list(_jobs):
+        if not due(name, load(name)):
+            continue
+
+        with job_lock(name, blocking=False) as acquired:
+            # Another process is running it, or finished it while we checked
+            if not acquired or not due(name, load(name)):
+                continue
+
+            try:
+                store(name)
+            except Exception:
+                logger.exception("Precompute job %s failed", name)
+
+
+def loop():
+    while True:
+        try:
+            run_due()
+        except Exception:
+            logger.exception("Scheduler tick failed")
+
+        time.sleep(SCHEDULER_TICK)
+
+
+def start():
+    global _thread
+
+    with _lock:
+        if _thread is not None:
+            return
+
+        _started.update(computed_at=time.time(), seq=storage.sequence())
+
+        _thread = threading.Thread(target=loop, name="precompute-scheduler", daemon=True)
+        _thread.start()
@@ -0,0 +1,534 @@
+import os
+import json
+import fcntl
+import atexit
+import hashlib
+import logging
+import threading
+import uuid
+from contextlib import contextmanager, nullcontext
+import pandas as pd
+
+# ---------------- FILES ----------------
+JOURNAL_FILE = "journal.log"
+MANIFEST_FILE = "journal.manifest"
+LOCK_FILE = "storage.lock"
+# Held for the life of each process: shared by shared-mode processes, exclusive by a local-mode one
+MODE_LOCK_FILE = "storage.mode.lock"
+
+# "local": one server process. "shared": several processes on the same data directory
+STORAGE_MODE = os.environ.get("STORAGE_MODE", "local")
+
+# Background flusher: every FLUSH_INTERVAL seconds, or sooner once FLUSH_BATCH records wait
+FLUSH_INTERVAL = 2
+FLUSH_BATCH = 500
+
+# Lock order: _flush_lock, then file lock, then _lock
+_lock = threading.RLock()        # in-process state and file replacement
+_flush_lock = threading.RLock()  # one flush at a time per process
+_held = threading.local()        # exclusive lock depth of the current thread
+_wake = threading.Event()
+_generation = {}                 # path -> local replace count, lets readers detect a concurrent flush
+_journal = {"header": None, "offset": 0, "records": []}
+_seq = 0
+_flusher = None
+_mode_lock = None
+_start_lock = threading.Lock()
+# Ops that can change rows in place rather than only add them
+UPSERT_OPS = ("upsert", "upsert_many")
+
+logger = logging.getLogger("smart_teacher.storage")
+
+
+# ---------------- HELPERS ----------------
+def file_sha(path):
+    h = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def file_stat(path):
+    if not os.path.exists(path):
+        return None
+
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def write_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+
+
+def read_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+
+    with open(MANIFEST_FILE) as f:
+        return json.load(f)
+
+
+# ---------------- LOCKING ----------------
+def holding_exclusive():
+    return getattr(_held, "depth", 0) > 0
+
+
+@contextmanager
+def file_lock(mode):
+    # flock on a fresh descriptor also excludes other threads of this process
+    with open(LOCK_FILE, "a") as f:
+        fcntl.flock(f.fileno(), mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def exclusive():
+    # Writers: process lock, plus the cross-process file lock in shared mode
+    depth = getattr(_held, "depth", 0)
+
+    if depth == 0 and STORAGE_MODE == "shared":
+        outer = file_lock(fcntl.LOCK_EX)
+    else:
+        outer = nullcontext()
+
+    with outer, _lock:
+        _held.depth = depth + 1
+        try:
+            yield
+        finally:
+            _held.depth = depth
+
+
+@contextmanager
+def rewriting():
+    # exclusive() for a block that also rewrites files: the flush lock is taken first, in the
+    # flusher's order. Taking it inside exclusive() deadlocks against a flush being staged.
+    with _flush_lock, exclusive():
+        yield
+
+
+@contextmanager
+def shared():
+    # Readers: block only while another process replaces files
+    if STORAGE_MODE == "shared" and not holding_exclusive():
+        with file_lock(fcntl.LOCK_SH):
+            yield
+    else:
+        yield
+
+
+# ---------------- JOURNAL ----------------
+def journal_header():
+    # First line of every journal: a fresh nonce per rewrite, since a replaced file can reuse the inode
+    return json.dumps({"journal": uuid.uuid4().hex}) + "\n"
+
+
+def journal_records():
+    # Parsed journal, read incrementally; reloaded when a flush replaced the file (new header)
+    with _lock:
+        try:
+            f = open(JOURNAL_FILE, "rb")
+        except FileNotFoundError:
+            _journal.update(header=None, offset=0, records=[])
+            return []
+
+        with f:
+            header = f.readline()
+            size = os.fstat(f.fileno()).st_size
+
+            if _journal["header"] != header or size < _journal["offset"]:
+                _journal.update(header=header, offset=0, records=[])
+
+            if size > _journal["offset"]:
+                f.seek(_journal["offset"])
+                data = f.read()
+            else:
+                data = b""
+
+        complete = data[:data.rfind(b"\n") + 1]
+
+        for line in complete.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn line from a crash mid-write; that save never returned
+                logger.warning("Skipping unreadable journal line")
+                continue
+
+            if "op" in record:
+                _journal["records"].append(record)
+
+        _journal["offset"] += len(complete)
+
+        return list(_journal["records"])
+
+
+def write_journal(records):
+    write_atomic(JOURNAL_FILE, journal_header() + "".join(json.dumps(r) + "\n" for r in records))
+
+
+# ---------------- APPLY ----------------
+def expand_records(records):
+    # An upsert_many record applies as one upsert per row, in order
+    for record in records:
+        if record["op"] != "upsert_many":
+            yield record
+            continue
+
+        for row in record["rows"]:
+            yield {"op": "upsert", "keys": {k: row[k] for k in record["keys"]}, "row": row, "update": record["update"]}
+
+
+def apply_records(df, records, as_text=False):
+    def value(v):
+        if as_text:
+            return "" if v is None else str(v)
+        return v
+
+    appended = []
+
+    def flush_appends(df):
+        if len(appended) == 0:
+            return df
+
+        rows = pd.DataFrame([{k: value(v) for k, v in r.items()} for r in appended])
+        appended.clear()
+
+        if len(df) == 0:
+            return rows.reindex(columns=list(dict.fromkeys(list(df.columns) + list(rows.columns))))
+
+        return pd.concat([df, rows], ignore_index=True)
+
+    for record in expand_records(records):
+        if record["op"] in ("append", "append_many"):
+            appended.extend(record["rows"])
+            continue
+
+        # upsert: update matching rows, or append when nothing matches
+        df = flush_appends(df)
+
+        match = pd.Series(len(df) > 0, index=df.index)
+        for col, key in record["keys"].items():
+            if col not in df.columns:
+                match &= False
+            else:
+                match &= df[col].astype(str) == str(key)
+
+        if match.any():
+            for col in record.get("update") or record["row"]:
+                df.loc[match, col] = value(record["row"][col])
+        else:
+            appended.append(record["row"])
+
+    return flush_appends(df)
+
+
+# ---------------- WRITE ----------------
+def sequence():
+    # Seq of the latest record written by any process; grows by one per save
+    with shared():
+        return max(
+            [_seq] +
+            [r["seq"] for r in journal_records()[-1:]] +
+            [e["seq"] for e in read_manifest().values()]
+        )
+
+
+def log(record):
+    global _seq
+
+    with exclusive():
+        # Sequence numbers stay increasing across every process sharing the journal
+        _seq = sequence() + 1
+        record["seq"] = _seq
+
+        line = json.dumps(record, default=str) + "\n"
+
+        with open(JOURNAL_FILE, "a") as f:
+            if f.tell() == 0:
+                f.write(journal_header())
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if len(journal_records()) >= FLUSH_BATCH:
+            _wake.set()
+
+    return len(line)
+
+
+def append(path, row):
+    return log({"op": "append", "file": path, "rows": [row]})
+
+
+def append_many(path, rows):
+    return log({"op": "append_many", "file": path, "rows": list(rows)})
+
+
+def upsert(path, keys, row, update=None):
+    return log({"op": "upsert", "file": path, "keys": keys, "row": row, "update": update})
+
+
+def upsert_many(path, keys, rows, update=None):
+    # Several upserts on the same key columns in one journal record (one fsync)
+    return log({"op": "upsert_many", "file": path, "keys": list(keys), "rows": list(rows), "update": update})
+
+
+def append_if(path, row, check, **kwargs):
+    # Duplicate check and append as one step, so two workers can't both pass the check
+    with exclusive():
+        problem = check(read(path, **kwargs))
+
+        if problem is None:
+            append(path, row)
+
+        return problem
+
+
+# ---------------- READ ----------------
+def read(path, columns=None, **kwargs):
+    # The CSV plus every journal record not flushed into it yet.
+    # With columns, a file not created yet reads as empty (its first rows may still be pending)
+    with shared():
+        while True:
+            with _lock:
+                generation = _generation.get(path, 0)
+                records = [r for r in journal_records() if r["file"] == path]
+
+            if columns is not None and not os.path.exists(path):
+                df = pd.DataFrame(columns=columns)
+            else:
+                df = pd.read_csv(path, **kwargs)
+
+            with _lock:
+                if _generation.get(path, 0) == generation:
+                    break
+
+    if len(records) == 0:
+        return df
+
+    # Pending values come back as text too when the file is read as text
+    return apply_records(df, records, as_text=kwargs.get("dtype") is str)
+
+
+def file_version(path):
+    # Changes when this one file is replaced or gets new journal records
+    with _lock:
+        pending = [r["seq"] for r in journal_records() if r["file"] == path]
+
+    return (file_stat(path), len(pending), pending[-1] if pending else 0)
+
+
+def content_versions(*paths):
+    # Per file: (seq of its latest save, rewrites, upserts). Changes when the file's rows change
+    # (a save, or a direct rewrite), but not when a flush only moves journal records into it,
+    # which file_version and mtimes can't tell apart. The upsert count tells in-place updates apart
+    # from appends.
+    with shared(), _lock:
+        records = journal_records()
+        manifest = read_manifest()
+
+    versions = {}
+    for path in paths:
+        pending = [r for r in records if r["file"] == path]
+        entry = manifest.get(path, {})
+
+        versions[path] = (
+            pending[-1]["seq"] if pending else entry.get("seq", 0),
+            entry.get("rewrites", 0),
+            entry.get("upserts", 0) + sum(r["op"] in UPSERT_OPS for r in pending)
+        )
+
+    return versions
+
+
+def content_version(path):
+    return content_versions(path)[path]
+
+
+def version(*paths):
+    # Changes whenever any of the files or the journal changes, in any process
+    return tuple(file_stat(p) for p in paths + (JOURNAL_FILE,))
+
+
+# ---------------- FLUSH ----------------
+def flush(paths=None):
+    with _flush_lock:
+        with shared():
+            batch = [r for r in journal_records() if paths is None or r["file"] in paths]
+
+            by_file = {}
+            for record in batch:
+                by_file.setdefault(record["file"], []).append(record)
+
+            # Taken with the batch: a file replaced after this point already holds some of it
+            stats = {path: file_stat(path) for path in by_file}
+
+        if len(batch) == 0:
+            return 0
+
+        # Build new files outside the lock so saves are never blocked on pandas
+        staged = {}
+        for path, records in by_file.items():
+            before = stats[path]
+
+            if before is not None:
+                df = pd.read_csv(path, dtype=str, keep_default_na=False)
+            else:
+                df = pd.DataFrame()
+
+            df = apply_records(df, records, as_text=True)
+
+            tmp = f"{path}.{os.getpid()}.tmp"
+            df.to_csv(tmp, index=False)
+
+            with open(tmp, "rb+") as f:
+                os.fsync(f.fileno())
+
+            staged[path] = {
+                "tmp": tmp,
+                "before": before,
+                "seq": records[-1]["seq"],
+                "sha": file_sha(tmp),
+                "upserts": sum(r["op"] in UPSERT_OPS for r in records)
+            }
+
+        with exclusive():
+            # Another worker flushed these files first: drop ours and redo it from its result,
+            # still holding the lock so the retry can't lose again
+            if any(file_stat(p) != info["before"] for p, info in staged.items()):
+                for info in staged.values():
+                    os.remove(info["tmp"])
+                return flush(paths)
+
+            # Manifest first: on restart, a file whose hash matches was already replaced
+            manifest = read_manifest()
+            for path, info in staged.items():
+                entry = manifest.get(path, {})
+                manifest[path] = {
+                    **entry,
+                    "seq": info["seq"],
+                    "sha": info["sha"],
+                    "upserts": entry.get("upserts", 0) + info["upserts"]
+                }
+            write_atomic(MANIFEST_FILE, json.dumps(manifest))
+
+            for path, info in staged.items():
+                os.replace(info["tmp"], path)
+                _generation[path] = _generation.get(path, 0) + 1
+
+            done = {r["seq"] for r in batch}
+            write_journal([r for r in journal_records() if r["seq"] not in done])
+
+        return len(batch)
+
+
+def replace_file(path, df):
+    with exclusive():
+        tmp = f"{path}.{os.getpid()}.tmp"
+        df.to_csv(tmp, index=False)
+
+        # Counted in the manifest so content_version sees rewrites; seq stays the last flushed record
+        manifest = read_manifest()
+        entry = manifest.setdefault(path, {"seq": 0})
+        entry["rewrites"] = entry.get("rewrites", 0) + 1
+        entry["sha"] = file_sha(tmp)
+        write_atomic(MANIFEST_FILE, json.dumps(manifest))
+
+        os.replace(tmp, path)
+        _generation[path] = _generation.get(path, 0) + 1
+
+
+def rewrite(path, df):
+    # Full-file replacement for files written directly (derived data, config).
+    # Inside a locked block, that block must be rewriting(), not exclusive()
+    with _flush_lock:
+        flush([path])
+        replace_file(path, df)
+
+
+def transform(path, fn):
+    # Read-modify-write of the flushed file; records logged meanwhile stay pending
+    with rewriting():
+        flush([path])
+        replace_file(path, fn(pd.read_csv(path, dtype=str, keep_default_na=False)))
+
+
+def flush_loop():
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+
+        try:
+            flush()
+        except Exception:
+            logger.exception("Journal flush failed")
+
+
+# ---------------- RECOVERY ----------------
+def recover():
+    with exclusive():
+        records = journal_records()
+        manifest = read_manifest()
+
+        # A file counts as flushed up to its manifest seq only if it is exactly that file
+        flushed = {
+            path: entry["seq"] for path, entry in manifest.items()
+            if os.path.exists(path) and file_sha(path) == entry["sha"]
+        }
+
+        keep = [r for r in records if r["seq"] > flushed.get(r["file"], 0)]
+
+        if len(keep) != len(records):
+            write_journal(keep)
+
+    return flush()
+
+
+def claim_mode():
+    # A local-mode process writes without the file lock, so it must be alone on the data directory,
+    # and a shared-mode process must not run next to one
+    global _mode_lock
+
+    f = open(MODE_LOCK_FILE, "a")
+    mode = fcntl.LOCK_SH if STORAGE_MODE == "shared" else fcntl.LOCK_EX
+
+    try:
+        fcntl.flock(f.fileno(), mode | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise RuntimeError(
+            "Another process is using this data directory, and local storage mode allows only one. "
+            "Run the app, the scan service and the CLI with STORAGE_MODE=shared to use them together."
+        )
+
+    _mode_lock = f
+
+
+def start():
+    global _flusher
+
+    with _start_lock:
+        if _flusher is not None:
+            return
+
+        claim_mode()
+        recover()
+
+        _flusher = threading.Thread(target=flush_loop, name="journal-flusher", daemon=True)
+        _flusher.start()
+
+        atexit.register(flush)
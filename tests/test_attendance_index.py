@@ -0,0 +1,103 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import core
+import storage
+
+DAYS = ["2026-10-19", "2026-10-20"]
+
+
+def att(roll, day="2026-10-19", status="Present", teacher="raj"):
+    return {"Username": teacher, "Roll": roll, "Name": "a", "Date": day, "Status": status}
+
+
+def brute(teacher, day):
+    # Present rolls straight from the files, last row per (teacher, roll, date) winning
+    df = core.clean_rolls(core.read_attendance())
+    df = df[df["Username"].isin(core.index_owners(teacher))]
+    df = df.assign(Date=pd.to_datetime(df["Date"], errors="coerce").dt.strftime("%Y-%m-%d"))
+    df = df.drop_duplicates(["Username", "Roll", "Date"], keep="last")
+    return sorted(set(df[(df["Date"] == day) & (df["Status"] == "Present")]["Roll"]))
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "STORAGE_MODE", "local")
+    core.create_files()
+    storage.append_many(core.ATT_FILE, [att(f"12345-CSE-{i:03d}") for i in range(5)])
+
+    index = core.load_attendance_index()
+    refresh(index)
+    return index
+
+
+def refresh(index):
+    # Refreshes the index and returns the attendance files it had to read
+    reads = []
+
+    def counting(path, *args, **kwargs):
+        reads.append(path)
+        return storage.read(path, *args, **kwargs)
+
+    core.refresh_attendance_index(index, core.attendance_paths(), counting)
+
+    for day in DAYS:
+        assert sorted(core.bitset_rolls(index, core.day_bits(index, "raj", day))) == brute("raj", day)
+
+    return [path for path in reads if path != core.SESSIONS_FILE]
+
+
+def test_appends_and_flushes_read_only_what_changed(index):
+    assert refresh(index) == []
+
+    storage.append(core.ATT_FILE, att("12345-CSE-009", DAYS[1]))
+    assert refresh(index) == [core.ATT_FILE]
+
+    # A flush moves rows into the CSV without changing them
+    storage.flush()
+    assert refresh(index) == []
+
+
+def test_write_path_updates_need_no_reread(index):
+    key = {"Username": "raj", "Roll": "12345-CSE-001", "Date": DAYS[0]}
+    row = att("12345-CSE-001", status="Absent")
+
+    with storage.exclusive():
+        before = storage.content_version(core.ATT_FILE)
+        storage.upsert(core.ATT_FILE, key, row, ["Status"])
+        after = storage.content_version(core.ATT_FILE)
+
+    assert core.index_written(index, core.ATT_FILE, [row], before, after)
+    assert refresh(index) == []
+
+
+@pytest.mark.parametrize("update", ["upsert", "upsert_many"])
+def test_updates_made_elsewhere_reindex(index, update):
+    rows = [att("12345-CSE-002", status="Absent"), att("12345-CSE-003", status="Absent")]
+
+    if update == "upsert":
+        storage.upsert(core.ATT_FILE, {"Username": "raj", "Roll": "12345-CSE-002", "Date": DAYS[0]}, rows[0], ["Status"])
+    else:
+        storage.upsert_many(core.ATT_FILE, ["Username", "Roll", "Date"], rows, ["Status"])
+
+    storage.flush()
+    assert refresh(index) == [core.ATT_FILE]
+
+
+def test_new_shards_and_rewrites(index):
+    storage.append(core.SESSIONS_FILE, {"SessionID": "s1", "Username": "raj", "Class": "A", "Date": DAYS[1], "Created": 0})
+    storage.append(core.shard_file("s1"), core.scan_row("raj", "12345-CSE-009", "b", DAYS[1], "d", "t"))
+    assert refresh(index) == [core.shard_file("s1")]
+
+    # The saved index used by the CLI and the scan service catches up too
+    saved = core.sync_attendance_index()
+    assert core.bitset_rolls(saved, core.day_bits(saved, "raj", DAYS[1])) == ["12345-CSE-009"]
+
+    storage.rewrite(core.ATT_FILE, storage.read(core.ATT_FILE).iloc[:2])
+    assert refresh(index) == [core.ATT_FILE, core.shard_file("s1")]
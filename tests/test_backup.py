@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backup
+
+
+def chunks(data):
+    start, out = 0, []
+    for end in backup.chunk_ends(data):
+        out.append(data[start:end])
+        start = end
+    return out
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 18, 31, 32, 33, backup.CHUNK_MIN, backup.CHUNK_MAX, backup.CHUNK_MAX + 1])
+def test_chunks_cover_the_data_within_bounds(size):
+    data = np.random.default_rng(size).integers(0, 256, size, dtype=np.uint8).tobytes()
+    parts = chunks(data)
+
+    assert b"".join(parts) == data
+    assert all(0 < len(p) <= backup.CHUNK_MAX for p in parts)
+    assert all(len(p) >= backup.CHUNK_MIN for p in parts[:-1])
+
+
+def test_data_without_cut_points_is_cut_at_the_maximum():
+    data = bytes(3 * backup.CHUNK_MAX + 5)
+    assert [len(p) for p in chunks(data)] == [backup.CHUNK_MAX] * 3 + [5]
+
+
+def test_an_insert_only_changes_the_chunks_around_it():
+    data = np.random.default_rng(0).integers(0, 256, 2_000_000, dtype=np.uint8).tobytes()
+    edited = data[:1000] + b"inserted" + data[1000:]
+
+    before = set(chunks(data))
+    new = [p for p in chunks(edited) if p not in before]
+
+    assert len(new) <= 2
+
+
+def test_snapshot_restores_tiny_empty_and_chunked_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    files = {
+        "users.csv": b"Username,Password\n",
+        "empty.csv": b"",
+        "attendance.csv": b"".join(b"raj,12345-CSE-%05d,Asha,2026-10-19,Present\n" % i for i in range(20000)),
+    }
+    for path, data in files.items():
+        with open(path, "wb") as f:
+            f.write(data)
+
+    name = backup.snapshot()["name"]
+    assert backup.verify(name) == []
+
+    for path in files:
+        os.remove(path)
+    assert sorted(backup.restore(name)["restored"]) == sorted(files)
+
+    for path, data in files.items():
+        with open(path, "rb") as f:
+            assert f.read() == data
+
+    # Everything already matches: nothing is written again
+    assert backup.restore(name)["restored"] == []
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import core
+import storage
+
+
+def setup_data(path, monkeypatch):
+    monkeypatch.chdir(path)
+    monkeypatch.setattr(storage, "STORAGE_MODE", "local")
+    core.create_files()
+
+    for teacher in ["asha", "ravi"]:
+        for i in range(3):
+            storage.append(core.MARKS_FILE, {
+                "Username": teacher, "Roll": f"12345-CSE-00{i}", "Name": "S", "Subject": "Maths", "Marks": 50 + i
+            })
+        storage.append(core.SESSIONS_FILE, {
+            "SessionID": teacher, "Username": teacher, "Class": "A", "Date": "2026-10-19", "Created": 0
+        })
+
+
+def scopes(monkeypatch):
+    # Teachers each run re-extracted (None: all of them)
+    seen = []
+    extract = core.grade_inputs
+
+    def recording(teachers=None, read=storage.read):
+        seen.append(None if teachers is None else sorted(teachers))
+        return extract(teachers, read)
+
+    monkeypatch.setattr(core, "grade_inputs", recording)
+    return seen
+
+
+def from_scratch():
+    os.remove(core.GRADES_VERSION_FILE)
+    result, _ = core.compute_final_grades()
+    return result
+
+
+def test_only_teachers_with_changed_inputs_are_regraded(tmp_path, monkeypatch):
+    setup_data(tmp_path, monkeypatch)
+    seen = scopes(monkeypatch)
+
+    first, changed = core.compute_final_grades()
+    assert changed == 6
+
+    # Nothing changed: no extraction at all
+    again, changed = core.compute_final_grades()
+    assert changed == 0 and seen == [None]
+    pd.testing.assert_frame_equal(again, first, check_dtype=False)
+
+    # A scan in asha's session shard: only asha is re-extracted
+    storage.append(core.shard_file("asha"), core.scan_row("asha", "12345-CSE-001", "S", "2026-10-19", "d", "t"))
+    result, changed = core.compute_final_grades(["ravi"])
+    assert seen[-1] == ["asha"] and changed == 1
+    assert set(result["Username"]) == {"ravi"}
+
+    # A shared file changed outside any run: everyone in scope
+    storage.upsert(core.MARKS_FILE, {"Username": "ravi", "Roll": "12345-CSE-000", "Subject": "Maths"},
+                   {"Username": "ravi", "Roll": "12345-CSE-000", "Subject": "Maths", "Marks": 90}, ["Marks"])
+    storage.flush()
+    result, changed = core.compute_final_grades()
+    assert seen[-1] is None and changed == 1
+
+    pd.testing.assert_frame_equal(result, from_scratch(), check_dtype=False)
+
+
+def test_a_scoped_run_does_not_vouch_for_other_teachers(tmp_path, monkeypatch):
+    setup_data(tmp_path, monkeypatch)
+    seen = scopes(monkeypatch)
+
+    core.compute_final_grades(["asha"])
+    result, changed = core.compute_final_grades()
+
+    assert seen == [["asha"], None] and changed == 3
+    assert set(result["Username"]) == {"asha", "ravi"}
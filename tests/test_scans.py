@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import core
+import storage
+import scan_service
+
+
+def scan(roll, device_id, slot=None, session=None):
+    slot = core.current_slot() if slot is None else slot
+    return {
+        "roll": roll, "name": "Asha", "date": "2026-10-19", "device_id": device_id,
+        "token": core.qr_token(slot, session), "slot": slot, "session": session,
+        "teacher": "QR-STUDENT", "file": core.ATT_FILE if session is None else core.shard_file(session)
+    }
+
+
+def test_dedupe_applies_the_device_rule_only_to_known_devices():
+    seen = {"rolls": set(), "devices": {}}
+
+    assert core.dedupe_problem(seen, "12345-CSE-001", "", "2026-10-19") is None
+    assert core.dedupe_problem(seen, "12345-CSE-002", "", "2026-10-19") is None
+    assert core.dedupe_problem(seen, "12345-CSE-003", "phone", "2026-10-19") is None
+    assert core.dedupe_problem(seen, "12345-CSE-004", "phone", "2026-10-19")[0] == "error"
+    assert core.dedupe_problem(seen, "12345-CSE-001", "", "2026-10-19")[0] == "warning"
+
+
+def test_capture_accepts_students_whose_page_sent_no_device_id(tmp_path, monkeypatch):
+    # A capture laptop serves plain http, where older pages could not make a device id
+    monkeypatch.setitem(scan_service._capture, "path", str(tmp_path / "scans.jsonl"))
+    monkeypatch.setitem(scan_service._capture, "seen", None)
+
+    results = scan_service.capture([scan("12345-CSE-001", ""), scan("12345-CSE-002", ""), scan("12345-CSE-001", "")])
+
+    assert results[:2] == [None, None]
+    assert results[2][0] == "warning"
+
+
+def ingest_in(path, monkeypatch, *batches):
+    path.mkdir()
+    monkeypatch.chdir(path)
+    monkeypatch.setattr(storage, "STORAGE_MODE", "local")
+    monkeypatch.setitem(core._replay, "slots", {})
+    monkeypatch.setitem(core._replay, "seeded", set())
+    core.create_files()
+
+    return [scan_service.ingest(batch) for batch in batches]
+
+
+def test_ingest_result_does_not_depend_on_batching(tmp_path, monkeypatch):
+    now = core.current_slot()
+    first, second = scan("12345-CSE-001", "", now - 1), scan("12345-CSE-002", "", now)
+
+    (together,) = ingest_in(tmp_path / "one", monkeypatch, [first, second])
+    apart = ingest_in(tmp_path / "two", monkeypatch, [first], [second])
+
+    assert together == [None, None]
+    assert apart == [[None], [None]]
+    assert len(storage.read(core.ATT_FILE)) == 2
+
+
+def with_session(path, monkeypatch):
+    ingest_in(path, monkeypatch)
+    monkeypatch.setitem(scan_service._capture, "path", None)
+    storage.append(core.SESSIONS_FILE, {"SessionID": "s1", "Username": "asha", "Class": "A", "Date": "2026-10-19", "Created": 0})
+    return storage.read(core.SESSIONS_FILE, dtype=str)
+
+
+def test_a_class_qr_is_only_accepted_for_its_session_date(tmp_path, monkeypatch):
+    with_session(tmp_path / "data", monkeypatch)
+    fields = {"session": "s1", "token": core.generate_token("s1"), "roll": "12345-CSE-001", "name": "asha"}
+
+    scan, problem = scan_service.prepare({**fields, "date": "2026-10-19"})
+    assert problem is None and scan["teacher"] == "asha"
+
+    assert scan_service.prepare({**fields, "date": "2026-10-20"}) == (None, ("error", "Invalid QR Code"))
+
+
+def test_offline_records_are_checked_against_the_session_date(tmp_path, monkeypatch):
+    sessions = with_session(tmp_path / "data", monkeypatch)
+    records = [core.offline_record({**scan(roll, roll, session="s1"), "date": day})
+               for roll, day in [("12345-CSE-001", "2026-10-19"), ("12345-CSE-002", "2026-10-20")]]
+
+    problems = core.verify_offline(core.read_offline_batch(map(json.dumps, records)), "asha", sessions)
+
+    assert problems.isna().tolist() == [True, False]
+    assert problems[1] == "Invalid QR Code"
@@ -0,0 +1,123 @@
+import os
+import sys
+import multiprocessing
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+CONTEXT = multiprocessing.get_context("spawn")
+
+
+def worker(data_dir, name, rounds, results):
+    # One "server process": shared mode, its own journal cache, same directory
+    os.chdir(data_dir)
+    storage.STORAGE_MODE = "shared"
+
+    saved = 0
+    for i in range(rounds):
+        # Every worker tries to claim the same slot; only one may get it
+        row = {"Key": f"slot-{i}", "Owner": name}
+        if storage.append_if("claims.csv", row, lambda df: "taken" if (df["Key"] == row["Key"]).any() else None) is None:
+            saved += 1
+
+        storage.append("events.csv", {"Key": f"{name}-{i}", "Owner": name})
+
+        if i % 5 == 0:
+            storage.flush()
+
+    storage.flush()
+    results.put((name, saved))
+
+
+def command_worker(data_dir, commands, replies):
+    # Idle between commands, so its cached view of the journal can go stale
+    os.chdir(data_dir)
+    storage.STORAGE_MODE = "shared"
+
+    for command, args in iter(commands.get, None):
+        if command == "append":
+            storage.append(*args)
+        elif command == "flush":
+            storage.flush()
+        elif command == "read":
+            storage.read(*args)
+        replies.put(command)
+
+
+def make_files(path, *names):
+    for name in names:
+        pd.DataFrame(columns=["Key", "Owner"]).to_csv(path / name, index=False)
+
+
+def test_workers_share_one_data_directory(tmp_path):
+    make_files(tmp_path, "claims.csv", "events.csv")
+    results = CONTEXT.Queue()
+
+    workers = [CONTEXT.Process(target=worker, args=(str(tmp_path), f"w{n}", 20, results)) for n in range(4)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join(120)
+        assert p.exitcode == 0
+
+    saved = dict(results.get() for _ in workers)
+
+    claims = pd.read_csv(tmp_path / "claims.csv")
+    events = pd.read_csv(tmp_path / "events.csv")
+
+    # Each slot claimed exactly once, and every event written exactly once
+    assert sorted(claims["Key"]) == sorted(f"slot-{i}" for i in range(20))
+    assert sum(saved.values()) == 20
+    assert len(events) == 80
+    assert events["Key"].is_unique
+
+
+def test_idle_worker_sees_journal_rewritten_by_another(tmp_path):
+    # A worker that sat out two flushes must not trust its old journal offset:
+    # the replaced journal can reuse the inode, so only the header tells them apart
+    make_files(tmp_path, "a.csv", "b.csv")
+
+    queues = {}
+    workers = []
+    for name in ["idle", "busy"]:
+        commands, replies = CONTEXT.Queue(), CONTEXT.Queue()
+        p = CONTEXT.Process(target=command_worker, args=(str(tmp_path), commands, replies))
+        p.start()
+        queues[name] = (commands, replies)
+        workers.append(p)
+
+    def run(name, command, *args):
+        commands, replies = queues[name]
+        commands.put((command, args))
+        assert replies.get(timeout=60) == command
+
+    expected = {"a.csv": [], "b.csv": []}
+
+    def append(name, path, key):
+        run(name, "append", path, {"Key": key, "Owner": name})
+        expected[path].append(key)
+
+    try:
+        # ext4 hands the journal's old inode back after a few rewrites; try several counts
+        for i in range(12):
+            append("idle", "a.csv", f"r{i}-idle")
+            run("idle", "read", "a.csv")
+
+            for k in range(i % 4 + 1):
+                append("busy", "a.csv", f"r{i}-busy{k}")
+                run("busy", "flush")
+            append("busy", "b.csv", f"r{i}-busy")
+
+            append("idle", "b.csv", f"r{i}-idle")
+            run("idle", "flush")
+    finally:
+        for commands, _ in queues.values():
+            commands.put(None)
+        for p in workers:
+            p.join(60)
+
+    for path, keys in expected.items():
+        assert sorted(pd.read_csv(tmp_path / path)["Key"]) == sorted(keys)
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+
+def test_upsert_many_is_one_record_applied_as_upserts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "STORAGE_MODE", "local")
+    pd.DataFrame(columns=["Roll", "Date", "Status"]).to_csv("att.csv", index=False)
+    storage.append_many("att.csv", [{"Roll": r, "Date": "2026-10-19", "Status": "Present"} for r in ["001", "002"]])
+    before = storage.content_version("att.csv")
+
+    records = len(storage.journal_records())
+    storage.upsert_many("att.csv", ["Roll", "Date"], [
+        {"Roll": "002", "Date": "2026-10-19", "Status": "Absent"},
+        {"Roll": "003", "Date": "2026-10-19", "Status": "Absent"}
+    ], ["Status"])
+
+    assert len(storage.journal_records()) == records + 1
+    assert storage.content_version("att.csv")[2] == before[2] + 1
+
+    expected = [["001", "Present"], ["002", "Absent"], ["003", "Absent"]]
+    assert storage.read("att.csv", dtype=str)[["Roll", "Status"]].values.tolist() == expected
+
+    storage.flush()
+    assert storage.read("att.csv", dtype=str)[["Roll", "Status"]].values.tolist() == expected
+    assert storage.content_version("att.csv")[2] == before[2] + 1
@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import threading
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+
+def run_with_flush(save):
+    # save(started) signals once it holds the storage lock; a flush then starts staging
+    # before save goes on to rewrite a file
+    started, flushing = threading.Event(), threading.Event()
+
+    def flusher():
+        started.wait(10)
+        flushing.set()
+        storage.flush()
+
+    threads = [threading.Thread(target=save, args=(started, flushing), daemon=True),
+               threading.Thread(target=flusher, daemon=True)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    return not any(t.is_alive() for t in threads)
+
+
+def test_rewrite_inside_a_locked_save_does_not_wait_on_the_flusher(tmp_path, monkeypatch):
+    # The marks save: upsert a mark, then rewrite the sketches, as one locked step
+    monkeypatch.chdir(tmp_path)
+    pd.DataFrame(columns=["Roll", "Marks"]).to_csv("marks.csv", index=False)
+    storage.append("marks.csv", {"Roll": "12345-CSE-001", "Marks": 40})
+
+    def save(started, flushing):
+        with storage.rewriting():
+            storage.upsert("marks.csv", {"Roll": "12345-CSE-001"}, {"Roll": "12345-CSE-001", "Marks": 70}, ["Marks"])
+            started.set()
+            flushing.wait(10)
+            time.sleep(0.2)
+            storage.rewrite("sketches.csv", pd.DataFrame({"B70": [1]}))
+
+    assert run_with_flush(save)
+
+    storage.flush()
+    assert pd.read_csv("marks.csv")["Marks"].tolist() == [70]
+    assert pd.read_csv("sketches.csv")["B70"].tolist() == [1]